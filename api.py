@@ -1,10 +1,94 @@
 # file: api.py
-from fastapi import FastAPI
+import os, hmac, json, asyncio, time, tempfile
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from fastapi.responses import HTMLResponse
-from router import predict  # returns {"emotion": {...}, "intent": {...}}
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+import lazy
+import intent_index
+import intent_head
+import bulk
+import cascade
+import embeddings
+import memory_compact
+import metrics
+import partitions
+import response_cache
+import sessions
+from router import apredict, apredict_batch, apredict_keyed, astream_turn, warmup  # returns {"emotion": {...}, "intent": {...}}
+from batcher import MicroBatcher
+from llm_cache import get_cache as llm_cache
+from memory_writer import get_writer as memory_writer
 
-app = FastAPI(title="Emotion + Intent Detector")
+# coalesce concurrent /predict calls into router.apredict_batch (MB_MAX_BATCH / MB_MAX_WAIT_MS),
+# one batch per partition
+MICROBATCH = os.getenv("MICROBATCH", "1") == "1"
+_batcher = MicroBatcher(apredict_keyed)
+# /admin/* (reload, retrain, compact) needs "X-Admin-Token: <ADMIN_TOKEN>"; unset = admin routes off (404)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# turns of one /session connection being processed at once (the rest wait for a slot)
+SESSION_INFLIGHT = int(os.getenv("SESSION_INFLIGHT", "4"))
+
+# ---- /metrics gauges (computed at scrape time, never force a load) ----
+def _fallback_rate() -> float:
+    n = metrics.TEXTS.get()
+    llm = sum(metrics.INTENT_SOURCE.get(s) for s in ("gemini", "gemini_cache", "vector_db_timeout"))
+    return llm / n if n else 0.0
+
+def _cache_ratios() -> dict:
+    e = embeddings.cache_stats()
+    out = {'cache="embeddings"': e["hits"] / (e["hits"] + e["misses"]) if e["hits"] + e["misses"] else 0.0}
+    if lazy.peek("llm_cache") is not None:
+        out['cache="llm"'] = llm_cache().stats()["hit_ratio"]
+    if response_cache.ENABLED:
+        out['cache="response"'] = response_cache.get_cache().stats()["hit_ratio"]
+    return out
+
+def _sizes() -> dict:
+    out = {}
+    mem, idx = lazy.peek("memory"), lazy.peek("faiss_intent")
+    if mem is not None:
+        out['index="memory"'] = len(mem)
+    if idx is not None:
+        out['index="intent"'] = len(idx)
+    return out
+
+metrics.gauge("gemini_fallback_ratio", "Share of texts whose intent came from the LLM path (incl. its cache and timeouts).", _fallback_rate)
+metrics.gauge("cache_hit_ratio", "Hit ratio per cache.", _cache_ratios)
+metrics.gauge("index_rows", "Rows in the memory store and the intent index.", _sizes)
+metrics.gauge("model_load_seconds", "Load time per lazily loaded component.",
+              lambda: {f'component="{k}"': r["load_s"] for k, r in lazy.report().items() if r["load_s"] is not None})
+metrics.gauge("memory_writer_queue_depth", "Auto-store rows waiting for the background writer.",
+              lambda: memory_writer().stats()["queue_depth"])
+metrics.gauge("memory_writer_dropped_total", "Auto-store rows dropped because the writer queue was full.",
+              lambda: memory_writer().stats()["dropped"])
+metrics.gauge("partitions_resident_bytes", "Estimated memory held by loaded per-property indexes.",
+              lambda: partitions.get_cache().stats()["resident_bytes"])
+metrics.gauge("sessions_active", "Conversation sessions held in memory.",
+              lambda: sessions.get_store().stats()["sessions"])
+metrics.gauge("microbatch_queue_depth", "Requests waiting for the /predict micro-batcher.",
+              lambda: _batcher.stats()["queue_depth"])
+
+# WARMUP=0 skips eager loading (models then load on first request)
+WARMUP = os.getenv("WARMUP", "1") == "1"
+_startup = {"warmup_s": None}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP:
+        t0 = time.perf_counter()
+        report = await asyncio.to_thread(warmup)
+        _startup["warmup_s"] = time.perf_counter() - t0
+        for name, r in report.items():
+            print(f"startup: {name:<14} {r['load_s'] or 0:.2f}s" + (f"  ERROR {r['error']}" if r["error"] else ""))
+    yield
+    await _batcher.aclose()
+    # commit auto-stored rows still queued in the background writer
+    await asyncio.to_thread(memory_writer().close)
+
+app = FastAPI(title="Emotion + Intent Detector", lifespan=lifespan)
 
 class Pred(BaseModel):
     label: str
@@ -17,10 +101,190 @@ class Out(BaseModel):
 
 class In(BaseModel):
     text: str
+    partition: Optional[str] = None  # property key; memory and intent index of that property only
+
+class InBatch(BaseModel):
+    texts: List[str]
+    partition: Optional[str] = None
+
+def _partition(key: Optional[str]) -> Optional[str]:
+    try:
+        return partitions.check(key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/predict", response_model=Out)
-def _predict(inp: In):
-    return predict(inp.text)
+async def _predict(inp: In):
+    key = _partition(inp.partition)
+    if MICROBATCH:
+        return await _batcher.submit((key, inp.text))
+    with partitions.use(key):
+        return await apredict(inp.text)
+
+@app.post("/predict_batch", response_model=List[Out])
+async def _predict_batch(inp: InBatch):
+    with partitions.use(_partition(inp.partition)):
+        return await apredict_batch(inp.texts)
+
+@app.post("/predict_stream")
+async def _predict_stream(request: Request, format: str = "ndjson", text_field: str = bulk.TEXT_FIELD,
+                          chunk: int = bulk.CHUNK, store: bool = False, offset: int = 0,
+                          partition: Optional[str] = None):
+    # NDJSON/CSV body -> NDJSON response, one chunk at a time. The body is spooled to
+    # disk first (reading it while the response streams races Starlette's disconnect
+    # listener) and parsed once before the 200 goes out, so a bad body is a 400 rather
+    # than a cut-off stream; offset skips records already returned by an interrupted request.
+    key = _partition(partition)
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    if chunk < 1 or offset < 0:
+        raise HTTPException(status_code=400, detail="chunk must be >= 1 and offset >= 0")
+    fd, path = tempfile.mkstemp(suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for part in request.stream():
+                f.write(part)
+        await asyncio.to_thread(bulk.check_records, path, format, text_field)
+    except (ValueError, UnicodeDecodeError) as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        os.remove(path)
+        raise
+    records = bulk.aread_records(path, format, text_field, offset)
+    return StreamingResponse(bulk.astream(records, chunk, store, key), media_type="application/x-ndjson",
+                             background=BackgroundTask(os.remove, path))
+
+@app.websocket("/session/{session_id}")
+async def _session(ws: WebSocket, session_id: str, partition: Optional[str] = None):
+    # one conversation per connection: send {"text": ..., "ref": optional} per turn and get a
+    # "local" event, plus an "llm" event later when the intent needs the LLM (router.astream_turn).
+    # A bad message or a failed turn gets {"type": "error", "ref", "error"} instead.
+    # Reconnecting with the same id (and partition) resumes the context until the session idles out.
+    try:
+        key = partitions.check(partition)
+    except ValueError as e:
+        await ws.close(code=1008, reason=str(e))
+        return
+    if len(session_id) > 128:
+        await ws.close(code=1008, reason="session id too long")
+        return
+    await ws.accept()
+    send_lock = asyncio.Lock()
+    slots = asyncio.Semaphore(SESSION_INFLIGHT)
+    tasks: set = set()
+    closed = False
+
+    async def send(event: dict) -> None:
+        # events for a client that already left are dropped; the receive loop then cancels its turns
+        nonlocal closed
+        async with send_lock:
+            if closed:
+                return
+            try:
+                await ws.send_json(event)
+            except (WebSocketDisconnect, RuntimeError):  # RuntimeError: send after close
+                closed = True
+
+    async def turn(text: str, ref) -> None:
+        async def emit(event: dict) -> None:
+            await send({**event, "ref": ref} if ref is not None else event)
+        try:
+            with partitions.use(key):
+                await astream_turn(text, sessions.get_store().get(session_id, key), emit)
+        except Exception as e:
+            print("Session error:", repr(e))
+            await send({"type": "error", "ref": ref, "final": True, "error": repr(e)})
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            try:
+                msg = json.loads(await ws.receive_text())
+            except ValueError:
+                msg = None
+            if not isinstance(msg, dict) or not isinstance(msg.get("text"), str):
+                await send({"type": "error", "ref": msg.get("ref") if isinstance(msg, dict) else None, "final": True,
+                            "error": 'expected {"text": str, "ref": optional}'})
+                continue
+            await slots.acquire()
+            t = asyncio.create_task(turn(msg["text"], msg.get("ref")))
+            tasks.add(t)
+            t.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for t in tasks:
+            t.cancel()
+
+@app.get("/ready")
+def _ready():
+    body = {"ready": lazy.all_loaded(), "warmup_s": _startup["warmup_s"], "components": lazy.report()}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+def _admin(x_admin_token: str = Header(default="")) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+admin = APIRouter(prefix="/admin", dependencies=[Depends(_admin)])
+
+@admin.post("/intent_index/reload")
+def _reload_intent_index(partition: Optional[str] = None):
+    # swap in the store written by vector_db_intent.py without restarting workers
+    return {"rows": len(intent_index.reload(partition=_partition(partition)))}
+
+@admin.post("/intent_head/retrain")
+async def _retrain_intent_head():
+    # refit on the dataset + current memory and swap the new weights in
+    return await asyncio.to_thread(intent_head.train)
+
+@admin.post("/memory/compact")
+async def _compact_memory(dry_run: bool = False, partition: Optional[str] = None):
+    # dedup / prototypes / caps per MEM_COMPACT_* and MEM_MAX_*; readers keep serving meanwhile
+    with partitions.use(_partition(partition)):
+        return await asyncio.to_thread(memory_compact.compact, dry_run=dry_run)
+
+app.include_router(admin)
+
+@app.get("/stats/batcher")
+def _batcher_stats():
+    return _batcher.stats()
+
+@app.get("/stats/llm_cache")
+def _llm_cache_stats():
+    return llm_cache().stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def _metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+def _traces(limit: int = 50):
+    # sampled per-request spans (TRACE_SAMPLE > 0)
+    return metrics.recent_traces(limit)
+
+@app.get("/stats/cascade")
+def _cascade_stats():
+    return cascade.get_stats().stats()
+
+@app.get("/stats/response_cache")
+def _response_cache_stats():
+    return response_cache.get_cache().stats()
+
+@app.get("/stats/partitions")
+def _partition_stats():
+    return partitions.get_cache().stats()
+
+@app.get("/stats/sessions")
+def _session_stats():
+    return sessions.get_store().stats()
+
+@app.get("/stats/memory_writer")
+def _memory_writer_stats():
+    return memory_writer().stats()
 
 # ---------- Minimal UI ----------
 @app.get("/", response_class=HTMLResponse)
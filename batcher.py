@@ -0,0 +1,128 @@
+# file: batcher.py
+import asyncio, os
+from typing import Any, Callable, Dict, List, Optional
+
+MAX_BATCH = int(os.getenv("MB_MAX_BATCH", "32"))
+MAX_WAIT_MS = float(os.getenv("MB_MAX_WAIT_MS", "5"))
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item calls into one batch_fn(list) -> list call.
+    After the first queued item it waits at most max_wait_ms (or until max_batch
+    items) before running the batch. batch_fn runs in a worker thread so the event
+    loop keeps accepting requests; items arriving meanwhile form the next batch.
+    An async batch_fn is awaited as its own task, so batches waiting on I/O (the
+    Gemini fallback) overlap instead of holding up the next window.
+    """
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._tasks: set = set()    # running async dispatches (the loop only keeps weak references)
+        self._pending: set = set()  # futures of submitted items not yet answered
+        # metrics
+        self.batches = 0
+        self.items = 0
+        self.in_flight = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.size_hist: Dict[int, int] = {}
+
+    async def submit(self, item: Any) -> Any:
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.add(fut)
+        fut.add_done_callback(self._pending.discard)
+        await self._queue.put((item, fut))
+        return await fut
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        is_async = asyncio.iscoroutinefunction(self.batch_fn)
+        while True:
+            batch = await self._collect()
+            self._record(len(batch))
+            if is_async:
+                t = asyncio.get_running_loop().create_task(self._dispatch(batch))
+                self._tasks.add(t)
+                t.add_done_callback(self._tasks.discard)
+            else:
+                await self._dispatch(batch)
+
+    async def _dispatch(self, batch: list) -> None:
+        self.in_flight += len(batch)
+        items = [x for x, _ in batch]
+        try:
+            if asyncio.iscoroutinefunction(self.batch_fn):
+                results = await self.batch_fn(items)
+            else:
+                results = await asyncio.to_thread(self.batch_fn, items)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self.in_flight -= len(batch)
+        results = list(results)
+        if len(results) != len(batch):
+            e = RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():  # caller may have disconnected
+                fut.set_result(res)
+
+    def _record(self, n: int) -> None:
+        self.batches += 1
+        self.items += n
+        self.last_batch_size = n
+        self.max_batch_size = max(self.max_batch_size, n)
+        self.size_hist[n] = self.size_hist.get(n, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "in_flight": self.in_flight,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "batch_size_hist": dict(sorted(self.size_hist.items())),
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+    async def aclose(self) -> None:
+        """Stop collecting, let batches already dispatched finish, and fail every item still waiting."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for fut in list(self._pending):
+            if not fut.done():
+                fut.set_exception(RuntimeError("micro-batcher closed"))
+        self._queue = None
@@ -0,0 +1,236 @@
+# file: bench.py
+"""
+Offline latency/throughput benchmark for the router pipeline.
+
+Uses the bundled intent_dataset_450.csv and memory.jsonl (copied to a temp file,
+so auto-store never touches the real memory), replaces Gemini with a stub that
+sleeps --llm-ms, and writes a JSON report that can be diffed between versions.
+
+  python bench.py --out bench_report.json
+  python bench.py --mem-sizes 1000,100000,1000000 --concurrency 1,4,16 --batch-sizes 1,8,32,128
+"""
+import os, json, time, shutil, tempfile, argparse, platform, subprocess, asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+def _percentiles(ms: list) -> dict:
+    import numpy as np
+    a = np.asarray(ms, dtype=np.float64)
+    if not len(a):
+        return {}
+    return {"n": int(len(a)), "mean_ms": float(a.mean()), "p50_ms": float(np.percentile(a, 50)),
+            "p95_ms": float(np.percentile(a, 95)), "p99_ms": float(np.percentile(a, 99)),
+            "max_ms": float(a.max())}
+
+def _timed(fn, *a, **kw):
+    t0 = time.perf_counter()
+    r = fn(*a, **kw)
+    return r, (time.perf_counter() - t0) * 1000.0
+
+def _setup_env(tmp: str) -> None:
+    # must run before importing router: isolate memory, disable caches that would hide model cost
+    mem = os.path.join(tmp, "memory.jsonl")
+    if os.path.exists("memory.jsonl"):
+        shutil.copy("memory.jsonl", mem)
+    os.environ["MEMORY_FILE"] = mem
+    os.environ.setdefault("EMB_CACHE_SIZE", "0")
+    os.environ.setdefault("LLM_CACHE", "0")
+    os.environ.setdefault("RESP_CACHE", "0")
+    os.environ.setdefault("MEM_AUTO_STORE", "1")
+
+def _stub_llm(llm_ms: float) -> None:
+    """Replace the Gemini chain with a local runnable that sleeps llm_ms and answers service_request."""
+    from langchain_core.runnables import RunnableLambda
+    import lc_gemini_intent
+
+    def _answer(_inp):
+        time.sleep(llm_ms / 1000.0)
+        return lc_gemini_intent.IntentPred(intent="service_request", confidence=0.9)
+
+    async def _aanswer(_inp):
+        await asyncio.sleep(llm_ms / 1000.0)
+        return lc_gemini_intent.IntentPred(intent="service_request", confidence=0.9)
+
+    lc_gemini_intent._chain.override(RunnableLambda(_answer, afunc=_aanswer))
+
+def _load_texts(path: str) -> list:
+    import pandas as pd
+    return pd.read_csv(path)["text"].astype(str).tolist()
+
+# ---- sections ----
+def bench_stages(texts: list) -> dict:
+    """Per-stage single-item latency, each stage timed in isolation."""
+    import embeddings, memory_store, router, cascade
+    from hf_baseline import predict_with_hf
+    from vector_infer_intent import predict_intent_knn
+    from free_metadata import tag_text_free
+    from router import predict, _llm_intents
+    from memory_writer import get_writer
+
+    t = {k: [] for k in ("embed", "hf_emotion", "memory_knn", "faiss_knn", "llm_fallback",
+                         "metadata", "auto_store", "auto_store_enqueue", "end_to_end")}
+    for text in texts:
+        (raw, unit), ms = _timed(embeddings.embed, text); t["embed"].append(ms)
+        _, ms = _timed(predict_with_hf, text); t["hf_emotion"].append(ms)
+        _, ms = _timed(memory_store.label_dist, text, "emotion", 5, unit); t["memory_knn"].append(ms)
+        (label, _, _, dist), ms = _timed(predict_intent_knn, text, 1, raw); t["faiss_knn"].append(ms)
+        if dist > router.THRESHOLD:
+            _, ms = _timed(_llm_intents, [text], [unit], [(label, 0.0, "vector_db")]); t["llm_fallback"].append(ms)
+        _, ms = _timed(tag_text_free, text, "other"); t["metadata"].append(ms)
+        _, ms = _timed(memory_store.add_example, text, "joy", "service_request", {}, unit); t["auto_store"].append(ms)
+        row = {"text": text, "emotion": "joy", "intent": "service_request", "tags": {}, "emb": unit}
+        _, ms = _timed(get_writer().submit, [row]); t["auto_store_enqueue"].append(ms)
+        _, ms = _timed(predict, text); t["end_to_end"].append(ms)
+    get_writer().flush()
+    out = {k: _percentiles(v) for k, v in t.items()}
+    out["cascade"] = cascade.get_stats().stats()
+    out["memory_writer"] = get_writer().stats()
+    out["llm_fallback_rate"] = len(t["llm_fallback"]) / max(len(texts), 1)
+    return out
+
+def bench_concurrency(texts: list, levels: list) -> dict:
+    """Throughput of router.predict from c threads, and of the async micro-batched path."""
+    from router import predict, apredict_batch
+    from batcher import MicroBatcher
+
+    out = {"threads": {}, "microbatch": {}}
+    for c in levels:
+        lat = []
+        def one(text):
+            _, ms = _timed(predict, text)
+            lat.append(ms)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=c) as ex:
+            list(ex.map(one, texts))
+        wall = time.perf_counter() - t0
+        out["threads"][str(c)] = {"texts_per_s": len(texts) / wall, **_percentiles(lat)}
+
+        async def run():
+            mb = MicroBatcher(apredict_batch)
+            sem = asyncio.Semaphore(c)
+            lat_a = []
+            async def one_a(text):
+                async with sem:
+                    t1 = time.perf_counter()
+                    await mb.submit(text)
+                    lat_a.append((time.perf_counter() - t1) * 1000.0)
+            t1 = time.perf_counter()
+            await asyncio.gather(*[one_a(x) for x in texts])
+            wall_a = time.perf_counter() - t1
+            stats = mb.stats()
+            await mb.aclose()
+            return {"texts_per_s": len(texts) / wall_a, "avg_batch_size": stats["avg_batch_size"],
+                    **_percentiles(lat_a)}
+        out["microbatch"][str(c)] = asyncio.run(run())
+    return out
+
+def bench_hf_batch(texts: list, sizes: list) -> dict:
+    """probs_emotion_batch over all texts at each HF_BATCH_SIZE (1 = the old one-text-per-pass behaviour)."""
+    import hf_baseline
+    out, keep = {}, hf_baseline.HF_BATCH_SIZE
+    try:
+        for b in sizes:
+            hf_baseline.HF_BATCH_SIZE = b
+            hf_baseline.probs_emotion_batch(texts[:b])  # warm
+            _, ms = _timed(hf_baseline.probs_emotion_batch, texts)
+            out[str(b)] = {"texts_per_s": len(texts) / (ms / 1000.0), "ms_total": ms}
+    finally:
+        hf_baseline.HF_BATCH_SIZE = keep
+    return out
+
+def bench_batches(texts: list, sizes: list) -> dict:
+    from router import predict_batch
+    out = {}
+    for b in sizes:
+        t0 = time.perf_counter()
+        for s in range(0, len(texts), b):
+            predict_batch(texts[s:s + b])
+        wall = time.perf_counter() - t0
+        out[str(b)] = {"texts_per_s": len(texts) / wall, "ms_per_batch": wall * 1000.0 / -(-len(texts) // b)}
+    return out
+
+def _synthetic_index(n: int, d: int, tmp: str):
+    """A resident memory index holding n random unit rows, pinned to an empty file so refresh() is a no-op."""
+    import numpy as np
+    import memory_store
+    path = os.path.join(tmp, f"synthetic_{n}.jsonl")
+    open(path, "w").close()
+    idx = memory_store._MemoryIndex(path)
+    rng = np.random.default_rng(0)
+    M = rng.standard_normal((n, d), dtype=np.float32)
+    M /= np.linalg.norm(M, axis=1, keepdims=True)
+    emos, ints = ["joy", "anger", "sadness", "neutral"], ["service_request", "hotel_info", "booking"]
+    # the in-memory ingest path, so every per-row list (labels, meta, weights) stays aligned
+    idx._append([{"text": f"row {i}", "emotion": emos[i % len(emos)], "intent": ints[i % len(ints)], "tags": {},
+                  "added_at": "", "emb": M[i]} for i in range(n)])
+    st = os.stat(path)
+    idx._sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+    return idx
+
+def bench_memory_scaling(texts: list, sizes: list, tmp: str, queries: int = 50) -> dict:
+    import memory_store, embeddings
+    raw, unit = embeddings.embed_batch(texts[:queries])
+    saved = memory_store._index.get()
+    out = {}
+    try:
+        for n in sizes:
+            memory_store._index.override(_synthetic_index(n, unit.shape[1], tmp))
+            lat = [_timed(memory_store.label_dist, texts[i], "emotion", 5, unit[i])[1] for i in range(len(unit))]
+            _, batch_ms = _timed(memory_store.label_dist_batch, texts[:queries], "emotion", 5, unit)
+            out[str(n)] = {"single": _percentiles(lat), "batch_ms_per_query": batch_ms / len(unit)}
+            memory_store._index.override(None)
+    finally:
+        memory_store._index.override(saved)
+    return out
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+def main(argv=None) -> dict:
+    ap = argparse.ArgumentParser(description="Offline benchmark for router.predict")
+    ap.add_argument("--data", default="intent_dataset_450.csv")
+    ap.add_argument("--n", type=int, default=200, help="texts used for stage/concurrency runs")
+    ap.add_argument("--llm-ms", type=float, default=300.0, help="stub Gemini latency")
+    ap.add_argument("--concurrency", default="1,4,16")
+    ap.add_argument("--batch-sizes", default="1,8,32,128")
+    ap.add_argument("--mem-sizes", default="1000,100000,1000000")
+    ap.add_argument("--skip", default="", help="comma list of sections to skip: stages,concurrency,hf_batch,batches,memory")
+    ap.add_argument("--out", default="bench_report.json")
+    args = ap.parse_args(argv)
+    skip = set(filter(None, args.skip.split(",")))
+
+    tmp = tempfile.mkdtemp(prefix="bench_")
+    _setup_env(tmp)
+    import router
+    _stub_llm(args.llm_ms)
+    warm = router.warmup()
+    texts = _load_texts(args.data)[:args.n]
+
+    report = {
+        "meta": {"git": _git_rev(), "python": platform.python_version(), "machine": platform.machine(),
+                 "cpus": os.cpu_count(), "infer_backend": os.getenv("INFER_BACKEND", "torch"),
+                 "cascade": os.getenv("CASCADE", "0") == "1",
+                 "n_texts": len(texts), "llm_stub_ms": args.llm_ms, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "startup": warm,
+    }
+    if "stages" not in skip:
+        report["stages"] = bench_stages(texts)
+    if "concurrency" not in skip:
+        report["concurrency"] = bench_concurrency(texts, [int(c) for c in args.concurrency.split(",")])
+    if "hf_batch" not in skip:
+        report["hf_batch"] = bench_hf_batch(texts, [int(b) for b in args.batch_sizes.split(",")])
+    if "batches" not in skip:
+        report["batches"] = bench_batches(texts, [int(b) for b in args.batch_sizes.split(",")])
+    if "memory" not in skip:
+        report["memory_scaling"] = bench_memory_scaling(texts, [int(m) for m in args.mem_sizes.split(",")], tmp)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    shutil.rmtree(tmp, ignore_errors=True)
+    print(f"wrote {args.out}")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# file: bulk.py
+"""
+Streaming bulk classification for back-fills.
+
+  python bulk.py messages.ndjson -o labels.ndjson --workers 4
+  python bulk.py messages.csv -o labels.ndjson --text-field body --store
+
+Input (NDJSON objects or CSV rows with a text field) is read lazily and cut into
+chunks; each chunk goes through router.predict_batch in a process pool whose
+workers load the models once. Results are written in input order as NDJSON
+({...input fields, "offset", "emotion", "intent", "tags"}), with at most
+2 x workers chunks in flight. After every chunk a checkpoint (<out>.ckpt)
+records the next input offset and the output size, so a rerun resumes where
+the previous one stopped. A chunk that fails is retried record by record, and
+records that still fail are written with an "error" field instead of labels, so
+one bad record cannot stall a run or its resumes. Auto-store is off unless
+--store is given.
+"""
+import os, sys, csv, json, time, argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from serve import pin_threads, thread_env
+import partitions
+
+# ---- config ----
+CHUNK = int(os.getenv("BULK_CHUNK", "256"))
+WORKERS = int(os.getenv("BULK_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+TEXT_FIELD = os.getenv("BULK_TEXT_FIELD", "text")
+
+# ---- input ----
+def read_records(path: str, fmt: Optional[str] = None, text_field: str = TEXT_FIELD,
+                 start: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yield (offset, record) lazily from an NDJSON or CSV file, skipping the first start records."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            rows: Iterable = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for i, rec in enumerate(rows):
+            if i < start:
+                continue
+            if text_field != "text":
+                rec["text"] = rec.pop(text_field)
+            yield i, rec
+
+def check_records(path: str, fmt: str, text_field: str = TEXT_FIELD) -> int:
+    """Parse the whole file once; raises ValueError naming the first bad record, else returns the record count."""
+    n = 0
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            if text_field not in (reader.fieldnames or []):
+                raise ValueError(f"CSV header has no {text_field!r} column")
+            for n, _ in enumerate(reader, 1):
+                pass
+            return n
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {lineno}: invalid JSON ({e.msg})")
+            if not isinstance(rec, dict) or text_field not in rec:
+                raise ValueError(f"line {lineno}: expected an object with a {text_field!r} field")
+            n += 1
+    return n
+
+def chunked(it: Iterable, size: int) -> Iterator[list]:
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+def _encode(offsets: List[int], recs: List[Dict[str, Any]], outs: list) -> str:
+    return "".join(json.dumps({**r, "offset": i, **o}, ensure_ascii=False) + "\n"
+                   for i, r, o in zip(offsets, recs, outs))
+
+# ---- worker side ----
+_store = False
+_partition = None
+
+def _init_worker(store: bool, threads: int, partition: Optional[str] = None) -> None:
+    """Runs once per pool process: pin intra-op threads, then load every model."""
+    global _store, _partition
+    _store, _partition = store, partition
+    thread_env(threads)
+    import router
+    # pool processes exit without running atexit hooks, so write auto-stored rows inline
+    router.ASYNC_WRITES = False
+    router.warmup()
+    pin_threads(threads)
+
+def _one(text: str) -> Dict[str, Any]:
+    from router import predict_batch
+    try:
+        return predict_batch([text], store=_store)[0]
+    except Exception as e:
+        print("Bulk record error:", repr(e))
+        return {"error": repr(e)}
+
+def _work(chunk: List[Tuple[int, Dict[str, Any]]]) -> Tuple[int, str]:
+    # predict_batch bounds its Gemini fallback by GEMINI_TIMEOUT_S, so a chunk cannot hang
+    from router import predict_batch
+    offsets = [i for i, _ in chunk]
+    recs = [r for _, r in chunk]
+    texts = [str(r.get("text", "")) for r in recs]
+    with partitions.use(_partition):
+        try:
+            outs = predict_batch(texts, store=_store)
+        except Exception as e:
+            print("Bulk chunk error:", repr(e))
+            outs = [_one(t) for t in texts]
+    return len(chunk), _encode(offsets, recs, outs)
+
+# ---- checkpoint ----
+def _load_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"offset": 0, "out_bytes": 0}
+
+def _save_checkpoint(path: str, ckpt: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ckpt, f)
+    os.replace(tmp, path)
+
+# ---- driver ----
+def run(inp: str, out: str, fmt: Optional[str] = None, text_field: str = TEXT_FIELD,
+        chunk: int = CHUNK, workers: int = WORKERS, store: bool = False,
+        checkpoint: Optional[str] = None, resume: bool = True, partition: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Classify every record of inp into out (against partition's memory and intent
+    index, if given). workers=0 runs in this process (no pool).
+    Returns {"processed", "offset", "seconds", "texts_per_s"}.
+    """
+    checkpoint = checkpoint or out + ".ckpt"
+    partition = partitions.check(partition)
+    ckpt = _load_checkpoint(checkpoint) if resume else {"offset": 0, "out_bytes": 0}
+    start = int(ckpt["offset"])
+    # drop output written after the last checkpoint (a crash mid-chunk)
+    with open(out, "ab") as f:
+        f.truncate(int(ckpt["out_bytes"]))
+
+    threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+    records = read_records(inp, fmt, text_field, start)
+    done, t0 = 0, time.perf_counter()
+
+    with open(out, "ab") as fout:
+        def emit(n: int, lines: str) -> None:
+            nonlocal done
+            fout.write(lines.encode("utf-8"))
+            fout.flush()
+            done += n
+            _save_checkpoint(checkpoint, {"offset": start + done, "out_bytes": fout.tell(), "input": inp})
+
+        if workers <= 0:
+            _init_worker(store, threads, partition)
+            for c in chunked(records, chunk):
+                emit(*_work(c))
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(store, threads, partition)) as ex:
+                pending: deque = deque()
+                for c in chunked(records, chunk):
+                    pending.append(ex.submit(_work, c))
+                    if len(pending) >= 2 * workers:  # bounded: oldest chunk must finish first
+                        emit(*pending.popleft().result())
+                while pending:
+                    emit(*pending.popleft().result())
+
+    secs = time.perf_counter() - t0
+    return {"processed": done, "offset": start + done, "seconds": secs,
+            "texts_per_s": done / secs if secs else 0.0}
+
+# ---- streaming (used by /predict_stream) ----
+async def aread_records(path: str, fmt: Optional[str] = None, text_field: str = TEXT_FIELD,
+                        start: int = 0) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    for item in read_records(path, fmt, text_field, start):
+        yield item
+
+async def astream(records: AsyncIterator[Tuple[int, Dict[str, Any]]], chunk: int = CHUNK,
+                  store: bool = False, partition: Optional[str] = None) -> AsyncIterator[str]:
+    """Classify (offset, record) pairs chunk by chunk in this process, yielding NDJSON text per chunk."""
+    from router import apredict_batch
+    buf: List[Tuple[int, Dict[str, Any]]] = []
+
+    async def flush() -> str:
+        recs = [r for _, r in buf]
+        # set per chunk: a context variable must not stay set across the generator's yields
+        with partitions.use(partition):
+            outs = await apredict_batch([str(r["text"]) for r in recs], store=store)
+        return _encode([i for i, _ in buf], recs, outs)
+
+    async for item in records:
+        buf.append(item)
+        if len(buf) >= chunk:
+            yield await flush()
+            buf = []
+    if buf:
+        yield await flush()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Bulk emotion/intent/tags labelling (NDJSON or CSV in, NDJSON out)")
+    ap.add_argument("input")
+    ap.add_argument("-o", "--output", required=True)
+    ap.add_argument("--format", choices=["ndjson", "csv"], default=None, help="default: from the file extension")
+    ap.add_argument("--text-field", default=TEXT_FIELD)
+    ap.add_argument("--chunk", type=int, default=CHUNK)
+    ap.add_argument("--workers", type=int, default=WORKERS, help="0 = run in this process")
+    ap.add_argument("--store", action="store_true", help="auto-store confident predictions into memory")
+    ap.add_argument("--checkpoint", default=None, help="default: <output>.ckpt")
+    ap.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    ap.add_argument("--partition", default=None, help="property key (see partitions.py)")
+    args = ap.parse_args()
+    rep = run(args.input, args.output, args.format, args.text_field, args.chunk,
+              args.workers, args.store, args.checkpoint, resume=not args.restart, partition=args.partition)
+    print(json.dumps(rep), file=sys.stderr)
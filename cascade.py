@@ -0,0 +1,109 @@
+# file: cascade.py
+import os, math, threading
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# ---- config ----
+# "1": confidence-gated cascade (memory -> HF -> intent head -> intent kNN -> LLM); "0" (default): every
+# stage for every text, as before the cascade existed. Opt in once tune.py has been run on your data.
+ENABLED = os.getenv("CASCADE", "0") == "1"
+INTENT_K = int(os.getenv("CASCADE_INTENT_K", "5"))           # dataset neighbours used for the intent vote
+VOTE_TEMP = float(os.getenv("CASCADE_VOTE_TEMP", "0.2"))     # neighbour weight exp(-(d - d_best) / VOTE_TEMP)
+DIST_TEMP = float(os.getenv("CASCADE_DIST_TEMP", "0.1"))     # softness of the distance gate around THRESHOLD
+INTENT_MIN = float(os.getenv("CASCADE_INTENT_MIN", "0.5"))   # calibrated intent confidence below this -> LLM
+MEM_SIM = float(os.getenv("CASCADE_MEM_SIM", "0.95"))        # nearest memory row at least this close (cosine) ...
+MEM_AGREE = float(os.getenv("CASCADE_MEM_AGREE", "0.8"))     # ... and this share of its k neighbours agreeing
+MEM_MIN_K = float(os.getenv("CASCADE_MEM_MIN_K", "3"))       # ... out of at least this many neighbour votes
+
+def calibrate_intent(labels: Sequence[str], dists: Sequence[float], threshold: float) -> Tuple[str, float]:
+    """
+    Weighted k-neighbour vote -> (label, confidence). Confidence is the distance
+    gate of the winning label's closest neighbour (a logistic centred on
+    threshold) scaled by the vote margin: (0.5 + 0.5 * (p_top - p_second)).
+    A unanimous vote falls below 0.5 exactly when that distance exceeds
+    threshold, i.e. the old hard rule; split votes escalate earlier.
+    """
+    d = [float(x) for x in dists[:len(labels)]]
+    best = min(d)
+    votes: Dict[str, float] = {}
+    closest: Dict[str, float] = {}
+    for lab, x in zip(labels, d):
+        votes[lab] = votes.get(lab, 0.0) + math.exp(-(x - best) / VOTE_TEMP)
+        closest[lab] = min(closest.get(lab, x), x)
+    total = sum(votes.values())
+    ranked = sorted(votes, key=votes.get, reverse=True)
+    top = ranked[0]
+    margin = (votes[top] - (votes[ranked[1]] if len(ranked) > 1 else 0.0)) / total
+    z = (threshold - closest[top]) / DIST_TEMP
+    gate = 1.0 / (1.0 + math.exp(-max(min(z, 50.0), -50.0)))
+    return top, gate * (0.5 + 0.5 * margin)
+
+def memory_label(dist: Dict[str, float], sim: float, n: float) -> Optional[Tuple[str, float]]:
+    """
+    (label, confidence) when a near-exact memory hit with strong agreement decides
+    the task, else None. dist is normalised, so n (the neighbour votes behind it)
+    must reach MEM_MIN_K: one stored row alone would otherwise agree 100%.
+    """
+    if sim < MEM_SIM or not dist or n < MEM_MIN_K:
+        return None
+    label = max(dist, key=dist.get)
+    if dist[label] < MEM_AGREE:
+        return None
+    return label, dist[label] * sim
+
+class CascadeStats:
+    """
+    Per-stage counters: how many texts reached each stage (escalation rate), the
+    measured cost per text of stages that ran, and the estimated time saved by the
+    texts that skipped them.
+    """
+    STAGES = ("memory", "hf_emotion", "intent_head", "intent_knn", "llm")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.ran = {s: 0 for s in self.STAGES}
+        self.ms = {s: 0.0 for s in self.STAGES}
+        self.mem_emotion = 0       # emotion decided by memory (HF skipped)
+        self.mem_intent = 0        # intent decided by memory (kNN + LLM skipped)
+        self.legacy_llm = 0        # texts the old hard threshold would have sent to the LLM
+
+    def texts_seen(self, n: int) -> None:
+        with self._lock:
+            self.texts += n
+
+    def record(self, stage: str, n: int, ms: float) -> None:
+        with self._lock:
+            self.ran[stage] += n
+            self.ms[stage] += ms
+
+    def shortcut(self, emotion: int, intent: int, legacy_llm: int = 0) -> None:
+        with self._lock:
+            self.mem_emotion += emotion
+            self.mem_intent += intent
+            self.legacy_llm += legacy_llm
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self.texts or 1
+            per = {s: self.ms[s] / self.ran[s] if self.ran[s] else 0.0 for s in self.STAGES}
+            skipped_hf = self.texts - self.ran["hf_emotion"]
+            skipped_knn = self.texts - self.ran["intent_knn"]
+            return {
+                "enabled": ENABLED,
+                "texts": self.texts,
+                "escalation_rate": {s: self.ran[s] / n for s in self.STAGES},
+                "ms_per_text": per,
+                "memory_shortcut": {"emotion": self.mem_emotion, "intent": self.mem_intent},
+                "llm_calls": self.ran["llm"],
+                "llm_calls_legacy_threshold": self.legacy_llm,
+                "saved_ms_est": {
+                    "hf_emotion": skipped_hf * per["hf_emotion"],
+                    "intent_knn": skipped_knn * per["intent_knn"],
+                    "llm": max(self.legacy_llm - self.ran["llm"], 0) * per["llm"],
+                },
+            }
+
+_stats = CascadeStats()
+
+def get_stats() -> CascadeStats:
+    return _stats
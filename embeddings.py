@@ -0,0 +1,84 @@
+# file: embeddings.py
+import os, threading
+from collections import OrderedDict
+from typing import List, Tuple
+import numpy as np
+from lazy import Lazy
+
+# one MiniLM shared by memory_store, vector_infer_intent and the auto-store path
+EMB_MODEL_NAME = os.getenv("MEM_EMB_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+INFER_BACKEND = os.getenv("INFER_BACKEND", "torch")  # "torch" | "onnx" (int8 ONNX Runtime, see onnx_backend.py)
+CACHE_SIZE = int(os.getenv("EMB_CACHE_SIZE", "4096"))
+
+def _load_model():
+    if INFER_BACKEND == "onnx":
+        from onnx_backend import OrtSentenceEncoder
+        return OrtSentenceEncoder(EMB_MODEL_NAME)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMB_MODEL_NAME)
+
+_model = Lazy("minilm", _load_model)
+
+def get_model():
+    return _model.get()
+
+def __getattr__(name):
+    # embeddings.model keeps working but only loads on first access
+    if name == "model":
+        return _model.get()
+    raise AttributeError(name)
+
+_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+def norm_text(text: str) -> str:
+    # MiniLM's tokenizer is uncased and whitespace-insensitive, so this key is safe
+    return " ".join(text.split()).lower()
+
+def unit(vecs: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(vecs, axis=-1, keepdims=True)
+    return vecs / np.maximum(n, 1e-12)
+
+def embed_batch(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (raw, unit) float32 matrices of shape (n, d) from a single forward pass
+    over the cache misses. raw feeds the FAISS L2 index, unit feeds cosine memory.
+    """
+    global hits, misses
+    keys = [norm_text(t) for t in texts]
+    found = {}
+    with _lock:
+        for k in keys:
+            v = _cache.get(k)
+            if v is not None:
+                _cache.move_to_end(k)
+                found[k] = v
+    todo: "OrderedDict[str, str]" = OrderedDict()  # key -> first original text
+    for k, t in zip(keys, texts):
+        if k not in found:
+            todo.setdefault(k, t)
+    if todo:
+        vecs = np.asarray(get_model().encode(list(todo.values())), dtype=np.float32)
+        with _lock:
+            for k, v in zip(todo, vecs):
+                found[k] = v
+                _cache[k] = v
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    with _lock:
+        hits += len(keys) - len(todo)
+        misses += len(todo)
+    if not keys:
+        d = get_model().get_sentence_embedding_dimension()
+        return np.zeros((0, d), np.float32), np.zeros((0, d), np.float32)
+    raw = np.stack([found[k] for k in keys])
+    return raw, unit(raw)
+
+def embed(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    raw, u = embed_batch([text])
+    return raw[0], u[0]
+
+def cache_stats() -> dict:
+    return {"size": len(_cache), "capacity": CACHE_SIZE, "hits": hits, "misses": misses}
@@ -1,7 +1,9 @@
 # file: eval_quick.py
-import random
+import os, random
 from datasets import load_dataset
 from sklearn.metrics import accuracy_score, classification_report
+# don't let evaluation texts leak into memory.jsonl
+os.environ.setdefault("MEM_AUTO_STORE", "0")
 from router import predict
 
 # dataset: 6 classes, columns: text, label
@@ -21,7 +23,7 @@ for i in idxs:
     gold = id2label[test[i]["label"]]
     pred = predict(text)
     y_true.append(gold)
-    y_pred.append(pred["label"])
+    y_pred.append(pred["emotion"]["label"])
 
 print("Accuracy:", accuracy_score(y_true, y_pred))
 print(classification_report(y_true, y_pred, digits=3))
@@ -1,5 +1,6 @@
 # free_metadata.py
-import re
+import os, re, time
+from functools import lru_cache
 from typing import Dict, Any
 import dateparser
 from word2number import w2n
@@ -24,32 +25,221 @@ WORDS = {
   "one":1,"two":2,"three":3,"four":4,"five":5,"six":6,"seven":7,"eight":8,"nine":9,"ten":10
 }
 
-def _detect_amenity(text: str) -> str:
-  t = text.lower()
+# ---- config ----
+# "span": run dateparser only on temporal-looking spans (e.g. "tomorrow at 5 pm")
+# "full": previous behaviour, whole text, but skipped when no temporal cue is present
+WHEN_MODE = os.getenv("TAG_WHEN_MODE", "span")
+WHEN_TTL_S = float(os.getenv("TAG_WHEN_TTL_S", "60"))  # parsed dates depend on "now"
+CACHE_SIZE = int(os.getenv("TAG_CACHE_SIZE", "8192"))
+
+# ---- precompiled engine ----
+# One scan finds every synonym occurrence (substring semantics, as before) and every
+# whole-word number word. The lookahead makes matches zero-width so overlapping
+# synonyms are all seen; shorter synonyms sharing a start are recovered via _CONTAINED.
+_SYN_TO_AMENITY: Dict[str, list] = {}
+for _k, _syns in AMENITY_MAP.items():
+  for _s in _syns:
+    _SYN_TO_AMENITY.setdefault(_s, []).append(_k)
+_SYNS = sorted(_SYN_TO_AMENITY, key=len, reverse=True)
+_CONTAINED = {s: [o for o in _SYNS if o in s] for s in _SYNS}
+_WORD_ORDER = {w: i for i, w in enumerate(WORDS)}
+_SCAN_RE = re.compile(
+  r"(?=(?P<am>%s)|\b(?P<num>%s)\b)" % ("|".join(map(re.escape, _SYNS)), "|".join(WORDS))
+)
+# w2n only succeeds when a whitespace/hyphen separated token is one of its number words
+_W2N_RE = re.compile(r"(?<![^\s-])(?:%s)(?![^\s-])" % "|".join(sorted(w2n.american_number_system, key=len, reverse=True)))
+
+_MONTHS = "january|february|march|april|june|july|august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sept|sep|oct|nov|dec"
+_DAYS = "monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+_WHEN_RE = re.compile(r"""\b(?:
+    (?P<day>(?:day\ after\ )?tomorrow|this)\s+(?:morning|afternoon|evening|night)   # before the bare words
+  | (?:day\ after\ )?tomorrow|today|tonight|yesterday
+  | (?:next|this|coming)\s+(?:week|weekend|month|year|%(days)s)
+  | %(days)s
+  | (?:\d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?)?(?:%(months)s)(?:\s+\d{1,2}(?:st|nd|rd|th)?)?
+  | may\s+\d{1,2}(?:st|nd|rd|th)? | \d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?may
+  | \d{1,2}(?::\d{2})?\s*(?:am|pm|a\.m\.|p\.m\.)
+  | \d{1,2}:\d{2}
+  | noon|midnight
+  | (?:in\s+)?\d{1,3}\s+(?:minutes?|mins?|hours?|hrs?|days?|weeks?)(?:\s+ago)?
+  | \d{4}-\d{2}-\d{2}
+  | \d{1,2}[/.-]\d{1,2}(?:[/.-]\d{2,4})?
+)(?!\w)""" % {"days": _DAYS, "months": _MONTHS}, re.X)
+_JOIN_RE = re.compile(r"^\s*(?:,|at|on|by|around|from|of|the)?\s*$")
+
+def _scan(t: str):
+  found, nums = set(), set()
+  for m in _SCAN_RE.finditer(t):
+    if m.group("am"):
+      found.update(_CONTAINED[m.group("am")])
+    else:
+      nums.add(m.group("num"))
+  return found, nums
+
+def _amenity_from(found: set) -> str:
   best = ("other", 0)
   for k, syns in AMENITY_MAP.items():
-    score = sum(1 for s in syns if s in t)
+    score = sum(1 for s in syns if s in found)
     if score > best[1]: best = (k, score)
   return best[0] if best[1]>0 else "other"
 
-def _detect_qty(text: str) -> int | None:
-  t = text.lower()
+def _qty_from(t: str, nums: set) -> int | None:
   m = NUM_RE.search(t)
   if m: return int(m.group())
-  for w,n in WORDS.items():
-    if re.search(rf"\b{w}\b", t): return n
-  try:
-    return w2n.word_to_num(t)  # will try to parse “two towels”
-  except Exception:
-    return None
+  if nums:
+    return WORDS[min(nums, key=_WORD_ORDER.get)]
+  if t.replace("-", " ").isdigit() or _W2N_RE.search(t):
+    try:
+      return w2n.word_to_num(t)  # will try to parse “twenty towels”
+    except Exception:
+      return None
+  return None
 
-def _detect_when(text: str) -> str | None:
-  dt = dateparser.parse(text, settings={"PREFER_DATES_FROM": "future"})
+def _when_spans(t: str) -> tuple:
+  """Temporal-looking spans, adjacent cues merged ("friday at 5 pm"); each cue also kept alone."""
+  cues = list(_WHEN_RE.finditer(t))
+  if not cues:
+    return ()
+  merged, start, end = [], cues[0].start(), cues[0].end()
+  for m in cues[1:]:
+    if _JOIN_RE.match(t[end:m.start()]):
+      end = m.end()
+    else:
+      merged.append(t[start:end]); start, end = m.start(), m.end()
+  merged.append(t[start:end])
+  singles = [m.group() for m in cues]
+  # dateparser reads neither "tomorrow morning" nor "this evening": each span is followed
+  # by its variant with the part of day dropped ("tomorrow at 9 am", "today")
+  days = [(m.group(), "today" if m.group("day") == "this" else m.group("day")) for m in cues if m.group("day")]
+  spans = []
+  for s in merged + singles:
+    spans.append(s)
+    for cue, day in days:
+      s = s.replace(cue, day)
+    spans.append(s)
+  return tuple(dict.fromkeys(spans))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _static_tags(text: str) -> tuple:
+  # everything that does not depend on the clock, memoized per text
+  t = text.lower()
+  found, nums = _scan(t)
+  return _amenity_from(found), _qty_from(t, nums), _when_spans(t)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_when(s: str, bucket: int) -> str | None:
+  # bucket = current WHEN_TTL_S window, so relative dates are recomputed as time moves
+  dt = dateparser.parse(s, settings={"PREFER_DATES_FROM": "future"})
   return dt.isoformat() if dt else None
 
+def _bucket() -> int:
+  return int(time.time() // WHEN_TTL_S) if WHEN_TTL_S > 0 else time.time_ns()
+
+def _detect_amenity(text: str) -> str:
+  return _static_tags(text)[0]
+
+def _detect_qty(text: str) -> int | None:
+  return _static_tags(text)[1]
+
+def _detect_when(text: str) -> str | None:
+  spans = _static_tags(text)[2]
+  if not spans:
+    return None
+  if WHEN_MODE == "full":
+    return _parse_when(text, _bucket())
+  b = _bucket()
+  for s in spans:
+    iso = _parse_when(s, b)
+    if iso: return iso
+  return None
+
+def when_tag(text: str) -> str | None:
+  # "when" alone, for callers that cache the other (clock-independent) tags
+  return _detect_when(text)
+
 def tag_text_free(text: str, action_from_intent: str | None = None) -> Dict[str, Any]:
   amenity = _detect_amenity(text)
   qty = _detect_qty(text)
   when = _detect_when(text)
   action = action_from_intent or "other"
   return {"action": action, "amenity": amenity, "qty": qty, "when": when}
+
+# ---- parity with the previous per-request implementation ----
+def _reference_tags(text: str) -> Dict[str, Any]:
+  t = text.lower()
+  best = ("other", 0)
+  for k, syns in AMENITY_MAP.items():
+    score = sum(1 for s in syns if s in t)
+    if score > best[1]: best = (k, score)
+  amenity = best[0] if best[1]>0 else "other"
+  qty = None
+  m = NUM_RE.search(t)
+  if m:
+    qty = int(m.group())
+  else:
+    for w,n in WORDS.items():
+      if re.search(rf"\b{w}\b", t):
+        qty = n
+        break
+    else:
+      try:
+        qty = w2n.word_to_num(t)
+      except Exception:
+        qty = None
+  dt = dateparser.parse(text, settings={"PREFER_DATES_FROM": "future"})
+  return {"amenity": amenity, "qty": qty, "when": dt.isoformat() if dt else None}
+
+PARITY_EXTRA = [
+  "Can I get two extra towels please?", "parking near the park", "towels towels and cleaning",
+  "we need twenty five towels", "one or two pillows", "Book a couple spa at 5 PM",
+  "tomorrow at 5pm", "friday at 5 pm", "in 2 hours", "what time does the pool close?",
+  "Please arrange room cleaning at 3 pm", "wi-fi is not working in room 204", "order to room: club sandwich",
+]
+
+def _same_when(a: str | None, b: str | None) -> bool:
+  # relative dates ("in 2 hours") drift with the clock and the TTL bucket
+  if a is None or b is None:
+    return a == b
+  from datetime import datetime
+  return abs((datetime.fromisoformat(a) - datetime.fromisoformat(b)).total_seconds()) <= WHEN_TTL_S + 5
+
+def parity(csv_path: str = "intent_dataset_450.csv") -> Dict[str, Any]:
+  """
+  Compare the precompiled engine with the previous implementation. amenity/qty must
+  match exactly; "when" is compared in "full" mode (same dateparser input) and the
+  extra dates found by "span" mode are listed separately.
+  """
+  global WHEN_MODE
+  import pandas as pd
+  texts = pd.read_csv(csv_path)["text"].astype(str).tolist() + PARITY_EXTRA
+  t0 = time.perf_counter()
+  ref = [_reference_tags(x) for x in texts]
+  ref_s = time.perf_counter() - t0
+  mode = WHEN_MODE
+  try:
+    WHEN_MODE = "full"
+    _static_tags.cache_clear(); _parse_when.cache_clear()
+    t0 = time.perf_counter()
+    new = [tag_text_free(x) for x in texts]
+    new_s = time.perf_counter() - t0
+    WHEN_MODE = "span"
+    span = [tag_text_free(x) for x in texts]
+  finally:
+    WHEN_MODE = mode
+  mismatches = [(x, r, n) for x, r, n in zip(texts, ref, new)
+                if (r["amenity"], r["qty"]) != (n["amenity"], n["qty"]) or not _same_when(r["when"], n["when"])]
+  return {
+    "n": len(texts),
+    "mismatches": mismatches,
+    "span_mode_changed_when": [(x, r["when"], s["when"]) for x, r, s in zip(texts, ref, span) if r["when"] != s["when"]],
+    "reference_ms_per_text": 1000 * ref_s / len(texts),
+    "engine_ms_per_text": 1000 * new_s / len(texts),
+  }
+
+if __name__ == "__main__":
+  import sys, json
+  if sys.argv[1:2] == ["parity"]:
+    rep = parity(*sys.argv[2:3])
+    print(json.dumps(rep, indent=2, default=str))
+    sys.exit(1 if rep["mismatches"] else 0)
+  print(tag_text_free(" ".join(sys.argv[1:]) or "Can I get two towels tomorrow at 5 pm?"))
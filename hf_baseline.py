@@ -1,13 +1,40 @@
-from transformers import pipeline
+import os
+from lazy import Lazy
 HF_MODEL = "j-hartmann/emotion-english-distilroberta-base"  # stronger baseline
-clf = pipeline("text-classification", model=HF_MODEL, return_all_scores=True)
+INFER_BACKEND = os.getenv("INFER_BACKEND", "torch")  # "torch" | "onnx" (int8 ONNX Runtime, see onnx_backend.py)
+HF_BATCH_SIZE = int(os.getenv("HF_BATCH_SIZE", "32"))  # texts per forward pass in probs_emotion_batch
+
+def _load_clf():
+  if INFER_BACKEND == "onnx":
+    from onnx_backend import OrtTextClassifier
+    return OrtTextClassifier(HF_MODEL)
+  from transformers import pipeline
+  return pipeline("text-classification", model=HF_MODEL, return_all_scores=True)
+
+_clf = Lazy("hf_emotion", _load_clf)
+
+def __getattr__(name):
+  # hf_baseline.clf keeps working but only loads on first access
+  if name == "clf":
+    return _clf.get()
+  raise AttributeError(name)
 
 def probs_emotion(text: str) -> dict:
   # returns dict label->score
-  scores = clf(text)[0]
+  scores = _clf.get()(text)[0]
   return {d["label"].lower(): float(d["score"]) for d in scores}
 
-def predict_with_hf(text: str):
-  p = probs_emotion(text)
+def probs_emotion_batch(texts: list[str]) -> list[dict]:
+  # one pipeline call for the whole list; without batch_size the pipeline runs one text per forward pass
+  bs = max(1, min(len(texts), HF_BATCH_SIZE))
+  return [{d["label"].lower(): float(d["score"]) for d in scores} for scores in _clf.get()(texts, batch_size=bs)]
+
+def _pick(p: dict) -> dict:
   label = max(p, key=p.get)
   return {"label": label, "confidence": p[label], "probs": p}
+
+def predict_with_hf(text: str):
+  return _pick(probs_emotion(text))
+
+def predict_with_hf_batch(texts: list[str]) -> list[dict]:
+  return [_pick(p) for p in probs_emotion_batch(texts)]
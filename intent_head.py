@@ -0,0 +1,212 @@
+# file: intent_head.py
+"""
+Lightweight intent classifier over MiniLM unit embeddings: multinomial logistic
+regression trained with NumPy, temperature-scaled on a held-out split so its
+probabilities are calibrated, stored as a small .npz and served as one
+(n, d) x (d, C) matmul per batch.
+
+Training data is intent_dataset_450.csv (vectors from the intent index's
+embedding cache, so retraining encodes nothing new) plus every labelled row of
+the memory store (vectors already stored).
+
+  python intent_head.py train          # fit, report, save INTENT_HEAD_FILE
+  python intent_head.py predict "Can I get two towels?"
+"""
+import os, json, time, threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+import embeddings
+from lazy import Lazy
+
+# ---- config ----
+ENABLED = os.getenv("INTENT_HEAD", "0") == "1"             # use the head as the intent fast path
+HEAD_PATH = os.getenv("INTENT_HEAD_FILE", "intent_head.npz")
+DATASET = os.getenv("INTENT_HEAD_DATA", "intent_dataset_450.csv")
+MIN_PROB = float(os.getenv("INTENT_HEAD_MIN_PROB", "0.8"))   # below this the kNN/LLM stages decide
+L2 = float(os.getenv("INTENT_HEAD_L2", "1e-3"))
+ITERS = int(os.getenv("INTENT_HEAD_ITERS", "300"))
+RETRAIN_EVERY = int(os.getenv("INTENT_HEAD_RETRAIN_EVERY", "0"))  # new memory rows; 0 = only on demand
+
+def _softmax(Z: np.ndarray) -> np.ndarray:
+    Z = Z - Z.max(axis=1, keepdims=True)
+    E = np.exp(Z)
+    return E / E.sum(axis=1, keepdims=True)
+
+class IntentHead:
+    def __init__(self, W: np.ndarray, b: np.ndarray, classes: List[str], temperature: float = 1.0,
+                 meta: Optional[Dict[str, Any]] = None):
+        self.W = np.ascontiguousarray(W, dtype=np.float32)
+        self.b = np.asarray(b, dtype=np.float32)
+        self.classes = list(classes)
+        self.temperature = float(temperature)
+        self.meta = meta or {}
+
+    def proba(self, U: np.ndarray) -> np.ndarray:
+        """(n, d) unit vectors -> (n, C) calibrated class probabilities."""
+        return _softmax((np.asarray(U, dtype=np.float32) @ self.W + self.b) / self.temperature)
+
+    def predict(self, U: np.ndarray) -> List[Tuple[str, float]]:
+        P = self.proba(U)
+        top = P.argmax(axis=1)
+        return [(self.classes[j], float(P[i, j])) for i, j in enumerate(top)]
+
+    def save(self, path: str = HEAD_PATH) -> None:
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, W=self.W, b=self.b, classes=np.asarray(self.classes, dtype=str),
+                 temperature=np.float32(self.temperature), meta=json.dumps(self.meta))
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path: str = HEAD_PATH) -> "IntentHead":
+        with np.load(path, allow_pickle=False) as z:
+            return cls(z["W"], z["b"], z["classes"].tolist(), float(z["temperature"]), json.loads(str(z["meta"])))
+
+# ---- training ----
+def _fit(X: np.ndarray, y: np.ndarray, n_classes: int, l2: float = L2, iters: int = ITERS) -> Tuple[np.ndarray, np.ndarray]:
+    # full-batch gradient descent with Nesterov momentum; unit-norm rows keep the
+    # loss smooth enough for a fixed step
+    n, d = X.shape
+    Y = np.zeros((n, n_classes), dtype=np.float32)
+    Y[np.arange(n), y] = 1.0
+    W = np.zeros((d, n_classes), dtype=np.float32)
+    b = np.zeros(n_classes, dtype=np.float32)
+    vW, vb = np.zeros_like(W), np.zeros_like(b)
+    lr, mu = 4.0, 0.9
+    for _ in range(iters):
+        Wl, bl = W + mu * vW, b + mu * vb
+        G = (_softmax(X @ Wl + bl) - Y) / n
+        vW = mu * vW - lr * (X.T @ G + l2 * Wl)
+        vb = mu * vb - lr * G.sum(axis=0)
+        W, b = W + vW, b + vb
+    return W, b
+
+def _nll(Z: np.ndarray, y: np.ndarray, t: float) -> float:
+    P = _softmax(Z / t)
+    return float(-np.log(np.maximum(P[np.arange(len(y)), y], 1e-12)).mean())
+
+def _ece(P: np.ndarray, y: np.ndarray, bins: int = 10) -> float:
+    conf, pred = P.max(axis=1), P.argmax(axis=1)
+    ece = 0.0
+    for lo in np.linspace(0, 1, bins, endpoint=False):
+        m = (conf > lo) & (conf <= lo + 1.0 / bins)
+        if m.any():
+            ece += m.mean() * abs(float((pred[m] == y[m]).mean()) - float(conf[m].mean()))
+    return ece
+
+def _split(y: np.ndarray, frac: float, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    # stratified hold-out, at least one row per class left for training
+    rng = np.random.default_rng(seed)
+    val = []
+    for c in np.unique(y):
+        rows = rng.permutation(np.flatnonzero(y == c))
+        val.extend(rows[:int(len(rows) * frac)].tolist())
+    mask = np.zeros(len(y), dtype=bool)
+    mask[val] = True
+    return np.flatnonzero(~mask), np.flatnonzero(mask)
+
+def training_data(csv_path: str = DATASET, use_memory: bool = True) -> Tuple[np.ndarray, List[str], Dict[str, int]]:
+    """(unit vectors, labels, counts) from the dataset CSV plus labelled memory rows."""
+    import intent_index
+    texts, labels = intent_index._read_csv(csv_path)
+    cache = intent_index.EmbeddingCache()
+    raw, encoded = cache.get_many(texts, intent_index._encode)
+    if encoded:
+        cache.save()
+    X = [embeddings.unit(raw)]
+    labels = list(labels)
+    n_mem = 0
+    if use_memory:
+        import memory_store
+        M, _, _, intents = memory_store._index.get().snapshot()
+        if len(M):
+            X.append(np.asarray(M, dtype=np.float32))
+            labels += list(intents)
+            n_mem = len(M)
+    return np.vstack(X).astype(np.float32), labels, {"dataset": len(texts), "memory": n_mem, "encoded": encoded}
+
+def _train(csv_path: str, use_memory: bool, val_frac: float) -> IntentHead:
+    t0 = time.perf_counter()
+    X, labels, counts = training_data(csv_path, use_memory)
+    classes = sorted(set(labels))
+    y = np.asarray([classes.index(l) for l in labels])
+    tr, va = _split(y, val_frac)
+    W, b = _fit(X[tr], y[tr], len(classes))
+    Z = X[va] @ W + b
+    temps = np.exp(np.linspace(np.log(0.05), np.log(5.0), 61))
+    t_best = float(min(temps, key=lambda t: _nll(Z, y[va], t))) if len(va) else 1.0
+    report = {
+        "classes": len(classes), "rows": len(y), **counts, "val_rows": len(va),
+        "val_accuracy": float((Z.argmax(axis=1) == y[va]).mean()) if len(va) else None,
+        "temperature": t_best,
+        "val_ece_raw": _ece(_softmax(Z), y[va]) if len(va) else None,
+        "val_ece_calibrated": _ece(_softmax(Z / t_best), y[va]) if len(va) else None,
+    }
+    W, b = _fit(X, y, len(classes))
+    report["train_s"] = time.perf_counter() - t0
+    return IntentHead(W, b, classes, t_best, {**report, "trained_at": datetime.utcnow().isoformat()})
+
+def train(csv_path: str = DATASET, use_memory: bool = True, path: str = HEAD_PATH,
+          val_frac: float = 0.2, save: bool = True) -> Dict[str, Any]:
+    """
+    Fit on (1 - val_frac), pick the temperature that minimises held-out NLL, report
+    held-out accuracy and calibration error, then refit on everything with that
+    temperature. The new head is saved and swapped in.
+    """
+    global _version
+    head = _train(csv_path, use_memory, val_frac)
+    if save:
+        head.save(path)
+    _head.override(head)
+    _version += 1
+    return head.meta
+
+# ---- serving ----
+def _load_head() -> Optional[IntentHead]:
+    if not ENABLED:
+        return None
+    if os.path.exists(HEAD_PATH):
+        return IntentHead.open(HEAD_PATH)
+    head = _train(DATASET, True, 0.2)
+    head.save(HEAD_PATH)
+    return head
+
+_head = Lazy("intent_head", _load_head)
+_retraining = threading.Lock()
+_version = 0  # bumps when train() swaps in new weights
+
+def version() -> int:
+    return _version
+
+def _memory_rows() -> int:
+    import lazy
+    mem = lazy.peek("memory")
+    return len(mem) if mem is not None else 0
+
+def _retrain_bg() -> None:
+    try:
+        train()
+    except Exception as e:
+        print("Intent head retrain error:", repr(e))
+    finally:
+        _retraining.release()
+
+def get_head() -> Optional[IntentHead]:
+    """The current head (None when INTENT_HEAD=0); kicks off a background retrain once memory has grown by RETRAIN_EVERY rows."""
+    head = _head.get()
+    if head is not None and RETRAIN_EVERY > 0 and \
+            _memory_rows() - head.meta.get("memory", 0) >= RETRAIN_EVERY and _retraining.acquire(blocking=False):
+        threading.Thread(target=_retrain_bg, name="intent-head-retrain", daemon=True).start()
+    return head
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["train"]:
+        print(json.dumps(train(*sys.argv[2:3]), indent=2))
+    elif sys.argv[1:2] == ["predict"]:
+        head = IntentHead.open(HEAD_PATH)
+        text = " ".join(sys.argv[2:]) or "Can I get two towels?"
+        print(head.predict(embeddings.embed_batch([text])[1]))
+    else:
+        print("usage: python intent_head.py train [csv] | predict <text>")
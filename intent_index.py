@@ -0,0 +1,237 @@
+# file: intent_index.py
+"""
+Intent kNN index manager.
+
+The index is a FAISS IndexIDMap over IndexFlatL2 (raw MiniLM vectors, as before).
+Row IDs are content hashes of (text, label, occurrence), so add/remove works by ID
+and neighbours map to labels/texts through the ID, not through line positions.
+Index, IDs, labels and texts live together in one binary store (INTENT_STORE, an
+.npz) that is replaced atomically; the in-process snapshot is swapped by reference,
+so searches in flight keep using the old one. Embeddings are cached by text hash
+(INTENT_EMB_CACHE), so a sync only encodes new or changed texts.
+
+When no store exists yet, the legacy intent_faiss.index + intent_texts.csv /
+intent_labels.csv are imported without re-encoding.
+
+A partition (partitions.use) with its own store (PARTITION_DIR/<key>/intent_index.npz)
+is searched instead of the global one; it is loaded on first use and kept in the
+partitions LRU.
+"""
+import os, hashlib, threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from lazy import Lazy
+import partitions
+
+STORE_PATH = os.getenv("INTENT_STORE", "intent_index.npz")
+EMB_CACHE_PATH = os.getenv("INTENT_EMB_CACHE", "intent_emb_cache.npz")
+LEGACY_INDEX = "intent_faiss.index"
+LEGACY_TEXTS = "intent_texts.csv"
+LEGACY_LABELS = "intent_labels.csv"
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def row_ids(texts: List[str], labels: List[str]) -> np.ndarray:
+    """Stable int64 IDs; the occurrence number keeps duplicate (text, label) rows distinct."""
+    seen: Dict[Tuple[str, str], int] = {}
+    out = []
+    for t, l in zip(texts, labels):
+        n = seen.get((t, l), 0)
+        seen[(t, l)] = n + 1
+        h = hashlib.sha1(f"{t}\x00{l}\x00{n}".encode("utf-8")).digest()
+        out.append(int.from_bytes(h[:8], "little") & 0x7FFFFFFFFFFFFFFF)
+    return np.asarray(out, dtype=np.int64)
+
+class IntentIndex:
+    """Immutable snapshot: FAISS IndexIDMap plus ID-aligned labels and texts."""
+    def __init__(self, index, ids: np.ndarray, labels: List[str], texts: List[str]):
+        self.index = index
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.labels = list(labels)
+        self.texts = list(texts)
+        self._row = {int(i): r for r, i in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, Q: np.ndarray, k: int) -> Tuple[np.ndarray, List[List[int]]]:
+        """Q: (n, d) raw vectors -> (distances (n, k), metadata rows per query)."""
+        D, I = self.index.search(np.ascontiguousarray(Q, dtype=np.float32), k)
+        return D, [[self._row[int(i)] for i in row if i >= 0] for row in I]
+
+    # ---- persistence ----
+    def save(self, path: str = STORE_PATH) -> None:
+        import faiss
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, faiss=faiss.serialize_index(self.index), ids=self.ids,
+                 labels=np.asarray(self.labels, dtype=str), texts=np.asarray(self.texts, dtype=str))
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path: str = STORE_PATH) -> "IntentIndex":
+        import faiss
+        with np.load(path, allow_pickle=False) as z:
+            index = faiss.deserialize_index(z["faiss"])
+            return cls(index, z["ids"], z["labels"].tolist(), z["texts"].tolist())
+
+class EmbeddingCache:
+    """text sha1 -> raw float32 vector, stored as one .npz."""
+    def __init__(self, path: str = EMB_CACHE_PATH):
+        self.path = path
+        self.vecs: Dict[str, np.ndarray] = {}
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as z:
+                self.vecs = dict(zip(z["keys"].tolist(), z["vecs"]))
+
+    def get_many(self, texts: List[str], encode) -> Tuple[np.ndarray, int]:
+        """Vectors for texts, encoding only cache misses in one call. Returns (vecs, n_encoded)."""
+        keys = [text_key(t) for t in texts]
+        miss = list(dict.fromkeys(k for k in keys if k not in self.vecs))
+        if miss:
+            first = {}
+            for k, t in zip(keys, texts):
+                first.setdefault(k, t)
+            new = np.asarray(encode([first[k] for k in miss]), dtype=np.float32)
+            self.vecs.update(zip(miss, new))
+        if not keys:
+            return np.zeros((0, 0), np.float32), 0
+        return np.stack([self.vecs[k] for k in keys]), len(miss)
+
+    def put_many(self, texts: List[str], vecs: np.ndarray) -> None:
+        for t, v in zip(texts, vecs):
+            self.vecs.setdefault(text_key(t), np.asarray(v, dtype=np.float32))
+
+    def save(self) -> None:
+        if not self.vecs:
+            return
+        tmp = self.path + ".tmp.npz"
+        keys = list(self.vecs)
+        np.savez(tmp, keys=np.asarray(keys, dtype=str), vecs=np.stack([self.vecs[k] for k in keys]))
+        os.replace(tmp, self.path)
+
+# ---- building ----
+def _read_csv(path: str) -> Tuple[List[str], List[str]]:
+    import pandas as pd
+    df = pd.read_csv(path)
+    return df["text"].astype(str).tolist(), df["intent"].astype(str).tolist()
+
+def _build(texts: List[str], labels: List[str], vecs: np.ndarray) -> IntentIndex:
+    import faiss
+    ids = row_ids(texts, labels)
+    index = faiss.IndexIDMap(faiss.IndexFlatL2(vecs.shape[1]))
+    index.add_with_ids(np.ascontiguousarray(vecs, dtype=np.float32), ids)
+    return IntentIndex(index, ids, labels, texts)
+
+def import_legacy() -> IntentIndex:
+    """Wrap intent_faiss.index + the two CSVs (read as CSV, so quoted commas survive)."""
+    import faiss
+    import pandas as pd
+    flat = faiss.read_index(LEGACY_INDEX)
+    vecs = flat.reconstruct_n(0, flat.ntotal)
+    texts = pd.read_csv(LEGACY_TEXTS)["text"].astype(str).tolist()
+    labels = pd.read_csv(LEGACY_LABELS)["intent"].astype(str).tolist()
+    cache = EmbeddingCache()
+    cache.put_many(texts, vecs)
+    cache.save()
+    return _build(texts, labels, vecs)
+
+def _encode(texts: List[str]) -> np.ndarray:
+    import embeddings
+    return embeddings.get_model().encode(texts)
+
+def _load_current() -> IntentIndex:
+    if os.path.exists(STORE_PATH):
+        return IntentIndex.open(STORE_PATH)
+    return import_legacy()
+
+_current = Lazy("faiss_intent", _load_current)
+_write_lock = threading.Lock()
+
+_version = 0
+
+def store_path(partition: Optional[str] = None) -> str:
+    return STORE_PATH if partition is None else partitions.path(partition, "intent_index.npz")
+
+def _resident_bytes(idx: IntentIndex) -> int:
+    return int(idx.index.ntotal) * int(idx.index.d) * 4 + 200 * len(idx)
+
+def _partition_index(key: str) -> Optional[IntentIndex]:
+    if not os.path.exists(store_path(key)):
+        return None
+    return partitions.get_cache().get("intent", key, lambda: IntentIndex.open(store_path(key)), _resident_bytes)
+
+def get_intent_index() -> IntentIndex:
+    """The current partition's index if it has one, else the global (dataset) index."""
+    key = partitions.current()
+    if key is not None:
+        idx = _partition_index(key)
+        if idx is not None:
+            return idx
+    return _current.get()
+
+def version() -> int:
+    """Bumps on every swap, so results derived from an older index can be told apart."""
+    return _version
+
+def swap(new: IntentIndex, partition: Optional[str] = None) -> None:
+    """Atomically replace the serving snapshot (searches in flight finish on the old one)."""
+    global _version
+    if partition is None:
+        _current.override(new)
+    else:
+        partitions.get_cache().put("intent", partition, new, _resident_bytes)
+    _version += 1
+
+def reload(path: Optional[str] = None, partition: Optional[str] = None) -> IntentIndex:
+    new = IntentIndex.open(path or store_path(partition))
+    swap(new, partition)
+    return new
+
+def sync(csv_path: str = "intent_dataset_450.csv", rebuild: bool = False, save: bool = True,
+         partition: Optional[str] = None) -> Dict[str, int]:
+    """
+    Bring the index (the global one, or partition's own) in line with the CSV.
+    Rows are matched by content ID: removed rows are dropped by ID, new rows are
+    added by ID, and only texts missing from the embedding cache are encoded.
+    rebuild=True builds a fresh IndexIDMap (still from the cache). The result is
+    saved and swapped in.
+    """
+    import faiss
+    partition = partitions.check(partition)
+    with _write_lock:
+        texts, labels = _read_csv(csv_path)
+        ids = row_ids(texts, labels)
+        cache = EmbeddingCache()
+        if rebuild:
+            cur = None
+        elif partition is None:
+            cur = _current.get()
+        else:
+            cur = _partition_index(partition)
+        if cur is None or not len(cur):
+            vecs, encoded = cache.get_many(texts, _encode)
+            new = _build(texts, labels, vecs)
+            added, removed = len(ids), 0
+        else:
+            old = set(cur.ids.tolist())
+            keep = set(ids.tolist())
+            gone = np.asarray(sorted(old - keep), dtype=np.int64)
+            add_rows = [r for r, i in enumerate(ids.tolist()) if i not in old]
+            index = faiss.clone_index(cur.index)
+            if len(gone):
+                index.remove_ids(gone)
+            encoded = 0
+            if add_rows:
+                vecs, encoded = cache.get_many([texts[r] for r in add_rows], _encode)
+                index.add_with_ids(np.ascontiguousarray(vecs, dtype=np.float32), ids[add_rows])
+            new = IntentIndex(index, ids, labels, texts)
+            added, removed = len(add_rows), len(gone)
+        if encoded:
+            cache.save()
+        if save:
+            path = store_path(partition)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            new.save(path)
+        swap(new, partition)
+        return {"rows": len(new), "added": added, "removed": removed, "encoded": encoded}
@@ -0,0 +1,72 @@
+# file: lazy.py
+import threading, time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+_registry: Dict[str, "Lazy"] = {}
+
+class Lazy:
+    """
+    Thread-safe load-on-first-use singleton for models, indexes and clients.
+    Instances register by name so warmup() can load everything up front and
+    report() can show how long each component took.
+    """
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._value: Any = None
+        self._loaded = False
+        self.load_s: Optional[float] = None
+        self.error: Optional[str] = None
+        _registry[name] = self
+
+    def get(self) -> Any:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    t0 = time.perf_counter()
+                    try:
+                        self._value = self.factory()
+                    except Exception as e:
+                        self.error = repr(e)
+                        raise
+                    self.load_s = time.perf_counter() - t0
+                    self.error = None
+                    self._loaded = True
+        return self._value
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def override(self, value: Any) -> None:
+        """Install a ready-made value (benchmarks, offline runs) instead of calling the factory."""
+        with self._lock:
+            self._value, self._loaded, self.load_s, self.error = value, True, 0.0, None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._value, self._loaded, self.load_s = None, False, None
+
+def warmup(names: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Load the given (default: all registered) components; failures are recorded, not raised."""
+    wanted = set(names) if names is not None else None
+    for name, lz in list(_registry.items()):
+        if wanted is None or name in wanted:
+            try:
+                lz.get()
+            except Exception as e:
+                print(f"warmup: {name} failed:", repr(e))
+    return report()
+
+def report() -> Dict[str, Dict[str, Any]]:
+    return {name: {"loaded": lz.loaded, "load_s": lz.load_s, "error": lz.error}
+            for name, lz in _registry.items()}
+
+def peek(name: str) -> Any:
+    """The component if it is already loaded, else None (never triggers a load)."""
+    lz = _registry.get(name)
+    return lz._value if lz is not None and lz.loaded else None
+
+def all_loaded() -> bool:
+    return all(lz.loaded for lz in _registry.values())
@@ -4,9 +4,9 @@ from typing import Literal
 from dotenv import load_dotenv
 
 from pydantic import BaseModel, Field, confloat
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
+from lazy import Lazy
 
 load_dotenv()
 
@@ -47,17 +47,19 @@ prompt = ChatPromptTemplate.from_messages([
     ("human", "Text: {text}\n" + INSTRUCTIONS)
 ]).partial(format_instructions=parser.get_format_instructions())
 
-llm = ChatGoogleGenerativeAI(
-    model=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
-    google_api_key=os.getenv("GEMINI_API_KEY"),
-    temperature=0.2,  
-)
-
+def _build_chain():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    llm = ChatGoogleGenerativeAI(
+        model=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+        google_api_key=os.getenv("GEMINI_API_KEY"),
+        temperature=0.2,
+    )
+    return prompt | llm | parser
 
-chain = prompt | llm | parser
+_chain = Lazy("gemini_emotion", _build_chain)
 
 def predict_with_gemini(text: str) -> EmotionPred:
-    return chain.invoke({"text": text})
+    return _chain.get().invoke({"text": text})
 
 if __name__ == "__main__":
     print(predict_with_gemini("I am a little sad and a little happy"))
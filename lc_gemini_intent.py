@@ -1,14 +1,20 @@
 # file: lc_gemini_intent.py
-import os
+import os, asyncio, weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from typing import Literal
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field, confloat
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
+from lazy import Lazy
 
 load_dotenv()
 
+# async fallback limits
+TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "2.5"))       # per-request deadline
+CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))        # in-flight Gemini calls
+RETRIES = int(os.getenv("GEMINI_RETRIES", "1"))                # extra attempts inside the deadline
+
 INTENTS = ["service_request","hotel_info","internal_experience","external_experience","booking","off_topic","feedback"]
 
 class IntentPred(BaseModel):
@@ -46,16 +52,150 @@ prompt = ChatPromptTemplate.from_messages([
     ("human", "Text: {text}\n" + INSTRUCTIONS)
 ]).partial(format_instructions=parser.get_format_instructions())
 
-llm = ChatGoogleGenerativeAI(
-    model=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
-    google_api_key=os.getenv("GEMINI_API_KEY"),
-    temperature=0.2,
-)
+def _build_chain():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    llm = ChatGoogleGenerativeAI(
+        model=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+        google_api_key=os.getenv("GEMINI_API_KEY"),
+        temperature=0.2,
+        timeout=TIMEOUT_S,  # per request, so calls abandoned at a deadline do not hang around
+    )
+    return prompt | llm | parser
+
+_chain = Lazy("gemini_intent", _build_chain)
 
-chain = prompt | llm | parser
+def get_chain():
+    return _chain.get()
+
+def __getattr__(name):
+    # lc_gemini_intent.chain keeps working but the client is built on first access
+    if name == "chain":
+        return _chain.get()
+    raise AttributeError(name)
 
 def predict_intent_with_gemini(text: str) -> IntentPred:
-    return chain.invoke({"text": text})
+    return get_chain().invoke({"text": text})
+
+_sync_pool = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="gemini")
+
+def predict_intent_with_gemini_batch(texts: list[str], timeout: float = TIMEOUT_S) -> list[IntentPred | None]:
+    """
+    Blocking counterpart of abatch_predict_intent_with_gemini: one batch_as_completed
+    call bounded by timeout. Answers that arrive in time are kept; errors and
+    late items come back as None.
+    """
+    out: list = [None] * len(texts)
+    if not texts:
+        return out
+
+    def _collect():
+        for i, res in get_chain().batch_as_completed(
+                [{"text": t} for t in texts], config={"max_concurrency": CONCURRENCY},
+                return_exceptions=True):
+            if isinstance(res, Exception):
+                print("Gemini error:", repr(res))
+            else:
+                out[i] = res
+
+    try:
+        _sync_pool.submit(_collect).result(timeout)
+    except FutureTimeout:
+        pass
+    return list(out)  # a copy, so answers landing after the deadline do not show up later
+
+# ---- async, deadline-bounded ----
+_sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _semaphore() -> asyncio.Semaphore:
+    # one bounded semaphore per event loop; a semaphore that ever had waiters holds
+    # its loop, so closed loops are dropped explicitly as well as by the weak key
+    loop = asyncio.get_running_loop()
+    if loop not in _sems:
+        for old in [l for l in _sems if l.is_closed()]:
+            _sems.pop(old, None)
+        _sems[loop] = asyncio.Semaphore(CONCURRENCY)
+    return _sems[loop]
+
+async def _gated(runnable, inp: dict) -> IntentPred:
+    # waiting for a slot counts against the caller's deadline
+    async with _semaphore():
+        return await runnable.ainvoke(inp)
+
+async def apredict_intent_with_gemini(text: str, timeout: float = TIMEOUT_S, runnable=None) -> IntentPred | None:
+    """
+    Non-blocking chain.ainvoke with a hard deadline, retries inside it and a bounded
+    number of concurrent calls. Returns None when the deadline passes or every
+    attempt fails, so the caller can fall back to the kNN label.
+    """
+    runnable = runnable or get_chain()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    for _ in range(1 + RETRIES):
+        left = deadline - loop.time()
+        if left <= 0:
+            break
+        try:
+            return await asyncio.wait_for(_gated(runnable, {"text": text}), left)
+        except asyncio.TimeoutError:
+            break
+        except Exception as e:
+            print("Gemini error:", repr(e))
+    return None
+
+async def abatch_predict_intent_with_gemini(texts: list[str], timeout: float = TIMEOUT_S,
+                                            runnable=None) -> list[IntentPred | None]:
+    """
+    Many low-confidence texts in one batched call (abatch family). Every item takes
+    a slot of the same semaphore as apredict_intent_with_gemini, so batches and
+    single calls share the CONCURRENCY limit. Uses abatch_as_completed so answers
+    that arrive before the deadline are kept; the rest (timeouts, errors) come
+    back as None.
+    """
+    from langchain_core.runnables import RunnableLambda
+    runnable = runnable or get_chain()
+    out: list = [None] * len(texts)
+    if not texts:
+        return out
+
+    async def _one(inp):
+        return await _gated(runnable, inp)
+    gated = RunnableLambda(_one)
+
+    async def _collect():
+        async for i, res in gated.abatch_as_completed(
+                [{"text": t} for t in texts], config={"max_concurrency": CONCURRENCY},
+                return_exceptions=True):
+            if isinstance(res, Exception):
+                print("Gemini error:", repr(res))
+            else:
+                out[i] = res
+
+    try:
+        await asyncio.wait_for(_collect(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    return out
+
+if __name__ == "__main__":
+    import sys
+    if "--offline" not in sys.argv:
+        print(predict_intent_with_gemini("Please arrange room cleaning at 3 pm"))
+    else:
+        # offline check of the async path against a local fake chat model
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        answer = '{"intent":"service_request","confidence":0.9}'
+        fast = prompt | FakeListChatModel(responses=[answer]) | parser
+        slow = prompt | FakeListChatModel(responses=[answer], sleep=1.0) | parser
+
+        async def _check():
+            ok = await apredict_intent_with_gemini("towels please", timeout=0.5, runnable=fast)
+            late = await apredict_intent_with_gemini("towels please", timeout=0.2, runnable=slow)
+            many = await abatch_predict_intent_with_gemini(["a", "b", "c"], timeout=0.5, runnable=fast)
+            none = await abatch_predict_intent_with_gemini(["a", "b"], timeout=0.2, runnable=slow)
+            assert ok is not None and ok.intent == "service_request", ok
+            assert late is None, late
+            assert all(p is not None and p.intent == "service_request" for p in many), many
+            assert none == [None, None], none
+            print("offline async fallback check: ok")
 
-# if __name__ == "__main__":
-#     print(predict_intent_with_gemini("Please arrange room cleaning at 3 pm"))
+        asyncio.run(_check())
@@ -0,0 +1,195 @@
+# file: llm_cache.py
+import os, json, time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import numpy as np
+from embeddings import norm_text
+from lazy import Lazy
+from memory_store import _file_lock
+
+# ---- config ----
+CACHE_PATH = os.getenv("LLM_CACHE_FILE", "llm_cache.jsonl")
+ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_SIZE", "20000"))
+SIM_THRESHOLD = float(os.getenv("LLM_CACHE_SIM", "0.95"))  # cosine on unit MiniLM vectors
+SWEEP_S = 60.0
+_FIELDS = {"key", "intent", "confidence", "ts"}
+
+class LLMCache:
+    """
+    Persistent cache of LLM intent answers. Hits on exact normalized text, then on
+    near-duplicates whose unit embedding has cosine >= sim_threshold. Entries
+    expire after ttl_s and are evicted least-recently-used beyond max_entries.
+    The file is append-only JSONL (appends hold the same cross-process lock file
+    as memory.jsonl) and is compacted on load when it holds too many stale lines
+    or any line that does not parse (e.g. torn by a crash mid-append). Embeddings live in one preallocated float32 matrix: puts fill a
+    free row (or grow it geometrically) and evictions free theirs, so a lookup
+    never has to rebuild it.
+    """
+    def __init__(self, path: str = CACHE_PATH, ttl_s: float = TTL_S,
+                 max_entries: int = MAX_ENTRIES, sim_threshold: float = SIM_THRESHOLD):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.sim_threshold = sim_threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._M = np.zeros((0, 0), np.float32)  # (capacity, d) unit vectors; free rows are zero
+        self._keys: list = []        # row -> key (None: free); len(_keys) rows are in use or free
+        self._rows: Dict[str, int] = {}
+        self._free: list = []
+        self._swept = 0.0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.bad_lines = 0
+        self._load()
+
+    # ---- persistence ----
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                lines += 1
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    e = None
+                if not isinstance(e, dict) or not _FIELDS <= e.keys():
+                    self.bad_lines += 1
+                    continue
+                self._entries[e["key"]] = e
+                self._entries.move_to_end(e["key"])
+        self._evict(time.time())
+        for k, e in self._entries.items():
+            if e.get("emb"):
+                self._index(k, e["emb"])
+        if self.bad_lines:
+            print(f"LLM cache: skipped {self.bad_lines} unreadable lines in {self.path}")
+        if self.bad_lines or lines > 2 * max(len(self._entries), 1):
+            self._rewrite()
+
+    def _rewrite(self) -> None:
+        tmp = self.path + ".tmp"
+        with _file_lock(self.path):
+            with open(tmp, "w", encoding="utf-8") as f:
+                for e in self._entries.values():
+                    f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+
+    def _evict(self, now: float) -> None:
+        # full TTL sweep at most every SWEEP_S (get() checks each hit's age itself); size cap every time
+        dead = []
+        if now - self._swept >= SWEEP_S:
+            self._swept = now
+            dead = [k for k, e in self._entries.items() if now - e["ts"] > self.ttl_s]
+        for k in dead:
+            del self._entries[k]
+            self._unindex(k)
+        self.expired += len(dead)
+        while len(self._entries) > self.max_entries:
+            self._unindex(self._entries.popitem(last=False)[0])
+
+    # ---- embedding matrix ----
+    def _index(self, key: str, emb) -> None:
+        v = np.asarray(emb, dtype=np.float32)
+        j = self._rows.get(key)
+        if j is None:
+            if self._free:
+                j = self._free.pop()
+                self._keys[j] = key
+            else:
+                j = len(self._keys)
+                if j >= self._M.shape[0]:
+                    M = np.zeros((max(64, 2 * self._M.shape[0]), len(v)), np.float32)
+                    if j:
+                        M[:j] = self._M[:j]
+                    self._M = M
+                self._keys.append(key)
+            self._rows[key] = j
+        self._M[j] = v
+
+    def _unindex(self, key: str) -> None:
+        j = self._rows.pop(key, None)
+        if j is not None:
+            self._M[j] = 0.0
+            self._keys[j] = None
+            self._free.append(j)
+
+    def get(self, text: str, emb: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+        """Return {"intent", "confidence", "match"} or None. emb is the unit MiniLM vector."""
+        key = norm_text(text)
+        now = time.time()
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None and now - e["ts"] > self.ttl_s:
+                del self._entries[key]
+                self._unindex(key)
+                self.expired += 1
+                e = None
+            if e is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return {"intent": e["intent"], "confidence": e["confidence"], "match": "exact"}
+            if emb is not None and self._entries:
+                keys = self._keys
+                if len(self._rows):
+                    sims = self._M[:len(keys)] @ np.asarray(emb, dtype=np.float32)
+                    j = int(np.argmax(sims))
+                    e = self._entries.get(keys[j]) if keys[j] is not None else None
+                    if sims[j] >= self.sim_threshold and e is not None and now - e["ts"] <= self.ttl_s:
+                        self._entries.move_to_end(keys[j])
+                        self.semantic_hits += 1
+                        return {"intent": e["intent"], "confidence": e["confidence"],
+                                "match": "semantic", "similarity": float(sims[j])}
+            self.misses += 1
+            return None
+
+    def put(self, text: str, intent: str, confidence: float, emb: Optional[np.ndarray] = None) -> None:
+        e = {"key": norm_text(text), "intent": intent, "confidence": float(confidence), "ts": time.time(),
+             "emb": None if emb is None else [round(float(x), 6) for x in emb]}
+        with self._lock:
+            self._entries[e["key"]] = e
+            self._entries.move_to_end(e["key"])
+            if e["emb"] is not None:
+                self._index(e["key"], e["emb"])
+            else:
+                self._unindex(e["key"])
+            self._evict(e["ts"])
+            with _file_lock(self.path), open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._M = np.zeros((0, 0), np.float32)
+            self._keys, self._rows, self._free = [], {}, []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "enabled": ENABLED,
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "bad_lines": self.bad_lines,
+            "hit_ratio": hits / total if total else 0.0,
+            "llm_calls_saved": hits,
+        }
+
+_cache = Lazy("llm_cache", LLMCache)
+
+def get_cache() -> LLMCache:
+    return _cache.get()
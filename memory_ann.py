@@ -0,0 +1,194 @@
+# file: memory_ann.py
+"""
+Nearest-neighbour backends for memory_store (inner product on unit vectors).
+
+MEM_ANN=exact  brute-force matmul + np.argpartition (default)
+MEM_ANN=hnsw   FAISS IndexHNSWFlat, incremental add, no training
+MEM_ANN=ivf    FAISS IndexIVFFlat, trained once on the rows present at build time
+
+The FAISS index is persisted next to DB_PATH and kept in step with the resident
+memory matrix: rows appended since the last sync are added incrementally; a
+replaced/compacted memory triggers a rebuild. Below MEM_ANN_MIN_ROWS rows exact
+search is used anyway (it is faster there).
+
+  python memory_ann.py report --n 100000 --queries 200   # recall vs latency
+"""
+import os, json, hashlib, threading, time
+from typing import Optional
+import numpy as np
+
+ANN = os.getenv("MEM_ANN", "exact")
+MIN_ROWS = int(os.getenv("MEM_ANN_MIN_ROWS", "20000"))
+HNSW_M = int(os.getenv("MEM_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("MEM_HNSW_EF", "64"))
+IVF_NLIST = int(os.getenv("MEM_IVF_NLIST", "0"))        # 0 = 4 * sqrt(N)
+IVF_NPROBE = int(os.getenv("MEM_IVF_NPROBE", "16"))
+SAVE_EVERY = int(os.getenv("MEM_ANN_SAVE_EVERY", "1000"))  # persist after this many incremental adds
+
+def topk_exact(S: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores along the last axis, best first. O(N) selection + O(k log k) sort."""
+    k = min(k, S.shape[-1])
+    if k <= 0:
+        return np.zeros(S.shape[:-1] + (0,), dtype=np.int64)
+    idx = np.argpartition(-S, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(S, idx, axis=-1), axis=-1)
+    return np.take_along_axis(idx, order, axis=-1)
+
+class ExactSearch:
+    kind = "exact"
+
+    def search(self, M: np.ndarray, Q: np.ndarray, k: int, generation: int = 0) -> np.ndarray:
+        """Q: (n, d) unit queries -> (n, k) row indices into M."""
+        return topk_exact(Q @ M.T, k)
+
+    def save(self) -> None:
+        pass
+
+class FaissSearch(ExactSearch):
+    def __init__(self, kind: str, path: str):
+        self.kind = kind
+        self.path = path
+        self._lock = threading.RLock()
+        self._index = None
+        self._generation: Optional[int] = None
+        self._fp = ""
+        self._unsaved = 0
+
+    # ---- build / persist ----
+    def _new_index(self, M: np.ndarray):
+        import faiss
+        d = M.shape[1]
+        if self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 80
+        else:
+            nlist = IVF_NLIST or max(1, int(4 * np.sqrt(len(M))))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(d), d, nlist, faiss.METRIC_INNER_PRODUCT)
+            sample = M[np.random.default_rng(0).choice(len(M), min(len(M), nlist * 64), replace=False)]
+            index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        return index
+
+    def _tune(self) -> None:
+        if self.kind == "hnsw":
+            self._index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            self._index.nprobe = IVF_NPROBE
+
+    @staticmethod
+    def _fingerprint(M: np.ndarray, n: int) -> str:
+        # a few sampled rows identify the memory prefix the index was built from
+        rows = np.unique(np.linspace(0, n - 1, 16).astype(np.int64))
+        return hashlib.sha1(np.ascontiguousarray(M[rows], dtype=np.float32).tobytes()).hexdigest()
+
+    def _load(self, M: np.ndarray) -> bool:
+        import faiss
+        meta_path = self.path + ".json"
+        if not (os.path.exists(self.path) and os.path.exists(meta_path)):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        n = meta.get("n", 0)
+        if meta.get("kind") != self.kind or not 0 < n <= len(M) or meta.get("fp") != self._fingerprint(M, n):
+            return False
+        self._index = faiss.read_index(self.path)
+        return self._index.ntotal == n
+
+    def save(self) -> None:
+        import faiss
+        with self._lock:
+            if self._index is None or not self._index.ntotal:
+                return
+            tmp = self.path + ".tmp"
+            faiss.write_index(self._index, tmp)
+            os.replace(tmp, self.path)
+            with open(self.path + ".json", "w") as f:
+                json.dump({"kind": self.kind, "n": int(self._index.ntotal), "fp": self._fp}, f)
+            self._unsaved = 0
+
+    def _sync(self, M: np.ndarray, generation: int) -> None:
+        if self._index is not None and (generation != self._generation or self._index.ntotal > len(M)):
+            self._index = None  # memory was replaced or shrank
+        if self._index is None:
+            if not self._load(M):
+                self._index = self._new_index(M)
+            self._generation = generation
+            self._tune()
+        n0 = self._index.ntotal
+        if n0 < len(M):
+            self._index.add(np.ascontiguousarray(M[n0:], dtype=np.float32))
+            self._unsaved += len(M) - n0
+        self._fp = self._fingerprint(M, self._index.ntotal)
+        if self._unsaved and (self._unsaved >= SAVE_EVERY or n0 == 0):
+            self.save()
+
+    def search(self, M: np.ndarray, Q: np.ndarray, k: int, generation: int = 0) -> np.ndarray:
+        if len(M) < MIN_ROWS:
+            return super().search(M, Q, k)
+        with self._lock:
+            self._sync(M, generation)
+            _, I = self._index.search(np.ascontiguousarray(Q, dtype=np.float32), min(k, len(M)))
+        return I
+
+def make_searcher(kind: str = ANN, path: str = "") -> ExactSearch:
+    if kind in ("hnsw", "ivf"):
+        return FaissSearch(kind, path)
+    return ExactSearch()
+
+# ---- recall vs latency ----
+def _clustered(n: int, d: int, rng, clusters: int = 256) -> np.ndarray:
+    # mixture of gaussians is closer to sentence embeddings than uniform noise
+    C = rng.standard_normal((clusters, d), dtype=np.float32)
+    X = C[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, d), dtype=np.float32)
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+def report(n: int = 100000, d: int = 384, queries: int = 200, k: int = 5) -> dict:
+    import tempfile
+    global MIN_ROWS
+    rng = np.random.default_rng(0)
+    M = _clustered(n, d, rng)
+    # queries are paraphrase-like perturbations of stored rows, as in real memory lookups
+    Q = M[rng.choice(n, queries, replace=False)] + 0.05 * rng.standard_normal((queries, d), dtype=np.float32)
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+    MIN_ROWS = 0
+
+    def timed(fn):
+        t0 = time.perf_counter()
+        r = fn()
+        return r, (time.perf_counter() - t0) * 1000.0 / queries
+
+    truth, argsort_ms = timed(lambda: np.argsort(-(Q @ M.T), axis=1)[:, :k])
+    _, argpart_ms = timed(lambda: topk_exact(Q @ M.T, k))
+    single_ms = timed(lambda: [topk_exact(M @ q, k) for q in Q])[1]
+
+    def recall(I):
+        return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(truth, I)]))
+
+    out = {"n": n, "d": d, "queries": queries, "k": k,
+           "exact": {"argsort_ms_per_query": argsort_ms, "argpartition_ms_per_query": argpart_ms,
+                     "argpartition_single_query_ms": single_ms}}
+    tmp = tempfile.mkdtemp()
+    for kind, knob, values in (("hnsw", "efSearch", (16, 32, 64, 128)), ("ivf", "nprobe", (1, 4, 16, 64))):
+        s = FaissSearch(kind, os.path.join(tmp, kind + ".faiss"))
+        t0 = time.perf_counter()
+        s.search(M, Q[:1], k)
+        build_s = time.perf_counter() - t0
+        rows = {}
+        for v in values:
+            if kind == "hnsw":
+                s._index.hnsw.efSearch = v
+            else:
+                s._index.nprobe = v
+            I, ms = timed(lambda: s._index.search(Q, k)[1])
+            rows[str(v)] = {"recall_at_k": recall(I), "ms_per_query": ms}
+        out[kind] = {"build_s": build_s, knob: rows}
+    return out
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("cmd", choices=["report"])
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=5)
+    a = ap.parse_args()
+    print(json.dumps(report(a.n, queries=a.queries, k=a.k), indent=2))
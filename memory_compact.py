@@ -0,0 +1,229 @@
+# file: memory_compact.py
+"""
+Memory compaction: keeps the auto-stored memory bounded without changing what
+its kNN vote says.
+
+  python memory_compact.py                              # dedup at MEM_COMPACT_DEDUP_SIM
+  python memory_compact.py --prototypes 0.9 --max-age-days 180 --max-rows 50000
+  python memory_compact.py --dry-run                    # report only, nothing rewritten
+  python memory_compact.py --partition hotel-42         # one property's store (see partitions.py)
+
+Steps, in order:
+  1. age cap: drop rows whose added_at is older than max_age_days;
+  2. dedup: among rows with the same (emotion, intent), drop every row within
+     dedup_sim (cosine) of a newer kept row;
+  3. prototypes (optional): greedily cluster same-label rows within proto_sim of
+     a leader and replace clusters of proto_min or more by one row: the weighted
+     mean unit vector, the leader's text and tags, the newest added_at and
+     weight = sum of member weights (it fills up to that many of the kNN vote's
+     k slots, as its members nearest the query would have);
+  4. size cap: keep the newest max_rows rows.
+
+The store is then rewritten atomically (memory_store rewrite: temp file +
+rename under the append lock); rows appended while the job ran are carried
+over. The report compares a leave-one-out kNN vote (k=5, near-copies of the
+probe excluded) on a sample of rows before and after.
+"""
+import os, json, time, argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+import numpy as np
+
+import memory_store
+import partitions
+
+# ---- config ----
+DEDUP_SIM = float(os.getenv("MEM_COMPACT_DEDUP_SIM", "0.97"))
+PROTO_SIM = float(os.getenv("MEM_COMPACT_PROTO_SIM", "0"))       # 0 = no prototypes
+PROTO_MIN = int(os.getenv("MEM_COMPACT_PROTO_MIN", "3"))
+MAX_AGE_DAYS = float(os.getenv("MEM_MAX_AGE_DAYS", "0"))         # 0 = no age cap
+MAX_ROWS = int(os.getenv("MEM_MAX_ROWS", "0"))                   # 0 = no size cap
+PROBES = int(os.getenv("MEM_COMPACT_PROBES", "2000"))            # rows sampled for the agreement report
+K = 5
+BLOCK = 512
+
+def _timestamps(meta: List[Dict[str, Any]]) -> np.ndarray:
+    out = np.zeros(len(meta))
+    for i, m in enumerate(meta):
+        try:
+            t = datetime.fromisoformat(m.get("added_at") or "")
+            out[i] = (t if t.tzinfo else t.replace(tzinfo=timezone.utc)).timestamp()  # utcnow() stamps
+        except ValueError:
+            pass  # unknown age: oldest
+    return out
+
+def _codes(labels: List[str]) -> Tuple[np.ndarray, List[str]]:
+    names, codes = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+    return codes, names.tolist()
+
+def _leaders(M: np.ndarray, order: np.ndarray, keys: np.ndarray, thr: float) -> np.ndarray:
+    """
+    Greedy leader clustering in the given order: each row joins the first earlier
+    leader with the same key and cosine >= thr, otherwise leads its own cluster.
+    Returns the leader row per row (-1 for rows not in order).
+    """
+    leader = np.full(len(M), -1)
+    leaders = np.zeros(0, dtype=int)
+    for s in range(0, len(order), BLOCK):
+        B = order[s:s + BLOCK]
+        if len(leaders):
+            S = M[B] @ M[leaders].T
+            S[keys[B][:, None] != keys[leaders][None, :]] = -2.0
+            j = S.argmax(axis=1)
+            hit = S[np.arange(len(B)), j] >= thr
+            leader[B[hit]] = leaders[j[hit]]
+        rest = B[leader[B] < 0]
+        if len(rest):
+            # within the block: against the leaders it has produced so far
+            S = M[rest] @ M[rest].T
+            same = keys[rest][:, None] == keys[rest][None, :]
+            new: List[int] = []
+            for a, r in enumerate(rest):
+                if new:
+                    cand = np.asarray(new)
+                    sims = np.where(same[a, cand], S[a, cand], -2.0)
+                    b = int(sims.argmax())
+                    if sims[b] >= thr:
+                        leader[r] = rest[cand[b]]
+                        continue
+                leader[r] = r
+                new.append(a)
+            leaders = np.concatenate([leaders, rest[new]])
+    return leader
+
+def _vote(M: np.ndarray, labels: np.ndarray, weights: np.ndarray, n_labels: int,
+          Q: np.ndarray, skip_sim: float, k: int = K) -> np.ndarray:
+    """Weighted top-k vote per query, ignoring rows within skip_sim of it (the query itself and its copies)."""
+    out = np.full(len(Q), -1)
+    if not len(M):
+        return out
+    for s in range(0, len(Q), BLOCK):
+        S = Q[s:s + BLOCK] @ M.T
+        S[S >= skip_sim] = -np.inf
+        kk = min(k, M.shape[0])
+        top = np.argpartition(-S, kk - 1, axis=1)[:, :kk]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(S, top, axis=1), axis=1), axis=1)
+        valid = np.isfinite(np.take_along_axis(S, top, axis=1))
+        # k slots filled by cumulative weight, best first (memory_store._dist)
+        w = weights[top] * valid
+        take = np.clip(k - (np.cumsum(w, axis=1) - w), 0.0, w)
+        V = np.zeros((len(top), n_labels))
+        np.add.at(V, (np.repeat(np.arange(len(top)), kk), labels[top].ravel()), take.ravel())
+        out[s:s + BLOCK] = np.where(V.max(axis=1) > 0, V.argmax(axis=1), -1)
+    return out
+
+def _agreement(M0, lab0, w0, M1, lab1, w1, probes: np.ndarray, skip_sim: float) -> Dict[str, Any]:
+    # lab*: {"emotion": codes, "intent": codes} over a shared label vocabulary
+    Q = M0[probes]
+    out: Dict[str, Any] = {"probes": len(probes)}
+    for task in ("emotion", "intent"):
+        n_labels = int(max(lab0[task].max(initial=0), lab1[task].max(initial=0))) + 1
+        before = _vote(M0, lab0[task], w0, n_labels, Q, skip_sim)
+        after = _vote(M1, lab1[task], w1, n_labels, Q, skip_sim)
+        truth = lab0[task][probes]
+        out[task] = {"agreement": float((before == after).mean()) if len(probes) else 1.0,
+                     "loo_accuracy_before": float((before == truth).mean()) if len(probes) else None,
+                     "loo_accuracy_after": float((after == truth).mean()) if len(probes) else None}
+    return out
+
+def _bytes(idx) -> int:
+    paths = [idx.path, getattr(idx, "vec_path", None)]
+    return sum(os.path.getsize(p) for p in paths if p and os.path.exists(p))
+
+def compact(dedup_sim: float = DEDUP_SIM, proto_sim: float = PROTO_SIM, proto_min: int = PROTO_MIN,
+            max_age_days: float = MAX_AGE_DAYS, max_rows: int = MAX_ROWS, probes: int = PROBES,
+            dry_run: bool = False) -> Dict[str, Any]:
+    """Compact the current partition's memory store in place (see the module docstring); returns the size and agreement report."""
+    t0 = time.perf_counter()
+    idx = memory_store._idx(write=True)
+    with idx._lock:
+        M, meta, emotions, intents = idx.snapshot()
+        weights = np.asarray(idx.weights[:len(M)], dtype=np.float32)
+        generation = idx.generation
+    n0 = len(M)
+    report: Dict[str, Any] = {"rows_before": n0, "bytes_before": _bytes(idx)}
+    M = np.asarray(M, dtype=np.float32)
+    ts = _timestamps(meta)
+    emo, emo_names = _codes(emotions)
+    inte, int_names = _codes(intents)
+    keys = emo * (len(int_names) or 1) + inte
+
+    # 1. age cap
+    keep = np.arange(n0)
+    if max_age_days > 0:
+        keep = keep[ts >= time.time() - max_age_days * 86400]
+    report["dropped_age"] = n0 - len(keep)
+
+    # 2. near-duplicates: the newest copy survives
+    newest_first = keep[np.argsort(-ts[keep], kind="stable")]
+    if dedup_sim < 1.0 and len(keep):
+        lead = _leaders(M, newest_first, keys, dedup_sim)
+        keep = np.sort(keep[lead[keep] == keep])
+    report["dropped_duplicates"] = n0 - report["dropped_age"] - len(keep)
+
+    # 3. prototypes
+    out_meta: List[Dict[str, Any]] = []
+    out_vecs: List[np.ndarray] = []
+    out_w: List[float] = []
+    lead = np.arange(n0)
+    if proto_sim > 0 and len(keep):
+        lead = _leaders(M, keep[np.argsort(-ts[keep], kind="stable")], keys, proto_sim)
+    members: Dict[int, np.ndarray] = {}
+    if proto_sim > 0:
+        leaders, counts = np.unique(lead[keep], return_counts=True)
+        for l in leaders[counts >= max(proto_min, 2)]:
+            members[int(l)] = keep[lead[keep] == l]
+    for r in keep:
+        l = int(lead[r])
+        if l not in members:
+            out_meta.append(meta[r]); out_vecs.append(M[r]); out_w.append(float(weights[r]))
+        elif l == r:
+            rows = members[l]
+            v = (weights[rows, None] * M[rows]).sum(axis=0)
+            w = float(weights[rows].sum())
+            out_meta.append({**meta[r], "weight": w, "added_at": meta[rows[np.argmax(ts[rows])]].get("added_at")})
+            out_vecs.append(v / max(float(np.linalg.norm(v)), 1e-12)); out_w.append(w)
+    report["prototypes"] = len(members)
+    report["merged_into_prototypes"] = int(sum(len(m) for m in members.values()))
+
+    # 4. size cap: newest first
+    n_out = len(out_meta)
+    if max_rows > 0 and n_out > max_rows:
+        out_ts = _timestamps(out_meta)
+        sel = np.sort(np.argsort(-out_ts, kind="stable")[:max_rows])
+        out_meta = [out_meta[i] for i in sel]; out_vecs = [out_vecs[i] for i in sel]; out_w = [out_w[i] for i in sel]
+    report["dropped_size_cap"] = n_out - len(out_meta)
+
+    M1 = np.asarray(out_vecs, dtype=np.float32).reshape(-1, M.shape[1] if n0 else 0)
+    names = {"emotion": {n: i for i, n in enumerate(emo_names)}, "intent": {n: i for i, n in enumerate(int_names)}}
+    lab1 = {t: np.asarray([names[t][m[t]] for m in out_meta], dtype=int) for t in names}
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(n0, size=min(probes, n0), replace=False)) if n0 else np.zeros(0, dtype=int)
+    report["knn_agreement"] = _agreement(M, {"emotion": emo, "intent": inte}, weights,
+                                         M1, lab1, np.asarray(out_w, dtype=np.float32), sample, dedup_sim)
+    report["rows_after"] = len(out_meta)
+    report["size_reduction"] = 1 - len(out_meta) / n0 if n0 else 0.0
+
+    if not dry_run and len(out_meta) < n0:
+        report["carried_over"] = idx.rewrite(out_meta, M1, n0, generation)
+        report["rows_after"] = len(idx)
+        report["bytes_after"] = _bytes(idx)
+    report["dry_run"] = dry_run
+    report["seconds"] = time.perf_counter() - t0
+    return report
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Dedup / consolidate / cap the memory store")
+    ap.add_argument("--dedup", type=float, default=DEDUP_SIM, help="cosine; 1 disables")
+    ap.add_argument("--prototypes", type=float, default=PROTO_SIM, help="cluster cosine; 0 disables")
+    ap.add_argument("--proto-min", type=int, default=PROTO_MIN)
+    ap.add_argument("--max-age-days", type=float, default=MAX_AGE_DAYS)
+    ap.add_argument("--max-rows", type=int, default=MAX_ROWS)
+    ap.add_argument("--probes", type=int, default=PROBES)
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--partition", default=None, help="property key; default: the global store")
+    args = ap.parse_args()
+    with partitions.use(args.partition):
+        rep = compact(args.dedup, args.prototypes, args.proto_min, args.max_age_days, args.max_rows,
+                      args.probes, args.dry_run)
+    print(json.dumps(rep, indent=2))
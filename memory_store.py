@@ -1,19 +1,32 @@
 # memory_store.py
-import os, json
+import os, json, threading, atexit, itertools
+from contextlib import contextmanager
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from typing import Any, Dict, List, Literal
 import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
-# Embeddings
-from sentence_transformers import SentenceTransformer
+# Embeddings (shared MiniLM + LRU cache)
+import embeddings
+from lazy import Lazy
+from memory_ann import make_searcher
+import partitions
 
 # ---- config ----
 DB_PATH = os.getenv("MEMORY_FILE", "memory.jsonl")
-EMB_MODEL_NAME = os.getenv("MEM_EMB_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-
-# load emb model once
-_emb_model = SentenceTransformer(EMB_MODEL_NAME)
+# "jsonl" keeps everything in DB_PATH; "npy" stores raw float32 vectors in VEC_PATH
+# (memory-mapped, shared across worker processes) and the rest in META_PATH
+BACKEND = os.getenv("MEM_BACKEND", "jsonl")
+VEC_PATH = os.getenv("MEM_VEC_FILE", os.path.splitext(DB_PATH)[0] + ".f32")
+META_PATH = os.getenv("MEM_META_FILE", os.path.splitext(DB_PATH)[0] + ".meta.jsonl")
+# kNN backend: "exact" (matmul + argpartition), "hnsw" or "ivf" (FAISS, persisted in ANN_PATH)
+ANN = os.getenv("MEM_ANN", "exact")
+ANN_PATH = os.getenv("MEM_ANN_FILE", os.path.splitext(DB_PATH)[0] + f".{ANN}.faiss")
+EMB_MODEL_NAME = embeddings.EMB_MODEL_NAME
 
 # ---- types ----
 EmotionLabel = Literal["sadness", "joy", "love", "anger", "fear", "surprise", "neutral"]
@@ -28,32 +41,368 @@ class Example:
     tags: Dict[str, Any]
     added_at: str
     emb: List[float]  # unit-normalized vector
+    weight: float = 1.0  # kNN vote weight; > 1 for prototypes written by memory_compact
 
-# ---- io helpers ----
-def _load_all() -> List[Example]:
-    if not os.path.exists(DB_PATH):
-        return []
-    out: List[Example] = []
-    with open(DB_PATH, "r", encoding="utf-8") as f:
-        for line in f:
+# ---- file locking ----
+@contextmanager
+def _file_lock(path: str):
+    """
+    Exclusive advisory lock on path + ".lock", held while appending so writers in
+    other processes (uvicorn workers, bulk jobs) never interleave partial lines.
+    """
+    if fcntl is None:  # no flock on this platform; in-process lock only
+        yield
+        return
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _sync(f, fsync: bool) -> None:
+    if fsync:
+        f.flush()
+        os.fsync(f.fileno())
+
+# ---- resident index ----
+_generations = itertools.count()  # unique across indexes, so a switch of index is also a change
+
+class _MemoryIndex:
+    """
+    Process-resident view of DB_PATH: one contiguous float32 matrix plus parallel
+    label arrays. Loaded once, appended in place by add_example, and re-synced from
+    the file tail when another process appends (detected via size/mtime/inode).
+    """
+    def __init__(self, path: str, searcher=None):
+        self.path = path
+        self.searcher = searcher  # per-partition ANN searcher; None = the module-level one
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._M = np.zeros((0, 0), dtype=np.float32)  # capacity grows geometrically
+        self._n = 0
+        self.meta: List[Dict[str, Any]] = []  # text/emotion/intent/tags/added_at
+        self.emotions: List[str] = []
+        self.intents: List[str] = []
+        self.weights: List[float] = []
+        self._offset = 0   # bytes of DB_PATH already parsed
+        self._sig = None   # (inode, size, mtime_ns) at last sync
+        self.generation = next(_generations)  # changes when rows may have changed
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _append(self, recs: List[Dict[str, Any]]) -> None:
+        if not recs:
+            return
+        vecs = np.asarray([r.pop("emb") for r in recs], dtype=np.float32)
+        need = self._n + len(vecs)
+        if self._n == 0 or need > self._M.shape[0]:
+            cap = max(need, 2 * self._M.shape[0], 64)
+            M = np.empty((cap, vecs.shape[1]), dtype=np.float32)
+            if self._n:
+                M[:self._n] = self._M[:self._n]
+            self._M = M
+        self._M[self._n:need] = vecs
+        self._n = need
+        self.meta.extend(recs)
+        self.emotions.extend(r["emotion"] for r in recs)
+        self.intents.extend(r["intent"] for r in recs)
+        self.weights.extend(float(r.get("weight", 1.0)) for r in recs)
+
+    def _read_tail(self) -> None:
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1  # ignore a partially written last line
+        if end <= 0:
+            return
+        recs = [json.loads(line) for line in chunk[:end].splitlines() if line.strip()]
+        self._offset += end
+        self._ingest(recs)
+
+    def _ingest(self, recs: List[Dict[str, Any]]) -> None:
+        self._append(recs)
+
+    def refresh(self) -> None:
+        """Pick up external changes: read only the new tail, or reload if the file was replaced."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                if self._n or self._offset:
+                    self._reset()
+                return
+            sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+            if sig == self._sig:
+                return
+            if (self._sig is not None and st.st_ino != self._sig[0]) or st.st_size <= self._offset:
+                self._reset()  # replaced, truncated or rewritten in place
+            self._read_tail()
+            self._sig = sig
+
+    def append(self, rec: Dict[str, Any]) -> None:
+        self.append_many([rec])
+
+    def append_many(self, recs: List[Dict[str, Any]], fsync: bool = False) -> None:
+        """
+        Append records to DB_PATH in one write (under the cross-process lock) and to
+        the resident arrays without re-reading the file.
+        """
+        if not recs:
+            return
+        data = b"".join((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in recs)
+        with self._lock, _file_lock(self.path):
+            self.refresh()
+            with open(self.path, "ab") as f:
+                f.write(data)
+                _sync(f, fsync)
+            st = os.stat(self.path)
+            if st.st_size == self._offset + len(data):
+                self._offset = st.st_size
+                self._sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+                self._append([dict(r) for r in recs])
+            # otherwise someone else appended concurrently; next refresh() reads the tail
+
+    def snapshot(self):
+        """Consistent (matrix, meta, emotions, intents) view for lock-free scoring."""
+        with self._lock:
+            self.refresh()
+            n = self._n
+            return self._M[:n], self.meta[:n], self.emotions[:n], self.intents[:n]
+
+    def voting_snapshot(self):
+        """(matrix, emotions, intents, weights) for the kNN vote."""
+        with self._lock:
+            M, _, emotions, intents = self.snapshot()
+            return M, emotions, intents, self.weights[:len(M)]
+
+    def rewrite(self, meta: List[Dict[str, Any]], M: np.ndarray, seen: int, generation: int) -> int:
+        """
+        Atomically replace the store with (meta, M), a rewritten version of its first
+        seen rows as of generation. Rows other writers appended after those are
+        carried over unchanged. Readers keep their snapshot; other processes reload
+        on the next refresh() (the file is replaced, so its inode changes). Returns
+        the number of carried-over rows; raises RuntimeError if the store was
+        rewritten or cleared in the meantime.
+        """
+        with self._lock, _file_lock(self.path):
+            self.refresh()
+            if self.generation != generation or self._n < seen:
+                raise RuntimeError("memory store changed underneath the rewrite; rerun")
+            n = self._n
+            meta = list(meta) + self.meta[seen:n]
+            M = np.asarray(M, dtype=np.float32)
+            if n > seen:
+                M = np.vstack([M.reshape(-1, self._M.shape[1]), self._M[seen:n]])
+            self._write_files(meta, M)
+            self._reset()
+            self.refresh()
+            return n - seen
+
+    def _write_files(self, meta: List[Dict[str, Any]], M: np.ndarray) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for m, v in zip(meta, M):
+                f.write(json.dumps({**m, "emb": v.tolist()}, ensure_ascii=False) + "\n")
+            _sync(f, True)
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        with self._lock, _file_lock(self.path):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._reset()
+
+class _BinaryMemoryIndex(_MemoryIndex):
+    """
+    Same interface, binary layout: an append-only raw float32 file opened with
+    np.memmap plus a JSONL sidecar (text, labels, tags, added_at) whose first line
+    is a {"format": ..., "dim": d} header. Vectors are written before their sidecar
+    line, so a crash can only leave orphan vectors past the last sidecar row; the
+    next append truncates them away before writing, keeping row i at offset i * dim.
+    """
+    FORMAT = "mem-f32-v1"
+
+    def __init__(self, vec_path: str, meta_path: str, searcher=None):
+        self.vec_path = vec_path
+        super().__init__(meta_path, searcher)
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._dim = 0
+
+    def _ingest(self, recs: List[Dict[str, Any]]) -> None:
+        rows = []
+        for r in recs:
+            if "format" in r:
+                self._dim = int(r["dim"])
+                continue
+            rows.append(r)
+        self.meta.extend(rows)
+        self.emotions.extend(r["emotion"] for r in rows)
+        self.intents.extend(r["intent"] for r in rows)
+        self.weights.extend(float(r.get("weight", 1.0)) for r in rows)
+        n = len(self.meta)
+        if n and self._dim:
+            # re-mapping is cheap; pages stay in the shared OS page cache
+            self._M = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, self._dim))
+        self._n = n
+
+    def append_many(self, recs: List[Dict[str, Any]], fsync: bool = False) -> None:
+        if not recs:
+            return
+        recs = [dict(r) for r in recs]
+        vecs = np.asarray([r.pop("emb") for r in recs], dtype=np.float32)
+        with self._lock, _file_lock(self.path):
+            self.refresh()
+            if not os.path.exists(self.path) or not os.path.getsize(self.path):
+                _write_binary_header(self.path, vecs.shape[1])
+            end = len(self.meta) * vecs.shape[1] * 4
+            if os.path.exists(self.vec_path) and os.path.getsize(self.vec_path) > end:
+                os.truncate(self.vec_path, end)  # orphans of a crashed append
+            with open(self.vec_path, "ab") as f:
+                f.write(vecs.tobytes())
+                _sync(f, fsync)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs))
+                _sync(f, fsync)
+            self.refresh()
+
+    def _write_files(self, meta: List[Dict[str, Any]], M: np.ndarray) -> None:
+        # vectors first: readers only re-map after the sidecar changes, and the lock keeps writers out
+        with open(self.vec_path + ".tmp", "wb") as f:
+            f.write(np.ascontiguousarray(M, dtype=np.float32).tobytes())
+            _sync(f, True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json.dumps({"format": self.FORMAT, "dim": int(M.shape[1])}) + "\n")
+            f.write("".join(json.dumps(m, ensure_ascii=False) + "\n" for m in meta))
+            _sync(f, True)
+        os.replace(self.vec_path + ".tmp", self.vec_path)
+        os.replace(self.path + ".tmp", self.path)
+
+    def clear(self) -> None:
+        with self._lock, _file_lock(self.path):
+            if os.path.exists(self.vec_path):
+                os.remove(self.vec_path)
+            # keep an empty sidecar so the legacy JSONL is not migrated back in
+            open(self.path, "w").close()
+            self._reset()
+
+def _write_binary_header(meta_path: str, dim: int) -> None:
+    with open(meta_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"format": _BinaryMemoryIndex.FORMAT, "dim": dim}) + "\n")
+
+def migrate_jsonl_to_binary(src: str = DB_PATH, vec_path: str = VEC_PATH, meta_path: str = META_PATH) -> int:
+    """
+    One-shot conversion of a JSONL memory into the binary layout. Writes to temp
+    files and renames them into place. Returns the number of migrated rows.
+    """
+    tmp_vec, tmp_meta = vec_path + ".tmp", meta_path + ".tmp"
+    n = 0
+    with open(src, "r", encoding="utf-8") as fin, open(tmp_vec, "wb") as fv, \
+         open(tmp_meta, "w", encoding="utf-8") as fm:
+        dim = None
+        for line in fin:
             line = line.strip()
             if not line:
                 continue
-            out.append(Example(**json.loads(line)))
-    return out
+            rec = json.loads(line)
+            vec = np.asarray(rec.pop("emb"), dtype=np.float32)
+            if dim is None:
+                dim = len(vec)
+                fm.write(json.dumps({"format": _BinaryMemoryIndex.FORMAT, "dim": dim}) + "\n")
+            fv.write(vec.tobytes())
+            fm.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n += 1
+    os.replace(tmp_vec, vec_path)
+    os.replace(tmp_meta, meta_path)
+    return n
+
+def _make_index(db_path: str = DB_PATH, vec_path: str = VEC_PATH, meta_path: str = META_PATH,
+                searcher=None) -> _MemoryIndex:
+    if BACKEND == "npy":
+        if not os.path.exists(meta_path) and os.path.exists(db_path):
+            migrate_jsonl_to_binary(db_path, vec_path, meta_path)
+        return _BinaryMemoryIndex(vec_path, meta_path, searcher)
+    return _MemoryIndex(db_path, searcher)
+
+def _load_index() -> _MemoryIndex:
+    idx = _make_index()
+    idx.refresh()  # parse the file now rather than on the first query
+    return idx
+
+_index = Lazy("memory", _load_index)
+_searcher = make_searcher(ANN, ANN_PATH)
+atexit.register(_searcher.save)
+
+# ---- partitions ----
+def _load_partition(key: str) -> _MemoryIndex:
+    os.makedirs(os.path.join(partitions.PARTITION_DIR, key), exist_ok=True)
+    idx = _make_index(partitions.path(key, "memory.jsonl"), partitions.path(key, "memory.f32"),
+                      partitions.path(key, "memory.meta.jsonl"),
+                      make_searcher(ANN, partitions.path(key, f"memory.{ANN}.faiss")))
+    idx.refresh()
+    return idx
+
+def _resident_bytes(idx: _MemoryIndex) -> int:
+    # vectors (a memmap counts too: its pages are what the partition keeps hot) + ~300 B of Python per row
+    return int(idx._M.nbytes) + 300 * len(idx)
+
+def _partition_index(key: str) -> _MemoryIndex:
+    return partitions.get_cache().get("memory", key, lambda: _load_partition(key), _resident_bytes,
+                                      lambda idx: idx.searcher.save())
+
+atexit.register(partitions.get_cache().close)
+
+def _idx(write: bool = False) -> _MemoryIndex:
+    """
+    Memory index of the current partition (partitions.use), or the global one.
+    Reads of a partition with too few rows go to the global index when
+    PARTITION_GLOBAL_FALLBACK=1; writes always stay in the partition.
+    """
+    key = partitions.current()
+    if key is None:
+        return _index.get()
+    idx = _partition_index(key)
+    if not write and partitions.GLOBAL_FALLBACK and len(idx) < partitions.FALLBACK_MIN_ROWS:
+        return _index.get()
+    return idx
+
+def _topk(idx: _MemoryIndex, M: np.ndarray, Q: np.ndarray, k: int) -> np.ndarray:
+    # (n, d) unit queries -> (n, k) row indices, best first; ANN indexes (HNSW/IVF)
+    # pad rows they could not fill with -1, which callers must drop (see _valid)
+    return (idx.searcher or _searcher).search(M, Q, k, idx.generation)
+
+def _valid(row: np.ndarray) -> np.ndarray:
+    return row[row >= 0]
+
+def _to_example(meta: Dict[str, Any], vec: np.ndarray) -> Example:
+    return Example(**meta, emb=vec.tolist())
+
+# ---- io helpers ----
+def _load_all() -> List[Example]:
+    M, meta, _, _ = _idx().snapshot()
+    return [_to_example(m, M[i]) for i, m in enumerate(meta)]
 
 def _save_one(ex: Example) -> None:
-    with open(DB_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(asdict(ex), ensure_ascii=False) + "\n")
+    _idx(write=True).append(asdict(ex))
 
 # ---- public api ----
-def add_example(text: str, emotion: str, intent: str, tags: Dict[str, Any]) -> None:
+def _unit(text: str, emb: np.ndarray | None) -> np.ndarray:
+    # emb: precomputed unit vector from embeddings.embed (avoids a second forward pass)
+    return embeddings.embed(text)[1] if emb is None else emb
+
+def add_example(text: str, emotion: str, intent: str, tags: Dict[str, Any],
+                emb: np.ndarray | None = None) -> None:
     """
     Store a labeled example with its embedding. Call this when you're confident
     the labels are correct (e.g., after human feedback or high-confidence predictions).
     """
     # compute normalized embedding
-    vec = _emb_model.encode(text, normalize_embeddings=True).tolist()
+    vec = _unit(text, emb).tolist()
     ex = Example(
         text=text,
         emotion=emotion,
@@ -64,35 +413,130 @@ def add_example(text: str, emotion: str, intent: str, tags: Dict[str, Any]) -> N
     )
     _save_one(ex)
 
-def top_k_similar(text: str, k: int = 3) -> List[Example]:
+def add_examples(rows: List[Dict[str, Any]], fsync: bool = False) -> None:
+    """
+    Batched add_example: rows are dicts with text/emotion/intent/tags and optionally
+    a precomputed unit "emb"; the rest are encoded in one call. All rows go to disk
+    in one locked write (fsync=True also forces them to stable storage).
+    """
+    if not rows:
+        return
+    missing = [r["text"] for r in rows if r.get("emb") is None]
+    fresh = iter(embeddings.embed_batch(missing)[1]) if missing else iter(())
+    vecs = [next(fresh) if r.get("emb") is None else r["emb"] for r in rows]
+    now = datetime.utcnow().isoformat()
+    _idx(write=True).append_many([
+        asdict(Example(text=r["text"], emotion=r["emotion"], intent=r["intent"],
+                       tags=r.get("tags") or {}, added_at=r.get("added_at") or now,
+                       emb=np.asarray(vec, dtype=np.float32).tolist()))
+        for r, vec in zip(rows, vecs)], fsync=fsync)
+
+def max_similarity(Q: np.ndarray, for_write: bool = False) -> np.ndarray:
+    """
+    Cosine similarity of each (n, d) unit query to its nearest stored example (-1
+    if empty); for_write compares against the index writes go to (never the global
+    fallback of a partition).
+    """
+    index = _idx(for_write)
+    M, _, _, _ = index.snapshot()
+    if not len(M):
+        return np.full(len(Q), -1.0, dtype=np.float32)
+    idx = _topk(index, M, Q, 1)[:, 0]
+    sims = np.einsum("ij,ij->i", M[np.maximum(idx, 0)], Q)
+    return np.where(idx >= 0, sims, np.float32(-1.0))
+
+def top_k_similar(text: str, k: int = 3, emb: np.ndarray | None = None) -> List[Example]:
     """
     Return the k most similar stored examples using cosine similarity in embedding space.
     """
-    allx = _load_all()
-    if not allx:
+    index = _idx()
+    M, meta, _, _ = index.snapshot()
+    if not meta:
         return []
-    q = _emb_model.encode(text, normalize_embeddings=True)
-    M = np.array([e.emb for e in allx], dtype=np.float32)  # (N, d)
+    q = _unit(text, emb)
     # cosine because both q and rows are normalized
-    sims = M @ q  # (N,)
-    idx = np.argsort(-sims)[:k]
-    return [allx[i] for i in idx]
+    idx = _valid(_topk(index, M, q[None, :], k)[0])
+    return [_to_example(meta[i], M[i]) for i in idx]
 
-def label_dist(text: str, task: Literal["emotion", "intent"], k: int = 5) -> Dict[str, float]:
+def label_dist(text: str, task: Literal["emotion", "intent"], k: int = 5,
+               emb: np.ndarray | None = None) -> Dict[str, float]:
     """
     kNN label distribution: counts labels among top-k similar examples.
     """
-    exs = top_k_similar(text, k=k)
-    if not exs:
+    index = _idx()
+    M, emotions, intents, weights = index.voting_snapshot()
+    if not len(M):
         return {}
-    if task == "emotion":
-        labels = [e.emotion for e in exs]
-    else:
-        labels = [e.intent for e in exs]
-    # distribution
-    counts: Dict[str, int] = {}
-    for lab in labels:
-        counts[lab] = counts.get(lab, 0) + 1
+    q = _unit(text, emb)
+    idx = _valid(_topk(index, M, q[None, :], k)[0])
+    arr = emotions if task == "emotion" else intents
+    return _dist([arr[i] for i in idx], [weights[i] for i in idx], k)
+
+def label_dist_batch(texts: List[str], task: Literal["emotion", "intent"], k: int = 5,
+                     embs: np.ndarray | None = None) -> List[Dict[str, float]]:
+    """
+    label_dist for many texts: one encode call and one (n, d) x (d, N) product
+    (or one batched ANN search).
+    """
+    index = _idx()
+    M, emotions, intents, weights = index.voting_snapshot()
+    if not len(M):
+        return [{} for _ in texts]
+    Q = embeddings.embed_batch(list(texts))[1] if embs is None else embs
+    idx = _topk(index, M, Q, k)  # (n, k)
+    arr = emotions if task == "emotion" else intents
+    return [_dist([arr[i] for i in row], [weights[i] for i in row], k) for row in map(_valid, idx)]
+
+def knn_batch(embs: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+    """
+    One memory search serving both tasks: per (n, d) unit query, the cosine of the
+    nearest and of the k-th nearest stored row ("sim", "kth"; -1 if memory is
+    empty), the emotion and intent label distributions over the k nearest, and
+    "n", the neighbour votes behind those distributions (prototypes count their
+    weight, capped at k).
+    kth is also -1 while fewer than k rows come back: any new row joins the top k.
+    """
+    index = _idx()
+    M, emotions, intents, weights = index.voting_snapshot()
+    if not len(M):
+        return [{"sim": -1.0, "kth": -1.0, "n": 0.0, "emotion": {}, "intent": {}} for _ in range(len(embs))]
+    idx = _topk(index, M, embs, k)
+    sims = np.einsum("ikd,id->ik", M[np.maximum(idx, 0)], embs)  # best first
+    out = []
+    for s, row in zip(sims, idx):
+        s, row = s[row >= 0], row[row >= 0]
+        if not len(row):
+            out.append({"sim": -1.0, "kth": -1.0, "n": 0.0, "emotion": {}, "intent": {}})
+            continue
+        w = [weights[i] for i in row]
+        kth = float(s[-1]) if len(row) >= k else -1.0
+        out.append({"sim": float(s[0]), "kth": kth, "n": float(min(sum(w), k)),
+                    "emotion": _dist([emotions[i] for i in row], w, k),
+                    "intent": _dist([intents[i] for i in row], w, k)})
+    return out
+
+def version() -> tuple:
+    """(generation, rows) of the index serving reads: generation changes when rows may have been removed or rewritten, or another index takes over; otherwise rows only grow."""
+    idx = _idx()
+    idx.refresh()
+    return idx.generation, len(idx)
+
+def rows(start: int, end: int) -> np.ndarray:
+    """Unit vectors of stored rows [start, end), e.g. the ones appended since version() was taken."""
+    M, _, _, _ = _idx().snapshot()
+    return M[start:end]
+
+def _dist(labels: List[str], weights: List[float] | None = None, k: int | None = None) -> Dict[str, float]:
+    # labels best first; each row fills min(weight, slots left) of the k vote slots, so a
+    # prototype (weight = rows it replaced) counts like its nearest members would have
+    slots = float(len(labels) if k is None else k)
+    counts: Dict[str, float] = {}
+    for lab, w in zip(labels, weights or [1.0] * len(labels)):
+        take = min(w, slots)
+        if take <= 0:
+            break
+        counts[lab] = counts.get(lab, 0) + take
+        slots -= take
     total = sum(counts.values()) or 1
     return {lab: counts[lab] / total for lab in counts}
 
@@ -101,5 +545,11 @@ def all_examples() -> List[Dict[str, Any]]:
     return [asdict(e) for e in _load_all()]
 
 def clear_memory() -> None:
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
+    _idx(write=True).clear()
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["migrate"]:
+        print(f"migrated {migrate_jsonl_to_binary()} rows -> {VEC_PATH}, {META_PATH}")
+    else:
+        print("usage: python memory_store.py migrate")
@@ -0,0 +1,193 @@
+# file: memory_writer.py
+import os, queue, threading, time, atexit
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+import embeddings
+import memory_store
+import partitions
+
+# ---- config ----
+QUEUE_SIZE = int(os.getenv("MEM_WRITE_QUEUE", "10000"))   # rows; beyond this writes are dropped
+MAX_BATCH = int(os.getenv("MEM_WRITE_BATCH", "256"))      # rows per group commit
+FLUSH_MS = float(os.getenv("MEM_WRITE_FLUSH_MS", "200"))  # max wait after the first queued row
+# "batch": fsync every group commit, "interval": at most every FSYNC_INTERVAL_S, "never": leave it to the OS
+FSYNC = os.getenv("MEM_FSYNC", "batch")
+FSYNC_INTERVAL_S = float(os.getenv("MEM_FSYNC_INTERVAL_S", "1.0"))
+# rows whose embedding is this close (cosine) to a stored or already-queued row are skipped; > 1 disables
+DEDUP_SIM = float(os.getenv("MEM_DEDUP_SIM", "0.98"))
+
+class MemoryWriter:
+    """
+    Non-blocking write path for auto-stored examples. submit() only enqueues
+    (dropping rows when the bounded queue is full, so a slow disk never stalls a
+    request); one flusher thread drains up to max_batch rows at a time, skips
+    near-duplicates, and writes the rest with a single locked append per batch
+    (group commit) under the configured fsync policy. Rows remember the partition
+    they were submitted from and are committed to it.
+    """
+    def __init__(self, maxsize: int = QUEUE_SIZE, max_batch: int = MAX_BATCH,
+                 flush_ms: float = FLUSH_MS, fsync: str = FSYNC, dedup_sim: float = DEDUP_SIM):
+        self.max_batch = max_batch
+        self.flush_s = flush_ms / 1000.0
+        self.fsync = fsync
+        self.dedup_sim = dedup_sim
+        self._q: queue.Queue = queue.Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_fsync = 0.0
+        # metrics
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0      # queue full
+        self.deduped = 0
+        self.errors = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.last_flush_ms = 0.0
+
+    def submit(self, rows: List[Dict[str, Any]]) -> int:
+        """Queue rows for storage in the current partition; returns how many were accepted."""
+        self._ensure_started()
+        key = partitions.current()
+        ok = 0
+        for r in rows:
+            try:
+                self._q.put_nowait((key, r))
+                ok += 1
+            except queue.Full:
+                self.dropped += 1
+        self.submitted += ok
+        return ok
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+                self._thread.start()
+
+    def _take(self) -> list:
+        try:
+            batch = [self._q.get(timeout=self.flush_s)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or self._stop.is_set():
+                # shutting down: take whatever is already queued without waiting
+                try:
+                    batch.append(self._q.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._q.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take()
+            if batch:
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    self.errors += len(batch)
+                    print("Memory writer error:", repr(e))
+                finally:
+                    for _ in batch:
+                        self._q.task_done()
+            elif self._stop.is_set():
+                return
+
+    def _dedup(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # exact text repeats inside the batch first, then near-duplicates by cosine
+        seen, uniq = set(), []
+        for r in rows:
+            key = embeddings.norm_text(r["text"])
+            if key not in seen:
+                seen.add(key)
+                uniq.append(r)
+        if self.dedup_sim > 1.0:
+            return uniq
+        missing = [i for i, r in enumerate(uniq) if r.get("emb") is None]
+        if missing:
+            fresh = embeddings.embed_batch([uniq[i]["text"] for i in missing])[1]
+            for i, v in zip(missing, fresh):
+                uniq[i]["emb"] = v
+        U = np.asarray([r["emb"] for r in uniq], dtype=np.float32)
+        keep = memory_store.max_similarity(U, for_write=True) < self.dedup_sim
+        S = U @ U.T
+        for i in range(len(uniq)):
+            if keep[i] and i and (S[i, :i][keep[:i]] >= self.dedup_sim).any():
+                keep[i] = False
+        return [r for r, k in zip(uniq, keep) if k]
+
+    def _want_fsync(self) -> bool:
+        if self.fsync == "batch":
+            return True
+        if self.fsync == "interval" and time.monotonic() - self._last_fsync >= FSYNC_INTERVAL_S:
+            return True
+        return False
+
+    def _commit(self, batch: list) -> None:
+        t0 = time.perf_counter()
+        groups: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for key, r in batch:
+            groups.setdefault(key, []).append(r)
+        fsync = self._want_fsync()
+        synced = False
+        for key, group in groups.items():
+            with partitions.use(key):
+                rows = self._dedup(group)
+                self.deduped += len(group) - len(rows)
+                if rows:
+                    memory_store.add_examples(rows, fsync=fsync)
+                    synced = synced or fsync
+                    self.written += len(rows)
+        if synced:
+            self.fsyncs += 1
+            self._last_fsync = time.monotonic()
+        self.batches += 1
+        self.last_flush_ms = 1000 * (time.perf_counter() - t0)
+
+    def flush(self) -> None:
+        """Block until every row submitted so far is committed (or dropped as a duplicate)."""
+        if self._thread is not None:
+            self._q.join()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Drain the queue and stop the flusher (called on shutdown)."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._q.qsize(),
+            "queue_size": self._q.maxsize,
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "deduped": self.deduped,
+            "errors": self.errors,
+            "batches": self.batches,
+            "avg_batch_size": (self.written + self.deduped) / self.batches if self.batches else 0.0,
+            "fsyncs": self.fsyncs,
+            "fsync_policy": self.fsync,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+_writer = MemoryWriter()
+atexit.register(_writer.close)
+
+def get_writer() -> MemoryWriter:
+    return _writer
@@ -0,0 +1,140 @@
+# file: metrics.py
+import os, time, random, threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ---- config ----
+ENABLED = os.getenv("METRICS", "1") == "1"
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "0"))      # fraction of requests that record spans
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "200"))      # most recent sampled traces kept for /traces
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative-bucket histogram per label value, rendered in the Prometheus text format."""
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name, self.help, self.label, self.buckets = name, help, label, buckets
+        self._lock = threading.Lock()
+        self._series: Dict[str, List[float]] = {}  # value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: str, seconds: float) -> None:
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            s = self._series.get(value)
+            if s is None:
+                s = self._series[value] = [0.0] * (len(self.buckets) + 2)
+            s[i] += 1
+            s[-1] += seconds
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for value, s in sorted(series.items()):
+            lab = f'{self.label}="{value}"'
+            acc = 0.0
+            for b, c in zip(self.buckets, s):
+                acc += c
+                out.append(f'{self.name}_bucket{{{lab},le="{b}"}} {acc:g}')
+            acc += s[len(self.buckets)]
+            out.append(f'{self.name}_bucket{{{lab},le="+Inf"}} {acc:g}')
+            out.append(f"{self.name}_sum{{{lab}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{lab}}} {acc:g}")
+        return out
+
+class Counter:
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name, self.help, self.label = name, help, label
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def inc(self, n: float = 1.0, value: str = "") -> None:
+        with self._lock:
+            self._values[value] = self._values.get(value, 0.0) + n
+
+    def get(self, value: str = "") -> float:
+        return self._values.get(value, 0.0)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for value, v in items:
+            out.append(f'{self.name}{{{self.label}="{value}"}} {v:g}' if self.label else f"{self.name} {v:g}")
+        return out
+
+STAGE_SECONDS = Histogram("router_stage_seconds", "Wall time of one router stage call (a call covers a whole batch).", "stage")
+STAGE_ITEMS = Counter("router_stage_items_total", "Texts processed per router stage.", "stage")
+TEXTS = Counter("router_texts_total", "Texts classified by the router.")
+INTENT_SOURCE = Counter("router_intent_source_total", "Final intent source per text.", "source")
+
+# ---- tracing ----
+_trace: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("trace", default=None)
+_traces: deque = deque(maxlen=TRACE_BUFFER)
+
+@contextmanager
+def _timed(name: str, n: int):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(name, dt)
+        STAGE_ITEMS.inc(n, name)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append({"stage": name, "start_ms": round((t0 - spans[0]["t0"]) * 1000, 3),
+                          "ms": round(dt * 1000, 3), "n": n})
+
+_NOOP = nullcontext()
+
+def stage(name: str, n: int = 1):
+    """Context manager timing one stage call over n texts; a shared no-op when METRICS=0."""
+    return _timed(name, n) if ENABLED else _NOOP
+
+@contextmanager
+def _traced(name: str, n: int):
+    spans = [{"t0": time.perf_counter()}]
+    token = _trace.set(spans)
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+        head = spans.pop(0)
+        _traces.append({"name": name, "n": n, "at": time.time(),
+                        "ms": round((time.perf_counter() - head["t0"]) * 1000, 3), "spans": spans})
+
+def trace(name: str, n: int = 1):
+    """Start a sampled trace (TRACE_SAMPLE) that collects the stage() spans run inside it."""
+    if ENABLED and TRACE_SAMPLE > 0 and _trace.get() is None and random.random() < TRACE_SAMPLE:
+        return _traced(name, n)
+    return _NOOP
+
+def recent_traces(limit: int = 50) -> List[Dict[str, Any]]:
+    return list(_traces)[-limit:]
+
+# ---- exposition ----
+_gauges: List[Tuple[str, str, Callable[[], Dict[str, float]]]] = []
+
+def gauge(name: str, help: str, fn: Callable[[], Any]) -> None:
+    """Register a gauge computed at scrape time; fn returns a number or {label_text: number}."""
+    _gauges.append((name, help, fn))
+
+def render() -> str:
+    lines: List[str] = []
+    for m in (STAGE_SECONDS, STAGE_ITEMS, TEXTS, INTENT_SOURCE):
+        lines += m.render()
+    for name, help, fn in _gauges:
+        try:
+            v = fn()
+        except Exception as e:
+            print("Metrics gauge error:", name, repr(e))
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        if isinstance(v, dict):
+            lines += [f"{name}{{{k}}} {float(x):g}" for k, x in v.items()]
+        else:
+            lines.append(f"{name} {float(v):g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,187 @@
+# file: onnx_backend.py
+"""
+ONNX Runtime CPU backend for the emotion classifier and the MiniLM encoder.
+Select it with INFER_BACKEND=onnx. Models are exported once into ONNX_DIR
+(optimum), dynamically quantized to int8 (onnxruntime.quantization) and served
+through onnxruntime with ORT_INTRA_OP_THREADS threads.
+
+  python onnx_backend.py export            # export + quantize both models
+  python onnx_backend.py parity [N]        # compare against PyTorch on intent_dataset_450.csv
+"""
+import os, json, time
+import numpy as np
+
+ONNX_DIR = os.getenv("ONNX_DIR", "onnx_models")
+ORT_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))  # 0 = onnxruntime default
+QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") == "1"
+BATCH = 64
+
+def _dir(model_name: str) -> str:
+    return os.path.join(ONNX_DIR, model_name.replace("/", "__"))
+
+def _model_file(d: str) -> str:
+    q = os.path.join(d, "model_int8.onnx")
+    return q if QUANTIZE and os.path.exists(q) else os.path.join(d, "model.onnx")
+
+# ---- export ----
+def export(model_name: str, kind: str) -> str:
+    """kind: "classifier" (sequence classification) or "encoder" (sentence-transformers)."""
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTModelForFeatureExtraction
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from transformers import AutoTokenizer
+
+    out = _dir(model_name)
+    cls = ORTModelForSequenceClassification if kind == "classifier" else ORTModelForFeatureExtraction
+    cls.from_pretrained(model_name, export=True).save_pretrained(out)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(out)
+    if kind == "encoder":
+        # keep the sentence-transformers head (pooling, normalize, max length) outside the graph
+        from sentence_transformers import SentenceTransformer
+        st = SentenceTransformer(model_name)
+        cfg = {"pooling": st[1].get_pooling_mode_str(),
+               "normalize": any(type(m).__name__ == "Normalize" for m in st),
+               "max_seq_length": st.max_seq_length,
+               "dim": st.get_sentence_embedding_dimension()}
+        with open(os.path.join(out, "st_config.json"), "w") as f:
+            json.dump(cfg, f)
+    quantize_dynamic(os.path.join(out, "model.onnx"), os.path.join(out, "model_int8.onnx"),
+                     weight_type=QuantType.QInt8)
+    return out
+
+def _ensure(model_name: str, kind: str) -> str:
+    d = _dir(model_name)
+    if not os.path.exists(os.path.join(d, "model.onnx")):
+        export(model_name, kind)
+    return d
+
+def _session(path: str):
+    import onnxruntime as ort
+    so = ort.SessionOptions()
+    if ORT_THREADS:
+        so.intra_op_num_threads = ORT_THREADS
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, so, providers=["CPUExecutionProvider"])
+
+def _feed(sess_inputs: set, enc) -> dict:
+    return {k: np.asarray(v, dtype=np.int64) for k, v in enc.items() if k in sess_inputs}
+
+# ---- runtime ----
+class OrtTextClassifier:
+    """Drop-in for pipeline("text-classification", return_all_scores=True)."""
+    def __init__(self, model_name: str):
+        from transformers import AutoConfig, AutoTokenizer
+        d = _ensure(model_name, "classifier")
+        self.tok = AutoTokenizer.from_pretrained(d)
+        cfg = AutoConfig.from_pretrained(d)
+        self.labels = [cfg.id2label[i] for i in range(len(cfg.id2label))]
+        self.sess = _session(_model_file(d))
+        self.inputs = {i.name for i in self.sess.get_inputs()}
+
+    def __call__(self, texts, **kw):
+        if isinstance(texts, str):
+            texts = [texts]
+        out, bs = [], kw.get("batch_size") or BATCH
+        for s in range(0, len(texts), bs):
+            enc = self.tok(texts[s:s + bs], padding=True, truncation=True, return_tensors="np")
+            logits = self.sess.run(None, _feed(self.inputs, enc))[0]
+            e = np.exp(logits - logits.max(axis=1, keepdims=True))
+            p = e / e.sum(axis=1, keepdims=True)
+            out.extend([{"label": l, "score": float(v)} for l, v in zip(self.labels, row)] for row in p)
+        return out
+
+class OrtSentenceEncoder:
+    """Drop-in for the SentenceTransformer.encode calls used in this repo."""
+    def __init__(self, model_name: str):
+        from transformers import AutoTokenizer
+        d = _ensure(model_name, "encoder")
+        with open(os.path.join(d, "st_config.json")) as f:
+            self.cfg = json.load(f)
+        self.tok = AutoTokenizer.from_pretrained(d)
+        self.sess = _session(_model_file(d))
+        self.inputs = {i.name for i in self.sess.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self.cfg["dim"])
+
+    def encode(self, sentences, normalize_embeddings: bool = False, **kw) -> np.ndarray:
+        one = isinstance(sentences, str)
+        sentences = [sentences] if one else list(sentences)
+        parts = []
+        for s in range(0, len(sentences), BATCH):
+            enc = self.tok(sentences[s:s + BATCH], padding=True, truncation=True,
+                           max_length=self.cfg["max_seq_length"], return_tensors="np")
+            hidden = self.sess.run(None, _feed(self.inputs, enc))[0]  # (n, T, d)
+            if self.cfg["pooling"] == "cls":
+                v = hidden[:, 0]
+            else:
+                mask = enc["attention_mask"][..., None].astype(np.float32)
+                v = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            parts.append(v.astype(np.float32))
+        v = np.concatenate(parts) if parts else np.zeros((0, self.get_sentence_embedding_dimension()), np.float32)
+        if self.cfg["normalize"] or normalize_embeddings:
+            v = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+        return v[0] if one else v
+
+# ---- accuracy parity ----
+def parity(n: int | None = None, csv_path: str = "intent_dataset_450.csv") -> dict:
+    """
+    Run both backends over the dataset texts and report emotion top-1 agreement,
+    probability drift, embedding cosine and FAISS intent agreement, plus speed.
+    """
+    import pandas as pd
+    import faiss
+    from transformers import pipeline
+    from sentence_transformers import SentenceTransformer
+    from hf_baseline import HF_MODEL
+    from embeddings import EMB_MODEL_NAME
+
+    texts = pd.read_csv(csv_path)["text"].astype(str).tolist()[:n]
+
+    def timed(fn):
+        t0 = time.perf_counter()
+        r = fn()
+        return r, time.perf_counter() - t0
+
+    pt_clf = pipeline("text-classification", model=HF_MODEL, return_all_scores=True)
+    ort_clf = OrtTextClassifier(HF_MODEL)
+    pt_em, pt_em_s = timed(lambda: pt_clf(texts))
+    ort_em, ort_em_s = timed(lambda: ort_clf(texts))
+    P = np.array([[d["score"] for d in sorted(r, key=lambda d: d["label"])] for r in pt_em])
+    Q = np.array([[d["score"] for d in sorted(r, key=lambda d: d["label"])] for r in ort_em])
+
+    pt_enc = SentenceTransformer(EMB_MODEL_NAME)
+    ort_enc = OrtSentenceEncoder(EMB_MODEL_NAME)
+    A, pt_emb_s = timed(lambda: np.asarray(pt_enc.encode(texts), dtype=np.float32))
+    B, ort_emb_s = timed(lambda: ort_enc.encode(texts))
+    cos = (A * B).sum(1) / (np.linalg.norm(A, axis=1) * np.linalg.norm(B, axis=1))
+
+    index = faiss.read_index("intent_faiss.index")
+    _, Ia = index.search(A, 1)
+    _, Ib = index.search(B, 1)
+
+    report = {
+        "n": len(texts),
+        "quantized": QUANTIZE,
+        "emotion_top1_agreement": float((P.argmax(1) == Q.argmax(1)).mean()),
+        "emotion_prob_max_abs_diff": float(np.abs(P - Q).max()),
+        "emotion_prob_mean_abs_diff": float(np.abs(P - Q).mean()),
+        "embedding_cosine_mean": float(cos.mean()),
+        "embedding_cosine_min": float(cos.min()),
+        "intent_knn_agreement": float((Ia[:, 0] == Ib[:, 0]).mean()),
+        "emotion_texts_per_s": {"torch": len(texts) / pt_em_s, "onnx": len(texts) / ort_em_s},
+        "embedding_texts_per_s": {"torch": len(texts) / pt_emb_s, "onnx": len(texts) / ort_emb_s},
+    }
+    return report
+
+if __name__ == "__main__":
+    import sys
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "export":
+        from hf_baseline import HF_MODEL
+        from embeddings import EMB_MODEL_NAME
+        print(export(HF_MODEL, "classifier"))
+        print(export(EMB_MODEL_NAME, "encoder"))
+    elif cmd == "parity":
+        print(json.dumps(parity(int(sys.argv[2]) if len(sys.argv) > 2 else None), indent=2))
+    else:
+        print(__doc__)
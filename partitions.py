@@ -0,0 +1,164 @@
+# file: partitions.py
+"""
+Per-property partitions of the memory store and the intent index, for serving
+many hotels from one deployment.
+
+The partition key travels in a context variable (use(key)), so memory_store and
+intent_index resolve it themselves, and asyncio.to_thread hands it to worker
+threads. No key means the global store and index, as before. Each partition
+lives under PARTITION_DIR/<key>/:
+
+  memory.jsonl (or memory.f32 + memory.meta.jsonl with MEM_BACKEND=npy)
+  intent_index.npz   optional; python vector_db_intent.py --partition <key> --csv hotel.csv
+
+Partitions load on first use. They are kept in one LRU whose estimated
+resident size is held under PARTITION_BUDGET_MB; the check runs whenever a
+partition loads.
+
+Auto-stored rows always go to the request's own partition. Reads fall back to
+the shared global memory only when PARTITION_GLOBAL_FALLBACK=1 and the
+partition holds fewer than PARTITION_FALLBACK_MIN_ROWS rows. A partition
+without its own intent index uses the global dataset index, which holds no
+tenant data.
+"""
+import os, re, time, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# ---- config ----
+PARTITION_DIR = os.getenv("PARTITION_DIR", "partitions")
+BUDGET_MB = float(os.getenv("PARTITION_BUDGET_MB", "1024"))
+GLOBAL_FALLBACK = os.getenv("PARTITION_GLOBAL_FALLBACK", "0") == "1"
+FALLBACK_MIN_ROWS = int(os.getenv("PARTITION_FALLBACK_MIN_ROWS", "5"))
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")  # also a safe directory name
+_current: ContextVar[Optional[str]] = ContextVar("partition", default=None)
+
+def check(key: Optional[str]) -> Optional[str]:
+    """None/"" -> None (global); raises ValueError for keys that are not a plain name."""
+    if not key:
+        return None
+    if not _KEY_RE.match(key):
+        raise ValueError(f"invalid partition key: {key!r}")
+    return key
+
+def current() -> Optional[str]:
+    return _current.get()
+
+@contextmanager
+def use(key: Optional[str]):
+    """Run the block against partition key (None: global)."""
+    token = _current.set(check(key))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def path(key: str, name: str) -> str:
+    return os.path.join(PARTITION_DIR, key, name)
+
+class PartitionCache:
+    """
+    LRU of loaded per-partition components, keyed by (kind, partition). Every
+    entry reports its resident size through the sizeof function it was loaded
+    with. Whenever something loads, least recently used entries are evicted until
+    the total fits budget_mb; the newest entry always stays. Callers holding an
+    evicted value can keep using it, and on_evict runs after it leaves the cache.
+    """
+    def __init__(self, budget_mb: float = BUDGET_MB):
+        self.budget = budget_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], list]" = OrderedDict()  # -> [value, sizeof, on_evict]
+        self._loading: Dict[Tuple[str, str], threading.Lock] = {}
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_s = 0.0
+
+    def get(self, kind: str, key: str, loader: Callable[[], Any], sizeof: Callable[[Any], int],
+            on_evict: Optional[Callable[[Any], None]] = None) -> Any:
+        k = (kind, key)
+        with self._lock:
+            e = self._entries.get(k)
+            if e is not None:
+                self._entries.move_to_end(k)
+                self.hits += 1
+                return e[0]
+            load_lock = self._loading.setdefault(k, threading.Lock())
+        with load_lock:  # one loader per partition; others wait for it
+            with self._lock:
+                e = self._entries.get(k)
+                if e is not None:
+                    return e[0]
+            t0 = time.perf_counter()
+            value = loader()
+            self.put(kind, key, value, sizeof, on_evict)
+            with self._lock:
+                self.loads += 1
+                self.load_s += time.perf_counter() - t0
+                self._loading.pop(k, None)
+            return value
+
+    def put(self, kind: str, key: str, value: Any, sizeof: Callable[[Any], int],
+            on_evict: Optional[Callable[[Any], None]] = None) -> None:
+        """Install or replace an entry (e.g. a rebuilt index), then enforce the budget."""
+        with self._lock:
+            old = self._entries.pop((kind, key), None)
+            self._entries[(kind, key)] = [value, sizeof, on_evict]
+            evicted = self._evict()
+        if old is not None and old[0] is not value:
+            evicted.append(old)
+        for v, _, cb in evicted:
+            if cb is not None:
+                try:
+                    cb(v)
+                except Exception as e:
+                    print("Partition evict error:", repr(e))
+
+    def _size(self) -> int:
+        return sum(s(v) for v, s, _ in self._entries.values())
+
+    def _evict(self) -> list:
+        out = []
+        total = self._size()
+        while total > self.budget and len(self._entries) > 1:
+            _, e = self._entries.popitem(last=False)
+            total -= e[1](e[0])
+            out.append(e)
+            self.evictions += 1
+        return out
+
+    def peek(self, kind: str, key: str) -> Any:
+        with self._lock:
+            e = self._entries.get((kind, key))
+            return e[0] if e is not None else None
+
+    def drop(self, kind: str, key: str) -> None:
+        with self._lock:
+            self._entries.pop((kind, key), None)
+
+    def close(self) -> None:
+        """Run every on_evict hook (ANN index saves) and empty the cache."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for v, _, cb in entries:
+            if cb is not None:
+                cb(v)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            per: Dict[str, Dict[str, int]] = {}
+            for (kind, key), (v, s, _) in self._entries.items():
+                per.setdefault(key, {})[kind] = int(s(v))
+            return {"resident": per, "resident_bytes": sum(b for p in per.values() for b in p.values()),
+                    "budget_bytes": int(self.budget), "hits": self.hits, "loads": self.loads,
+                    "evictions": self.evictions, "load_s": self.load_s,
+                    "global_fallback": GLOBAL_FALLBACK}
+
+_cache = PartitionCache()
+
+def get_cache() -> PartitionCache:
+    return _cache
@@ -0,0 +1,112 @@
+# file: response_cache.py
+import os, time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import intent_head
+import intent_index
+import memory_store
+import partitions
+from free_metadata import when_tag
+
+# ---- config ----
+ENABLED = os.getenv("RESP_CACHE", "1") == "1"
+MAX_ENTRIES = int(os.getenv("RESP_CACHE_SIZE", "10000"))
+TTL_S = float(os.getenv("RESP_CACHE_TTL_S", "3600"))  # upper bound on age, e.g. for LLM-decided intents
+
+def key(text: str) -> str:
+    # whitespace only: the HF emotion model is cased, so case can change the answer;
+    # prefixed by the partition, whose memory the answer came from
+    return (partitions.current() or "") + "\x00" + " ".join(text.split())
+
+def stamp() -> Tuple[int, int, int, int]:
+    """(intent index version, intent head version, memory generation, memory rows); take it before computing."""
+    gen, n = memory_store.version()
+    return intent_index.version(), intent_head.version(), gen, n
+
+class _Entry:
+    __slots__ = ("out", "models", "gen", "rows", "unit", "kth", "ts")
+
+    def __init__(self, out, st, unit, kth):
+        self.out = out
+        self.models = st[:2]
+        self.gen, self.rows = st[2], st[3]
+        self.unit = np.asarray(unit, dtype=np.float32)
+        self.kth = float(kth)
+        self.ts = time.time()
+
+class ResponseCache:
+    """
+    Bounded LRU of full router outputs keyed by partition and whitespace-normalized text.
+
+    An entry is valid while the intent index and intent head it was computed with
+    are still serving and the memory store has only grown. Rows appended since
+    then are scored against the entry's unit vector: one at least as close as the
+    k-th memory neighbour the answer used (kth) could have changed it, so the
+    entry is dropped; otherwise the entry's row count moves forward and it stays.
+    The date-relative "when" tag is recomputed on every hit.
+    """
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl_s: float = TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0        # model swap, memory rewrite or TTL
+        self.invalidated = 0  # a new memory row landed among the answer's neighbours
+
+    def _drop(self, k: str, counter: str) -> None:
+        self._entries.pop(k, None)
+        setattr(self, counter, getattr(self, counter) + 1)
+        self.misses += 1
+
+    def get(self, text: str) -> Optional[Dict[str, Any]]:
+        k = key(text)
+        with self._lock:
+            e = self._entries.get(k)
+            if e is None:
+                self.misses += 1
+                return None
+            gen, n = memory_store.version()
+            if time.time() - e.ts > self.ttl_s or e.gen != gen or \
+                    e.models != (intent_index.version(), intent_head.version()):
+                self._drop(k, "stale")
+                return None
+            if n > e.rows:
+                new = memory_store.rows(e.rows, n)
+                if len(new) and float((new @ e.unit).max()) >= e.kth:
+                    self._drop(k, "invalidated")
+                    return None
+                e.rows = n
+            self._entries.move_to_end(k)
+            self.hits += 1
+            out = e.out
+        return {"emotion": dict(out["emotion"]), "intent": dict(out["intent"]),
+                "tags": {**out["tags"], "when": when_tag(text)}}
+
+    def put(self, text: str, out: Dict[str, Any], st: Tuple[int, int, int, int], unit, kth: float) -> None:
+        """st is the stamp() taken before out was computed; kth the cosine of its k-th memory neighbour (-1: none)."""
+        k = key(text)
+        with self._lock:
+            self._entries[k] = _Entry({f: dict(v) for f, v in out.items()}, st, unit, kth)
+            self._entries.move_to_end(k)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"enabled": ENABLED, "entries": len(self._entries), "max_entries": self.max_entries,
+                    "ttl_s": self.ttl_s, "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / total if total else 0.0,
+                    "stale": self.stale, "invalidated": self.invalidated}
+
+_cache = ResponseCache()
+
+def get_cache() -> ResponseCache:
+    return _cache
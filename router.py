@@ -1,12 +1,23 @@
-import os
+import os, asyncio, time
 from typing import TypedDict
+import lazy
+import cascade
+import intent_head
+import metrics
+import partitions
+import response_cache
+import sessions
 from free_metadata import tag_text_free
-from memory_store import add_example, label_dist
-from vector_infer_intent import predict_intent_knn
-from hf_baseline import predict_with_hf, probs_emotion
+from memory_store import add_examples, knn_batch
+from memory_writer import get_writer
+from vector_infer_intent import predict_intent_knn_batch, intent_neighbours_batch
+from embeddings import embed_batch
+from hf_baseline import predict_with_hf_batch, probs_emotion
 
 # Import Gemini function!
-from lc_gemini_intent import predict_intent_with_gemini
+from lc_gemini_intent import (predict_intent_with_gemini_batch,
+                              apredict_intent_with_gemini, abatch_predict_intent_with_gemini)
+from llm_cache import get_cache as llm_cache, ENABLED as LLM_CACHE_ENABLED
 
 class Pred(TypedDict):
     label: str
@@ -20,6 +31,25 @@ class Out(TypedDict):
 
 ALPHA_EMO = float(os.getenv("ALPHA_EMO","0.7"))
 AUTO_STORE = os.getenv("MEM_AUTO_STORE","1") == "1"
+# "1": auto-stored rows go through the background writer (memory_writer); "0": written inline
+ASYNC_WRITES = os.getenv("MEM_ASYNC_WRITES","1") == "1"
+THRESHOLD = 0.9  # FAISS L2 distance above which intent falls back to Gemini (cascade: gate centre)
+
+ACTIONS = {
+    "service_request":"request_service",
+    "hotel_info":"ask_info",
+    "internal_experience":"ask_info",
+    "external_experience":"ask_info",
+    "booking":"book",
+    "off_topic":"other"
+}
+
+def warmup() -> dict:
+    """
+    Load every model, index and client now instead of on the first request.
+    Returns {component: {"loaded", "load_s", "error"}} for the startup breakdown.
+    """
+    return lazy.warmup()
 
 def _blend(probs_a: dict, probs_b: dict, alpha: float) -> dict:
     keys = set(probs_a) | set(probs_b)
@@ -30,49 +60,336 @@ def _blend(probs_a: dict, probs_b: dict, alpha: float) -> dict:
     s = sum(out.values()) or 1.0
     return {k: v/s for k,v in out.items()}
 
-def predict(text: str) -> Out:
-    # 1) HF + memory for emotion (as before)
-    emo_model = predict_with_hf(text)
-    emo_mem = label_dist(text, task="emotion", k=5)
+def _emotion(emo_model: dict, emo_mem: dict) -> tuple[str, float]:
     emo_blend = _blend(emo_model.get("probs", {}), emo_mem, ALPHA_EMO)
     emo_label = max(emo_blend, key=emo_blend.get) if emo_blend else emo_model["label"]
     emo_conf = float(emo_blend.get(emo_label, emo_model["confidence"]))
+    return emo_label, emo_conf
 
-    # --- Vector DB for intent with fallback to Gemini ---
-    int_label_knn, _, _, dist = predict_intent_knn(text)
-    THRESHOLD = 0.9  # adjust if needed
-
-    if dist > THRESHOLD:
-        # Use Gemini fallback
-        gemini_pred = predict_intent_with_gemini(text)
-        int_label = gemini_pred.intent
-        int_conf = float(gemini_pred.confidence)
-        int_source = "gemini"
-    else:
-        int_label = int_label_knn
-        int_conf = 1.0
-        int_source = "vector_db"
+def _cache_lookup(texts: list[str], units) -> tuple[list, list[int]]:
+    out: list = [None] * len(texts)
+    todo = []
+    for i, text in enumerate(texts):
+        hit = llm_cache().get(text, units[i]) if LLM_CACHE_ENABLED else None
+        if hit:
+            out[i] = (hit["intent"], float(hit["confidence"]), "gemini_cache")
+        else:
+            todo.append(i)
+    return out, todo
 
-    # Tag metadata (as before)
-    action = {
-        "service_request":"request_service",
-        "hotel_info":"ask_info",
-        "internal_experience":"ask_info",
-        "external_experience":"ask_info",
-        "booking":"book",
-        "off_topic":"other"
-    }.get(int_label, "other")
-    tags = tag_text_free(text, action_from_intent=action)
-
-    # Store confident examples (as before)
-    if AUTO_STORE and emo_conf>=0.8 and int_conf>=0.8:
-        try:
-            add_example(text, emo_label, int_label, tags)
-        except Exception as e:
-            print("Memory store error:", repr(e))
+def _cache_fill(out: list, todo: list[int], preds: list, texts: list[str], units) -> None:
+    for i, p in zip(todo, preds):
+        if p is None:
+            continue
+        out[i] = (p.intent, float(p.confidence), "gemini")
+        if LLM_CACHE_ENABLED:
+            llm_cache().put(texts[i], p.intent, p.confidence, units[i])
 
+def _llm_intents(texts: list[str], units, knn: list) -> list[tuple[str, float, str]]:
+    """
+    Gemini fallback behind the semantic cache: (label, confidence, source) per text.
+    Cache misses go out in one batched call bounded by GEMINI_TIMEOUT_S; misses
+    that fail or time out keep the kNN guess, marked vector_db_timeout (as in
+    _allm_intents).
+    """
+    out, todo = _cache_lookup(texts, units)
+    if todo:
+        preds = predict_intent_with_gemini_batch([texts[i] for i in todo])
+        _cache_fill(out, todo, preds, texts, units)
+        for i in todo:
+            if out[i] is None:
+                label, conf, _ = knn[i]
+                out[i] = (label, conf, "vector_db_timeout")
+    return out
+
+async def _allm_intents(texts: list[str], units, knn: list) -> list[tuple[str, float, str]]:
+    """
+    Async variant with a deadline: misses that Gemini does not answer in time keep
+    the kNN guess (label, confidence, source), marked vector_db_timeout. That
+    confidence is below the escalation gate, so it also stays below auto-store.
+    """
+    # cache lookups and puts (matmul, file append, first load) stay off the event loop
+    out, todo = await asyncio.to_thread(_cache_lookup, texts, units)
+    if todo:
+        if len(todo) == 1:
+            preds = [await apredict_intent_with_gemini(texts[todo[0]])]
+        else:
+            preds = await abatch_predict_intent_with_gemini([texts[i] for i in todo])
+        await asyncio.to_thread(_cache_fill, out, todo, preds, texts, units)
+        for i in todo:
+            if out[i] is None:
+                label, conf, _ = knn[i]
+                out[i] = (label, conf, "vector_db_timeout")
+    return out
+
+def _finish(text: str, emo_label: str, emo_conf: float,
+            int_label: str, int_conf: float, int_source: str, emo_source: str = "hf+mem") -> Out:
+    # Tag metadata (as before)
+    action = ACTIONS.get(int_label, "other")
+    with metrics.stage("tag_text_free"):
+        tags = tag_text_free(text, action_from_intent=action)
     return {
-        "emotion": {"label": emo_label, "confidence": emo_conf, "source": "hf+mem"},
+        "emotion": {"label": emo_label, "confidence": emo_conf, "source": emo_source},
         "intent":  {"label": int_label, "confidence": int_conf, "source": int_source},
         "tags": tags
     }
+
+def _should_store(out: Out) -> bool:
+    return AUTO_STORE and out["emotion"]["confidence"]>=0.8 and out["intent"]["confidence"]>=0.8
+
+def _store(rows: list[dict]) -> None:
+    try:
+        with metrics.stage("add_example", len(rows)):
+            if ASYNC_WRITES:
+                get_writer().submit(rows)
+            else:
+                add_examples(rows)
+    except Exception as e:
+        print("Memory store error:", repr(e))
+
+def predict(text: str) -> Out:
+    return predict_batch([text])[0]
+
+def _ms(t0: float) -> float:
+    return (time.perf_counter() - t0) * 1000.0
+
+def _local_stages(texts: list[str]):
+    """
+    Everything except the LLM. Returns (unit, emos, intents, fallback, kth): per text an
+    emotion (label, conf, source) and a kNN intent guess (label, conf, source), the
+    rows whose intent must go to the LLM (the guess is kept for timeouts), and per
+    text the cosine of its k-th memory neighbour (what the response cache checks
+    new memory rows against).
+    """
+    # one MiniLM pass shared by memory kNN, FAISS kNN and auto-store
+    with metrics.stage("embed", len(texts)):
+        raw, unit = embed_batch(texts)
+    stats = cascade.get_stats()
+    stats.texts_seen(len(texts))
+    if cascade.ENABLED:
+        return (unit,) + _cascade_stages(texts, raw, unit)
+    # full pipeline: one HF call, one memory matmul, one FAISS search
+    n = len(texts)
+    t0 = time.perf_counter()
+    with metrics.stage("hf_emotion", n):
+        emo_models = predict_with_hf_batch(texts)
+    stats.record("hf_emotion", n, _ms(t0)); t0 = time.perf_counter()
+    with metrics.stage("label_dist", n):
+        mem = knn_batch(unit, k=5)
+    stats.record("memory", n, _ms(t0)); t0 = time.perf_counter()
+    with metrics.stage("predict_intent_knn", n):
+        knn = predict_intent_knn_batch(texts, embs=raw)
+    stats.record("intent_knn", n, _ms(t0))
+    emos = [(*_emotion(m, e["emotion"]), "hf+mem") for m, e in zip(emo_models, mem)]
+    fallback = [i for i, (_, _, _, dist) in enumerate(knn) if dist > THRESHOLD]
+    # a timed-out fallback keeps the kNN label; its confidence comes from the squared L2
+    # distance IndexFlatL2 returns between unit vectors (0..4), so it stays below the auto-store gate
+    intents = [(label, max(0.0, 1.0 - float(dist) / 4) if dist > THRESHOLD else 1.0, "vector_db")
+               for label, _, _, dist in knn]
+    return unit, emos, intents, fallback, [m["kth"] for m in mem]
+
+def _cascade_stages(texts: list[str], raw, unit):
+    # cheapest first; each heavier stage only sees the rows the previous ones could not decide
+    stats = cascade.get_stats()
+    t0 = time.perf_counter()
+    with metrics.stage("label_dist", len(texts)):
+        mem = knn_batch(unit, k=5)
+    stats.record("memory", len(texts), _ms(t0))
+
+    emos: list = [None] * len(texts)
+    intents: list = [None] * len(texts)
+    for i, m in enumerate(mem):
+        e = cascade.memory_label(m["emotion"], m["sim"], m["n"])
+        if e:
+            emos[i] = (*e, "mem")
+        it = cascade.memory_label(m["intent"], m["sim"], m["n"])
+        if it:
+            intents[i] = (*it, "mem")
+
+    need_hf = [i for i, e in enumerate(emos) if e is None]
+    if need_hf:
+        t0 = time.perf_counter()
+        with metrics.stage("hf_emotion", len(need_hf)):
+            emo_models = predict_with_hf_batch([texts[i] for i in need_hf])
+        stats.record("hf_emotion", len(need_hf), _ms(t0))
+        for i, m in zip(need_hf, emo_models):
+            emos[i] = (*_emotion(m, mem[i]["emotion"]), "hf+mem")
+
+    n_mem_intent = sum(it is not None for it in intents)
+    need_head = [i for i, it in enumerate(intents) if it is None]
+    head = intent_head.get_head() if intent_head.ENABLED and need_head else None
+    if head is not None:
+        # one matmul; confident rows skip the kNN vote and the LLM
+        t0 = time.perf_counter()
+        with metrics.stage("intent_head", len(need_head)):
+            preds = head.predict(unit[need_head])
+        stats.record("intent_head", len(need_head), _ms(t0))
+        for i, (label, p) in zip(need_head, preds):
+            if p >= intent_head.MIN_PROB:
+                intents[i] = (label, p, "intent_head")
+
+    need_knn = [i for i, it in enumerate(intents) if it is None]
+    fallback, legacy = [], 0
+    if need_knn:
+        t0 = time.perf_counter()
+        with metrics.stage("predict_intent_knn", len(need_knn)):
+            neigh = intent_neighbours_batch([texts[i] for i in need_knn], k=cascade.INTENT_K, embs=raw[need_knn])
+        stats.record("intent_knn", len(need_knn), _ms(t0))
+        for i, (labels, dists) in zip(need_knn, neigh):
+            label, conf = cascade.calibrate_intent(labels, dists, THRESHOLD)
+            intents[i] = (label, conf, "vector_db")
+            legacy += float(dists[0]) > THRESHOLD
+            if conf < cascade.INTENT_MIN:
+                fallback.append(i)
+    stats.shortcut(len(texts) - len(need_hf), n_mem_intent, legacy)
+    return emos, intents, fallback, [m["kth"] for m in mem]
+
+def _assemble(texts: list[str], unit, emos, intents, gemini: dict, store: bool = True) -> list[Out]:
+    outs: list[Out] = []
+    for i, text in enumerate(texts):
+        emo_label, emo_conf, emo_source = emos[i]
+        int_label, int_conf, int_source = gemini.get(i) or intents[i]
+        outs.append(_finish(text, emo_label, emo_conf, int_label, int_conf, int_source, emo_source))
+        metrics.INTENT_SOURCE.inc(1, int_source)
+    metrics.TEXTS.inc(len(texts))
+
+    to_store = [{"text": t, "emotion": o["emotion"]["label"], "intent": o["intent"]["label"],
+                 "tags": o["tags"], "emb": unit[i]}
+                for i, (t, o) in enumerate(zip(texts, outs)) if store and _should_store(o)]
+    if to_store:
+        _store(to_store)
+    return outs
+
+def _cached(texts: list[str]) -> tuple[list, list[int]]:
+    # (outs with cache hits filled in, indices still to compute)
+    if not response_cache.ENABLED:
+        return [None] * len(texts), list(range(len(texts)))
+    with metrics.stage("response_cache", len(texts)):
+        cache = response_cache.get_cache()
+        outs = [cache.get(t) for t in texts]
+    todo = [i for i, o in enumerate(outs) if o is None]
+    metrics.TEXTS.inc(len(texts) - len(todo))
+    return outs, todo
+
+def _merge(texts: list[str], outs: list, todo: list[int], done: list[Out], st, unit, kth) -> list[Out]:
+    cache = response_cache.get_cache() if response_cache.ENABLED else None
+    for j, (i, o) in enumerate(zip(todo, done)):
+        outs[i] = o
+        # a timed-out LLM call is not an answer worth keeping
+        if cache is not None and o["intent"]["source"] != "vector_db_timeout":
+            cache.put(texts[i], o, st, unit[j], kth[j])
+    return outs
+
+def predict_batch(texts: list[str], store: bool = True) -> list[Out]:
+    """
+    Same results as [predict(t) for t in texts], but every stage runs once over the
+    whole list: one HF pipeline call, one memory encode + matmul, one FAISS search,
+    one batched Gemini call for the low-confidence rows. Memory is read once up front,
+    so rows auto-stored by this batch only influence later calls. store=False skips
+    auto-store (back-fills). Texts answered by the response cache skip all of it.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    with metrics.trace("predict_batch", len(texts)):
+        outs, todo = _cached(texts)
+        if not todo:
+            return outs
+        sub = [texts[i] for i in todo]
+        st = response_cache.stamp()
+        unit, emos, intents, fallback, kth = _local_stages(sub)
+        gemini = {}
+        if fallback:
+            t0 = time.perf_counter()
+            with metrics.stage("gemini_fallback", len(fallback)):
+                gemini = dict(zip(fallback, _llm_intents([sub[i] for i in fallback], unit[fallback],
+                                                         [intents[i] for i in fallback])))
+            cascade.get_stats().record("llm", len(fallback), _ms(t0))
+        return _merge(texts, outs, todo, _assemble(sub, unit, emos, intents, gemini, store), st, unit, kth)
+
+async def apredict_batch(texts: list[str], store: bool = True) -> list[Out]:
+    """
+    predict_batch for the event loop: CPU stages run in a worker thread and the
+    Gemini fallback is awaited with a deadline (GEMINI_TIMEOUT_S) instead of blocking.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    with metrics.trace("apredict_batch", len(texts)):
+        outs, todo = _cached(texts)
+        if not todo:
+            return outs
+        sub = [texts[i] for i in todo]
+        st = response_cache.stamp()
+        unit, emos, intents, fallback, kth = await asyncio.to_thread(_local_stages, sub)
+        gemini = {}
+        if fallback:
+            t0 = time.perf_counter()
+            with metrics.stage("gemini_fallback", len(fallback)):
+                res = await _allm_intents([sub[i] for i in fallback], unit[fallback],
+                                          [intents[i] for i in fallback])
+            cascade.get_stats().record("llm", len(fallback), _ms(t0))
+            gemini = dict(zip(fallback, res))
+        done = await asyncio.to_thread(_assemble, sub, unit, emos, intents, gemini, store)
+        return _merge(texts, outs, todo, done, st, unit, kth)
+
+async def apredict(text: str) -> Out:
+    return (await apredict_batch([text]))[0]
+
+async def apredict_keyed(items: list[tuple[str | None, str]]) -> list[Out]:
+    """
+    apredict_batch over (partition, text) pairs, one batch per partition, run
+    concurrently (the /predict micro-batcher mixes properties in one window).
+    """
+    groups: dict = {}
+    for i, (key, _) in enumerate(items):
+        groups.setdefault(key, []).append(i)
+    outs: list = [None] * len(items)
+
+    async def run(key, rows: list[int]) -> None:
+        with partitions.use(key):
+            res = await apredict_batch([items[i][1] for i in rows])
+        for i, o in zip(rows, res):
+            outs[i] = o
+
+    await asyncio.gather(*(run(k, rows) for k, rows in groups.items()))
+    return outs
+
+async def astream_turn(text: str, session: "sessions.Session", emit) -> None:
+    """
+    One conversation turn scored with the session's context as a prior (see
+    sessions.py). await emit(event) is called as results firm up:
+      {"stage": "local", "final": bool, "turn", "emotion", "intent", "tags", "ms"}
+      {"stage": "llm", "final": True, "turn", "intent", "tags", "ms"}   only when the intent needs the LLM
+    The prior can lift a low-confidence guess over CASCADE_INTENT_MIN (no LLM call)
+    but never sends a turn to the LLM by itself. Answers depend on the session, so
+    the response cache is bypassed; rows whose label came from the prior are not
+    auto-stored.
+    """
+    t0 = time.perf_counter()
+    async with session.lock:
+        unit, emos, intents, fallback, _ = await asyncio.to_thread(_local_stages, [text])
+        sim = session.similarity(unit[0])
+        emo = sessions.apply_prior(emos[0], session.prior("emotion"), sim)
+        guess = sessions.apply_prior(intents[0], session.prior("intent"), sim)
+        lifted = guess[1] >= cascade.INTENT_MIN and (guess[0] != intents[0][0] or guess[1] > intents[0][1])
+        if (fallback and not lifted) or (not fallback and guess[1] < cascade.INTENT_MIN):
+            guess = intents[0]
+        needs_llm = bool(fallback) and not lifted
+        turn = sessions.get_store().observe(session, unit[0], emo[:2], guess[:2])
+        store = emo[2] != "session" and guess[2] != "session"
+        if not needs_llm:
+            out = (await asyncio.to_thread(_assemble, [text], unit, [emo], [guess], {}, store))[0]
+            await emit({"stage": "local", "final": True, "turn": turn, **out, "ms": _ms(t0)})
+            return
+        local = _finish(text, emo[0], emo[1], guess[0], guess[1], guess[2], emo[2])
+        await emit({"stage": "local", "final": False, "turn": turn, **local, "ms": _ms(t0)})
+    t1 = time.perf_counter()
+    with metrics.stage("gemini_fallback", 1):
+        res = await _allm_intents([text], unit[[0]], [guess])
+    cascade.get_stats().record("llm", 1, _ms(t1))
+    out = (await asyncio.to_thread(_assemble, [text], unit, [emo], [guess], {0: res[0]}, store))[0]
+    if out["intent"]["source"] != "vector_db_timeout":
+        session.refine(turn, (out["intent"]["label"], out["intent"]["confidence"]))
+    await emit({"stage": "llm", "final": True, "turn": turn, "intent": out["intent"], "tags": out["tags"],
+                "ms": _ms(t0)})
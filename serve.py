@@ -0,0 +1,221 @@
+# file: serve.py
+"""
+Preforking server: the master loads every model and index once (router.warmup),
+freezes the GC so refcount/GC updates don't dirty those pages, then forks workers
+that share them copy-on-write and serve api.app on one inherited socket.
+
+  python serve.py --workers 4 --port 8000
+  python serve.py bench --workers 4       # RSS/PSS + throughput vs `uvicorn --workers`
+
+Each worker pins torch/FAISS/BLAS/ONNX Runtime to cpus // workers threads.
+With MEM_BACKEND=npy the memory matrix is an np.memmap, so it stays shared
+through the page cache even as workers append; otherwise the matrix parsed by
+the master is shared copy-on-write like the models and the intent index.
+"""
+import os, sys, gc, json, time, signal, socket, atexit, argparse, subprocess, tempfile
+from typing import Any, Dict, List
+
+# ---- config ----
+WORKERS = int(os.getenv("WEB_WORKERS", "2"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+
+def default_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(workers, 1))
+
+def thread_env(n: int) -> None:
+    """Thread caps read at import/initialisation time; call before numpy/torch/onnxruntime load."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "ORT_INTRA_OP_THREADS"):
+        os.environ.setdefault(var, str(n))
+    # the Rust tokenizers pool does not survive fork
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+def pin_threads(n: int) -> None:
+    """Per-process intra-op thread count for torch and FAISS, if loaded (never imports them)."""
+    torch, faiss = sys.modules.get("torch"), sys.modules.get("faiss")
+    if torch is not None:
+        torch.set_num_threads(n)
+    if faiss is not None:
+        faiss.omp_set_num_threads(n)
+
+def _listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def serve(host: str = HOST, port: int = PORT, workers: int = WORKERS, threads: int = 0) -> None:
+    threads = threads or default_threads(workers)
+    thread_env(threads)
+    import uvicorn
+    import api, router
+
+    t0 = time.perf_counter()
+    for name, r in router.warmup().items():
+        print(f"master: {name:<14} {r['load_s'] or 0:.2f}s" + (f"  ERROR {r['error']}" if r["error"] else ""))
+    print(f"master: loaded in {time.perf_counter() - t0:.2f}s, forking {workers} workers x {threads} threads")
+    gc.collect()
+    gc.freeze()  # keep the collector from touching (and un-sharing) everything loaded so far
+
+    sock = _listen(host, port)
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid:
+            children[pid] = slot
+            return
+        # ---- worker ----
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            pin_threads(threads)
+            config = uvicorn.Config(api.app, lifespan="on", log_level=os.getenv("LOG_LEVEL", "info"))
+            uvicorn.Server(config).run(sockets=[sock])
+        except BaseException as e:
+            print(f"worker {slot} error:", repr(e))
+            code = 1
+        finally:
+            atexit._run_exitfuncs()  # writer flush, ANN index save
+            os._exit(code)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            print(f"master: worker {slot} (pid {pid}) exited with {status}, respawning")
+            spawn(slot)
+    sock.close()
+
+# ---- benchmark ----
+def _tree(pid: int) -> List[int]:
+    out, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        out.append(p)
+        try:
+            for tid in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{tid}/children") as f:
+                    todo += [int(c) for c in f.read().split()]
+        except (FileNotFoundError, ProcessLookupError):
+            pass
+    return out
+
+def _mem_mb(pids: List[int]) -> Dict[str, float]:
+    # RSS counts shared pages once per process; PSS splits them, so its sum is the real footprint
+    tot = {"rss_mb": 0.0, "pss_mb": 0.0}
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                for line in f:
+                    k, v = line.split(":", 1)
+                    if k in ("Rss", "Pss"):
+                        tot[k.lower() + "_mb"] += int(v.split()[0]) / 1024.0
+        except (FileNotFoundError, ProcessLookupError):
+            pass
+    return tot
+
+def _wait_ready(url: str, workers: int, timeout: float) -> None:
+    import httpx
+    deadline, ok = time.time() + timeout, 0
+    while ok < 4 * workers:  # requests land on random workers; several in a row means all are up
+        if time.time() > deadline:
+            raise TimeoutError(f"{url} not ready after {timeout}s")
+        try:
+            ok = ok + 1 if httpx.get(url + "/ready", timeout=2).status_code == 200 else 0
+        except httpx.HTTPError:
+            ok = 0
+        time.sleep(0.05 if ok else 0.5)
+
+def _load(url: str, texts: List[str], concurrency: int) -> Dict[str, float]:
+    import asyncio, httpx
+
+    async def run() -> float:
+        sem = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+            async def one(t: str) -> None:
+                async with sem:
+                    (await client.post("/predict", json={"text": t})).raise_for_status()
+            t0 = time.perf_counter()
+            await asyncio.gather(*[one(t) for t in texts])
+            return time.perf_counter() - t0
+
+    secs = asyncio.run(run())
+    return {"requests": len(texts), "seconds": secs, "requests_per_s": len(texts) / secs}
+
+def bench(workers: int = WORKERS, requests: int = 400, concurrency: int = 32, port: int = 8765,
+          data: str = "intent_dataset_450.csv", timeout: float = 600.0) -> Dict[str, Any]:
+    """
+    Start the API twice (plain `uvicorn --workers N`, then this prefork mode), wait
+    until ready, record total RSS/PSS of the process tree and /predict throughput.
+    Gemini is kept out of the measurement (CASCADE_INTENT_MIN=0) and auto-store is off.
+    """
+    import pandas as pd
+    texts = (pd.read_csv(data)["text"].astype(str).tolist() * (requests // 450 + 1))[:requests]
+    tmp = tempfile.mkdtemp(prefix="serve_bench_")
+    env = dict(os.environ, MEM_AUTO_STORE="0", CASCADE_INTENT_MIN="0", LLM_CACHE="0", RESP_CACHE="0", LOG_LEVEL="warning",
+               EMB_CACHE_SIZE="0", MEMORY_FILE=os.path.join(tmp, "memory.jsonl"))
+    if os.path.exists("memory.jsonl"):
+        import shutil
+        shutil.copy("memory.jsonl", env["MEMORY_FILE"])
+    threads = str(default_threads(workers))
+    modes = {
+        "naive": [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--workers", str(workers),
+                  "--log-level", "warning"],
+        "prefork": [sys.executable, os.path.abspath(__file__), "--port", str(port), "--workers", str(workers), "--threads", threads],
+    }
+    report: Dict[str, Any] = {"workers": workers, "threads_per_worker": int(threads), "concurrency": concurrency}
+    for mode, cmd in modes.items():
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, start_new_session=True)
+        try:
+            t0 = time.perf_counter()
+            _wait_ready(f"http://127.0.0.1:{port}", workers, timeout)
+            ready_s = time.perf_counter() - t0
+            idle = _mem_mb(_tree(proc.pid))
+            load = _load(f"http://127.0.0.1:{port}", texts, concurrency)
+            report[mode] = {"ready_s": ready_s, "idle": idle, "after_load": _mem_mb(_tree(proc.pid)), **load}
+        finally:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(30)
+    if "naive" in report and "prefork" in report:
+        report["pss_saving"] = 1 - report["prefork"]["after_load"]["pss_mb"] / report["naive"]["after_load"]["pss_mb"]
+        report["throughput_ratio"] = report["prefork"]["requests_per_s"] / report["naive"]["requests_per_s"]
+    return report
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["bench"]:
+        ap = argparse.ArgumentParser(description="RSS/throughput: uvicorn --workers vs prefork")
+        ap.add_argument("--workers", type=int, default=WORKERS)
+        ap.add_argument("--requests", type=int, default=400)
+        ap.add_argument("--concurrency", type=int, default=32)
+        ap.add_argument("--port", type=int, default=8765)
+        args = ap.parse_args(sys.argv[2:])
+        print(json.dumps(bench(args.workers, args.requests, args.concurrency, args.port), indent=2))
+    else:
+        ap = argparse.ArgumentParser(description="Preforking server for api.app")
+        ap.add_argument("--host", default=HOST)
+        ap.add_argument("--port", type=int, default=PORT)
+        ap.add_argument("--workers", type=int, default=WORKERS)
+        ap.add_argument("--threads", type=int, default=0, help="per worker; default cpus // workers")
+        args = ap.parse_args()
+        serve(args.host, args.port, args.workers, args.threads)
@@ -0,0 +1,183 @@
+# file: sessions.py
+"""
+Per-conversation state for the /session WebSocket (api.py).
+
+A session keeps the unit embeddings and final labels of its last SESSION_TURNS
+turns. From those it derives, with weights SESSION_DECAY ** age (newest = 1):
+  - a rolling context vector (weighted mean of the turn embeddings);
+  - prior label distributions for emotion and intent (confidence-weighted votes
+    of the recent turns' labels).
+A new turn's local guess (label, conf) is blended with the prior, weighted by how
+closely the turn follows the conversation:
+  beta = SESSION_PRIOR_WEIGHT * max(0, cos(turn, context))
+  score(l) = (1 - beta) * conf * [l == label] + beta * prior(l)
+so "yes, and towels too" after a housekeeping request leans on the context, while
+a change of topic (low cosine) is scored on its own.
+
+Turns of one session take the local stages in order (Session.lock), so each
+sees the previous turn in its prior; LLM refinements overlap and update the
+turn's intent when they arrive.
+
+Sessions are keyed by (partition, session id) and live in one LRU. Sessions idle
+for SESSION_IDLE_S are dropped, and least recently used ones are evicted while
+the estimated total exceeds SESSION_BUDGET_MB. Both checks run on every access.
+"""
+import os, time, asyncio, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# ---- config ----
+TURNS = int(os.getenv("SESSION_TURNS", "8"))                      # recent turns kept per session
+DECAY = float(os.getenv("SESSION_DECAY", "0.6"))                  # weight of a turn per step of age
+PRIOR_WEIGHT = float(os.getenv("SESSION_PRIOR_WEIGHT", "0.3"))    # max share of the score given to the prior; 0 disables
+IDLE_S = float(os.getenv("SESSION_IDLE_S", "1800"))
+BUDGET_MB = float(os.getenv("SESSION_BUDGET_MB", "64"))
+_OVERHEAD = 2048  # bytes per session besides the embedding ring (objects, label records)
+
+class Session:
+    """Recent turns of one conversation: a ring of unit vectors plus [emotion, emo_conf, intent, int_conf, turn] records."""
+    def __init__(self, sid: str, partition: Optional[str], turns: int = TURNS):
+        self.sid = sid
+        self.partition = partition
+        self.turns = turns
+        self.ring: Optional[np.ndarray] = None   # (turns, d), allocated on the first turn
+        self.records: List[list] = []            # oldest first; record i's vector is ring[(count - len + i) % turns]
+        self.count = 0                           # turns seen
+        self.created = self.last_seen = time.time()
+        self.lock = asyncio.Lock()               # turns read the prior and observe in arrival order
+
+    def nbytes(self) -> int:
+        return _OVERHEAD + (self.ring.nbytes if self.ring is not None else 0)
+
+    def _weights(self) -> np.ndarray:
+        n = len(self.records)
+        return DECAY ** np.arange(n - 1, -1, -1, dtype=np.float64)  # oldest .. newest
+
+    def _vectors(self) -> np.ndarray:
+        n = len(self.records)
+        if not n:
+            return np.zeros((0, 0), np.float32)
+        slots = (np.arange(self.count - n, self.count)) % self.turns
+        return self.ring[slots]
+
+    def context(self) -> Optional[np.ndarray]:
+        """Unit rolling context vector, or None before the first turn."""
+        if not self.records:
+            return None
+        v = self._weights() @ self._vectors()
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    def similarity(self, unit: np.ndarray) -> float:
+        ctx = self.context()
+        return float(ctx @ unit) if ctx is not None else 0.0
+
+    def prior(self, task: str) -> Dict[str, float]:
+        col = 0 if task == "emotion" else 2
+        out: Dict[str, float] = {}
+        for w, r in zip(self._weights(), self.records):
+            out[r[col]] = out.get(r[col], 0.0) + float(w) * r[col + 1]
+        total = sum(out.values())
+        return {k: v / total for k, v in out.items()} if total > 0 else {}
+
+    def observe(self, unit: np.ndarray, emotion: Tuple[str, float], intent: Tuple[str, float]) -> Tuple[int, int]:
+        """Append a turn; returns (turn number, bytes newly allocated)."""
+        grown = 0
+        if self.ring is None:
+            self.ring = np.zeros((self.turns, len(unit)), dtype=np.float32)
+            grown = self.ring.nbytes
+        turn = self.count
+        self.ring[turn % self.turns] = unit
+        self.records.append([emotion[0], float(emotion[1]), intent[0], float(intent[1]), turn])
+        del self.records[:-self.turns]
+        self.count += 1
+        return turn, grown
+
+    def refine(self, turn: int, intent: Tuple[str, float]) -> None:
+        """Replace a turn's intent once the LLM answered (no-op if it already left the window)."""
+        for r in self.records:
+            if r[4] == turn:
+                r[2], r[3] = intent[0], float(intent[1])
+
+def apply_prior(guess: Tuple[str, float, str], prior: Dict[str, float], sim: float,
+                weight: float = PRIOR_WEIGHT) -> Tuple[str, float, str]:
+    """Blend a (label, conf, source) guess with the session prior; a label that came from the prior gets source "session"."""
+    beta = weight * max(0.0, sim)
+    if beta <= 0 or not prior:
+        return guess
+    label, conf, source = guess
+    scores = {l: beta * p for l, p in prior.items()}
+    scores[label] = scores.get(label, 0.0) + (1 - beta) * conf
+    top = max(scores, key=scores.get)
+    return top, float(scores[top]), source if top == label else "session"
+
+class SessionStore:
+    """LRU of sessions bounded by idle time and estimated size (see the module docstring)."""
+    def __init__(self, budget_mb: float = BUDGET_MB, idle_s: float = IDLE_S):
+        self.budget = budget_mb * 1024 * 1024
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[Tuple[Optional[str], str], Session]" = OrderedDict()
+        self._bytes = 0
+        self.created = 0
+        self.expired = 0   # idle
+        self.evicted = 0   # budget
+
+    def get(self, sid: str, partition: Optional[str] = None) -> Session:
+        """The session (created if missing or dropped), marked as just used."""
+        k = (partition, sid)
+        now = time.time()
+        with self._lock:
+            s = self._sessions.get(k)
+            if s is None:
+                s = Session(sid, partition)
+                self._sessions[k] = s
+                self._bytes += s.nbytes()
+                self.created += 1
+            self._sessions.move_to_end(k)
+            s.last_seen = now
+            self._sweep(now)
+        return s
+
+    def observe(self, s: Session, unit: np.ndarray, emotion: Tuple[str, float], intent: Tuple[str, float]) -> int:
+        """Session.observe with the store's size accounting; returns the turn number."""
+        with self._lock:
+            turn, grown = s.observe(unit, emotion, intent)
+            if self._sessions.get((s.partition, s.sid)) is s:
+                self._bytes += grown
+                self._sweep(time.time())
+        return turn
+
+    def _drop(self, k) -> None:
+        self._bytes -= self._sessions.pop(k).nbytes()
+
+    def _sweep(self, now: float) -> None:
+        # oldest first, so stop at the first session that is still fresh
+        while self._sessions:
+            k, s = next(iter(self._sessions.items()))
+            if now - s.last_seen <= self.idle_s:
+                break
+            self._drop(k)
+            self.expired += 1
+        while self._bytes > self.budget and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)))
+            self.evicted += 1
+
+    def drop(self, sid: str, partition: Optional[str] = None) -> bool:
+        with self._lock:
+            if (partition, sid) not in self._sessions:
+                return False
+            self._drop((partition, sid))
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sweep(time.time())
+            return {"sessions": len(self._sessions), "bytes": self._bytes, "budget_bytes": int(self.budget),
+                    "idle_s": self.idle_s, "created": self.created, "expired": self.expired,
+                    "evicted": self.evicted, "turns": TURNS, "prior_weight": PRIOR_WEIGHT}
+
+_store = SessionStore()
+
+def get_store() -> SessionStore:
+    return _store
@@ -0,0 +1,319 @@
+# file: tune.py
+"""
+Offline tuning of the router's accuracy / LLM-fallback trade-off.
+
+  python tune.py                                   # intent_dataset_450.csv + memory.jsonl
+  python tune.py --budget 0.1 --llm-ms 300         # best settings with <= 10% of texts sent to the LLM
+  python tune.py --llm-labels gemini_labels.csv    # measured LLM answers instead of --llm-accuracy
+
+One pass computes everything the router's decisions depend on and caches it in
+TUNE_CACHE (.npz, rebuilt when the data, models or max k change):
+  - intent: raw MiniLM vectors of the labelled CSV and, per row, its K nearest
+    other rows with squared L2 distances (the metric of the FAISS IndexFlatL2);
+  - emotion: for memory rows (and CSV rows with an "emotion" column), HF emotion
+    probabilities and their K nearest memory rows (cosine, copies of the query
+    excluded) with labels and vote weights.
+Every grid point is then array arithmetic on those lists:
+  - legacy intent path (CASCADE=0, the default): k-NN vote, LLM when the nearest distance > THRESHOLD;
+  - cascade intent path (CASCADE=1): cascade.calibrate_intent over (k, THRESHOLD, VOTE_TEMP),
+    LLM when confidence < CASCADE_INTENT_MIN;
+  - emotion: argmax of ALPHA_EMO * HF + (1 - ALPHA_EMO) * memory k-NN distribution.
+Rows sent to the LLM count as correct with probability --llm-accuracy (the LLM's
+label set differs from the dataset's), unless --llm-labels gives its answers.
+The report lists the accuracy vs fallback-rate Pareto frontier per intent mode.
+"""
+import os, json, time, hashlib, argparse
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+# ---- config ----
+CACHE_PATH = os.getenv("TUNE_CACHE", "tune_cache.npz")
+MAX_K = 20
+KS = (1, 3, 5, 7, 10, 15)
+THRESHOLDS = tuple(np.round(np.arange(0.3, 1.51, 0.05), 2))
+INTENT_MINS = tuple(np.round(np.arange(0.0, 0.96, 0.05), 2))
+VOTE_TEMPS = (0.05, 0.1, 0.2, 0.5)
+ALPHAS = tuple(np.round(np.arange(0.0, 1.01, 0.1), 2))
+MEM_KS = (1, 3, 5, 7, 10, 15, 20)
+COPY_SIM = 0.999     # memory neighbours this close to an emotion query are the query itself (or a stored copy)
+BLOCK = 1024
+
+# ---- neighbour lists (computed once, cached) ----
+def _smallest(D: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, D.shape[1])
+    idx = np.argpartition(D, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(idx, np.argsort(np.take_along_axis(D, idx, axis=1), axis=1), axis=1)
+
+def _knn_l2(X: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Leave-one-out k nearest rows of X by squared L2: (n, k) indices and distances, nearest first."""
+    sq = (X * X).sum(axis=1)
+    I, D = [], []
+    for s in range(0, len(X), BLOCK):
+        B = np.maximum(sq[s:s + BLOCK, None] + sq[None, :] - 2.0 * (X[s:s + BLOCK] @ X.T), 0.0)
+        B[np.arange(len(B)), s + np.arange(len(B))] = np.inf
+        top = _smallest(B, k)
+        I.append(top)
+        D.append(np.take_along_axis(B, top, axis=1))
+    return np.vstack(I), np.vstack(D).astype(np.float32)
+
+def _knn_cos(Q: np.ndarray, M: np.ndarray, k: int, copy_sim: float) -> Tuple[np.ndarray, np.ndarray]:
+    """k most similar rows of M per unit query, skipping rows within copy_sim; missing slots are -1."""
+    I, S = [], []
+    for s in range(0, len(Q), BLOCK):
+        B = Q[s:s + BLOCK] @ M.T
+        B[B >= copy_sim] = -np.inf
+        top = _smallest(-B, k)
+        sims = np.take_along_axis(B, top, axis=1)
+        I.append(np.where(np.isfinite(sims), top, -1))
+        S.append(sims)
+    return np.vstack(I), np.vstack(S).astype(np.float32)
+
+def _fingerprint(*parts: Any) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(json.dumps(p, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+def build(data: str = "intent_dataset_450.csv", k: int = MAX_K, max_emotion_rows: int = 2000,
+          path: str = CACHE_PATH) -> Dict[str, np.ndarray]:
+    """Neighbour lists and model outputs for tuning; loaded from path when its fingerprint matches."""
+    import pandas as pd
+    import embeddings, memory_store
+    from hf_baseline import HF_MODEL, probs_emotion_batch
+
+    df = pd.read_csv(data)
+    texts = df["text"].astype(str).tolist()
+    intents = df["intent"].astype(str).tolist()
+    emo_csv = df["emotion"].astype(str).tolist() if "emotion" in df.columns else []
+    index = memory_store._idx()
+    M, meta, mem_emotions, _ = index.snapshot()
+    weights = index.voting_snapshot()[3][:len(M)]
+    M = np.asarray(M, dtype=np.float32)
+    key = _fingerprint(texts, intents, emo_csv, [m.get("text") for m in meta], list(mem_emotions), list(weights),
+                       k, max_emotion_rows, HF_MODEL, embeddings.EMB_MODEL_NAME)
+    if os.path.exists(path):
+        with np.load(path, allow_pickle=False) as z:
+            if str(z["key"]) == key:
+                return {f: z[f] for f in z.files}
+
+    t0 = time.perf_counter()
+    raw, _ = embeddings.embed_batch(texts)
+    int_idx, int_d = _knn_l2(np.asarray(raw, dtype=np.float32), k)
+
+    # emotion queries: sampled memory rows (leave-one-out) + CSV rows carrying an emotion label
+    rng = np.random.default_rng(0)
+    mem_rows = np.sort(rng.choice(len(M), size=min(len(M), max_emotion_rows), replace=False)) if len(M) else np.zeros(0, int)
+    q_texts = [meta[i]["text"] for i in mem_rows] + (texts if emo_csv else [])
+    q_gold = [mem_emotions[i] for i in mem_rows] + emo_csv
+    Q = M[mem_rows]
+    if emo_csv:
+        Q = np.vstack([Q, embeddings.embed_batch(texts)[1]]) if len(Q) else embeddings.embed_batch(texts)[1]
+    probs = probs_emotion_batch(q_texts) if q_texts else []
+    hf_names = sorted({l for p in probs for l in p})
+    P = np.asarray([[p.get(l, 0.0) for l in hf_names] for p in probs], dtype=np.float32).reshape(len(probs), len(hf_names))
+    if len(M) and len(Q):
+        mem_idx, mem_sim = _knn_cos(Q, M, k, COPY_SIM)
+    else:
+        mem_idx, mem_sim = np.full((len(Q), 0), -1), np.zeros((len(Q), 0), np.float32)
+
+    out = {
+        "key": np.asarray(key), "k": np.asarray(k),
+        "int_labels": np.asarray(intents, dtype=str), "int_idx": int_idx, "int_d": int_d,
+        "texts": np.asarray(texts, dtype=str),
+        "emo_gold": np.asarray(q_gold, dtype=str), "hf_names": np.asarray(hf_names, dtype=str), "hf_probs": P,
+        "mem_labels": np.asarray(list(mem_emotions), dtype=str),
+        "mem_weights": np.asarray(weights, dtype=np.float32), "mem_idx": mem_idx, "mem_sim": mem_sim,
+        "build_s": np.asarray(time.perf_counter() - t0),
+    }
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **out)
+    os.replace(tmp, path)
+    return out
+
+# ---- vectorized evaluation ----
+def _codes(labels: np.ndarray, names: Sequence[str]) -> np.ndarray:
+    pos = {n: i for i, n in enumerate(names)}
+    return np.asarray([pos.get(l, -1) for l in labels.tolist()], dtype=int)
+
+def _votes(lab: np.ndarray, w: np.ndarray, C: int) -> np.ndarray:
+    """
+    (n, K) neighbour labels and weights, nearest first -> (n, K, C) votes of the first
+    1..K neighbours; for k neighbours each fills min(weight, slots left) of k slots (memory_store._dist).
+    """
+    n, K = lab.shape
+    ok = lab >= 0
+    w = np.where(ok, w, 0.0).astype(np.float32)
+    onehot = np.zeros((n, K, C), dtype=np.float32)
+    onehot[np.nonzero(ok)[0], np.nonzero(ok)[1], lab[ok]] = 1.0
+    before = np.cumsum(w, axis=1) - w
+    V = np.zeros((n, K, C), dtype=np.float32)
+    for k in range(1, K + 1):
+        take = np.clip(k - before[:, :k], 0.0, w[:, :k])
+        V[:, k - 1] = np.einsum("nj,njc->nc", take, onehot[:, :k])
+    return V
+
+def _first_seen(lab: np.ndarray, C: int) -> np.ndarray:
+    """(n, C) position of each label's nearest neighbour (K when absent)."""
+    K = lab.shape[1]
+    first = np.full((len(lab), C), K)
+    for j in range(K - 1, -1, -1):
+        ok = lab[:, j] >= 0
+        first[np.nonzero(ok)[0], lab[ok, j]] = j
+    return first
+
+def _winner(votes: np.ndarray, first: np.ndarray) -> np.ndarray:
+    # like the router's dict-ordered vote: among tied labels the one seen first wins
+    tied = votes >= votes.max(axis=1, keepdims=True) * (1 - 1e-9)
+    return np.where(tied, first, np.iinfo(first.dtype).max).argmin(axis=1)
+
+def eval_intent(c: Dict[str, np.ndarray], llm_correct: np.ndarray, ks: Sequence[int] = KS,
+                thresholds: Sequence[float] = THRESHOLDS, mins: Sequence[float] = INTENT_MINS,
+                vote_temps: Sequence[float] = VOTE_TEMPS, dist_temp: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Every grid point of both intent paths -> {"legacy": [...], "cascade": [...]} of {params, accuracy, fallback_rate}."""
+    import cascade
+    dist_temp = cascade.DIST_TEMP if dist_temp is None else dist_temp
+    names = sorted(set(c["int_labels"].tolist()))
+    C = len(names)
+    y = _codes(c["int_labels"], names)
+    lab = y[c["int_idx"]]                       # (n, K)
+    d = c["int_d"].astype(np.float64)           # (n, K), nearest first
+    T = np.asarray(thresholds, dtype=np.float64)
+    ks = [k for k in ks if k <= lab.shape[1]]
+    firsts = {k: _first_seen(lab[:, :k], C) for k in ks}
+    out: Dict[str, List[Dict[str, Any]]] = {"legacy": [], "cascade": []}
+
+    # legacy: unweighted vote over k, fallback when the nearest row is farther than THRESHOLD
+    V = _votes(lab, np.ones_like(d, dtype=np.float32), C)
+    fb = d[:, 0][:, None] > T[None, :]                                           # (n, T)
+    for k in ks:
+        correct = _winner(V[:, k - 1], firsts[k]) == y
+        acc = np.where(fb, llm_correct[:, None], correct[:, None]).mean(axis=0)
+        for t, a, f in zip(T, acc, fb.mean(axis=0)):
+            out["legacy"].append({"k": k, "threshold": float(t), "accuracy": float(a), "fallback_rate": float(f)})
+
+    # cascade: weighted vote, confidence = distance gate x margin, fallback below INTENT_MIN
+    m = np.asarray(mins, dtype=np.float64)
+    for vt in vote_temps:
+        w = np.exp(-(d - d[:, :1]) / vt)
+        Vw = _votes(lab, w.astype(np.float32), C)
+        for k in ks:
+            top = _winner(Vw[:, k - 1], firsts[k])
+            srt = np.sort(Vw[:, k - 1], axis=1)
+            margin = (srt[:, -1] - (srt[:, -2] if C > 1 else 0.0)) / srt.sum(axis=1)
+            closest = np.where(lab[:, :k] == top[:, None], d[:, :k], np.inf).min(axis=1)
+            z = np.clip((T[None, :] - closest[:, None]) / dist_temp, -50.0, 50.0)
+            conf = (0.5 + 0.5 * margin)[:, None] / (1.0 + np.exp(-z))               # (n, T)
+            fbm = conf[:, :, None] < m[None, None, :]                             # (n, T, M)
+            correct = (top == y)[:, None, None]
+            acc = np.where(fbm, llm_correct[:, None, None], correct).mean(axis=0)
+            rate = fbm.mean(axis=0)
+            for i, t in enumerate(T):
+                for j, mm in enumerate(m):
+                    out["cascade"].append({"k": k, "threshold": float(t), "intent_min": float(mm), "vote_temp": vt,
+                                           "accuracy": float(acc[i, j]), "fallback_rate": float(rate[i, j])})
+    return out
+
+def eval_emotion(c: Dict[str, np.ndarray], alphas: Sequence[float] = ALPHAS,
+                 mem_ks: Sequence[int] = MEM_KS) -> List[Dict[str, Any]]:
+    """Emotion accuracy for every (ALPHA_EMO, memory k)."""
+    if not len(c["emo_gold"]):
+        return []
+    names = sorted(set(c["hf_names"].tolist()) | set(c["mem_labels"].tolist()))
+    C = len(names)
+    y = _codes(c["emo_gold"], names)
+    P = np.zeros((len(y), C), dtype=np.float32)
+    P[:, _codes(c["hf_names"], names)] = c["hf_probs"]
+    idx = c["mem_idx"]
+    ml = _codes(c["mem_labels"], names)
+    lab = np.where(idx >= 0, ml[np.maximum(idx, 0)], -1) if idx.size else idx
+    w = np.where(idx >= 0, c["mem_weights"][np.maximum(idx, 0)], 0.0) if idx.size else idx.astype(np.float32)
+    V = _votes(lab, w, C) if idx.size else np.zeros((len(y), 0, C), np.float32)
+    a = np.asarray(alphas, dtype=np.float64)
+    out = []
+    for k in [k for k in mem_ks if k <= V.shape[1]] or [0]:
+        D = V[:, k - 1] if k else np.zeros_like(P)
+        D = D / np.maximum(D.sum(axis=1, keepdims=True), 1e-12)                 # router._dist
+        B = a[:, None, None] * P[None] + (1 - a)[:, None, None] * D[None]      # (A, n, C)
+        acc = (B.argmax(axis=2) == y[None]).mean(axis=1)
+        out += [{"alpha_emo": float(al), "mem_k": k, "accuracy": float(x)} for al, x in zip(a, acc)]
+    return out
+
+def frontier(points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Pareto-optimal points: no other point has a lower fallback rate and at least the same accuracy."""
+    best, out = -1.0, []
+    for p in sorted(points, key=lambda p: (p["fallback_rate"], -p["accuracy"])):
+        if p["accuracy"] > best + 1e-12:
+            out.append(p)
+            best = p["accuracy"]
+    return out
+
+def _llm_correct(c: Dict[str, np.ndarray], llm_accuracy: float, llm_labels: Optional[str]) -> np.ndarray:
+    out = np.full(len(c["int_labels"]), llm_accuracy, dtype=np.float64)
+    if llm_labels:
+        import pandas as pd
+        df = pd.read_csv(llm_labels)
+        ans = dict(zip(df["text"].astype(str), df["intent"].astype(str)))
+        for i, (t, g) in enumerate(zip(c["texts"].tolist(), c["int_labels"].tolist())):
+            if t in ans:
+                out[i] = float(ans[t] == g)
+    return out
+
+def _current(points: List[Dict[str, Any]], **params) -> Optional[Dict[str, Any]]:
+    near = [p for p in points if all(abs(p[k] - v) < 1e-6 for k, v in params.items())]
+    return near[0] if near else None
+
+def main(argv=None) -> Dict[str, Any]:
+    ap = argparse.ArgumentParser(description="Accuracy vs LLM-fallback frontier for ALPHA_EMO, k and THRESHOLD")
+    ap.add_argument("--data", default="intent_dataset_450.csv", help="CSV with text, intent (and optionally emotion)")
+    ap.add_argument("--cache", default=CACHE_PATH)
+    ap.add_argument("--max-k", type=int, default=MAX_K)
+    ap.add_argument("--max-emotion-rows", type=int, default=2000, help="memory rows sampled as emotion queries")
+    ap.add_argument("--llm-accuracy", type=float, default=0.9, help="assumed accuracy of LLM-routed rows")
+    ap.add_argument("--llm-labels", default=None, help="CSV text,intent of LLM answers (dataset label set)")
+    ap.add_argument("--llm-ms", type=float, default=300.0, help="LLM latency used for the expected cost column")
+    ap.add_argument("--budget", type=float, default=None, help="max fallback rate for the recommendation")
+    ap.add_argument("--out", default="tune_report.json")
+    args = ap.parse_args(argv)
+    os.environ.setdefault("MEM_AUTO_STORE", "0")
+
+    import cascade, router
+    t0 = time.perf_counter()
+    c = build(args.data, args.max_k, args.max_emotion_rows, args.cache)
+    t1 = time.perf_counter()
+    intent = eval_intent(c, _llm_correct(c, args.llm_accuracy, args.llm_labels))
+    emotion = eval_emotion(c)
+    t2 = time.perf_counter()
+
+    report: Dict[str, Any] = {
+        "data": args.data, "rows": int(len(c["int_labels"])), "emotion_rows": int(len(c["emo_gold"])),
+        "llm_accuracy_assumed": None if args.llm_labels else args.llm_accuracy,
+        "seconds": {"build_or_load": t1 - t0, "grid": t2 - t1},
+        "grid_points": {"legacy": len(intent["legacy"]), "cascade": len(intent["cascade"]), "emotion": len(emotion)},
+        "current": {
+            "legacy": _current(intent["legacy"], k=1, threshold=router.THRESHOLD),
+            "cascade": _current(intent["cascade"], k=cascade.INTENT_K, threshold=router.THRESHOLD,
+                                intent_min=cascade.INTENT_MIN, vote_temp=cascade.VOTE_TEMP),
+            "emotion": _current(emotion, alpha_emo=router.ALPHA_EMO, mem_k=5),
+        },
+        "frontier": {},
+        "emotion_best": max(emotion, key=lambda p: p["accuracy"]) if emotion else None,
+    }
+    for mode, pts in intent.items():
+        for p in pts:
+            p["llm_ms_per_text"] = p["fallback_rate"] * args.llm_ms
+        report["frontier"][mode] = frontier(pts)
+        if args.budget is not None:
+            ok = [p for p in pts if p["fallback_rate"] <= args.budget]
+            report.setdefault("recommended", {})[mode] = max(ok, key=lambda p: p["accuracy"]) if ok else None
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    for mode, pts in report["frontier"].items():
+        print(f"{mode} frontier ({len(pts)} points): fallback_rate -> accuracy")
+        for p in pts:
+            params = ", ".join(f"{k}={v}" for k, v in p.items() if k not in ("accuracy", "fallback_rate", "llm_ms_per_text"))
+            print(f"  {p['fallback_rate']:.3f} -> {p['accuracy']:.3f}   {params}")
+    print(f"wrote {args.out}")
+    return report
+
+if __name__ == "__main__":
+    main()
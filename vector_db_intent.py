@@ -1,21 +1,18 @@
-import pandas as pd
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
+# Build / update the intent FAISS index from the labelled CSV.
+#   python vector_db_intent.py                         # incremental: only new/changed rows are encoded
+#   python vector_db_intent.py --rebuild               # fresh IndexIDMap (embeddings still cached)
+#   python vector_db_intent.py --csv other.csv
+#   python vector_db_intent.py --partition hotel-42 --csv hotel42.csv   # one property's own index
+# A running API picks the result up via POST /admin/intent_index/reload[?partition=...]
+# (with ADMIN_TOKEN set on the server and sent as X-Admin-Token).
+import argparse
+from intent_index import sync, store_path
 
-# --- Step 1: Load your CSV ---
-df = pd.read_csv("intent_dataset_450.csv")  # Use your filename
-
-# --- Step 2: Compute embeddings ---
-model = SentenceTransformer("all-MiniLM-L6-v2")
-embeddings = model.encode(df["text"].tolist(), show_progress_bar=True)
-
-# --- Step 3: Initialise FAISS index and add embeddings ---
-embeddings = np.array(embeddings).astype("float32")
-faiss_index = faiss.IndexFlatL2(embeddings.shape[1])
-faiss_index.add(embeddings)
-
-# --- Step 4: Save index and metadata for later inference use ---
-faiss.write_index(faiss_index, "intent_faiss.index")
-df["text"].to_csv("intent_texts.csv", index=False)
-df["intent"].to_csv("intent_labels.csv", index=False)
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv", default="intent_dataset_450.csv")
+    ap.add_argument("--rebuild", action="store_true")
+    ap.add_argument("--partition", default=None)
+    args = ap.parse_args()
+    stats = sync(args.csv, rebuild=args.rebuild, partition=args.partition)
+    print(f"{store_path(args.partition)}: {stats}")
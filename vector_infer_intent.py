@@ -1,28 +1,49 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
+import embeddings
+from intent_index import get_intent_index
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
-faiss_index = faiss.read_index("intent_faiss.index")
+def __getattr__(name):
+    # model / faiss_index / texts / labels keep working but load on first access
+    if name == "model":
+        return embeddings.get_model()  # shared all-MiniLM-L6-v2
+    if name == "faiss_index":
+        return get_intent_index().index
+    if name in ("texts", "labels"):
+        return getattr(get_intent_index(), name)
+    raise AttributeError(name)
 
-with open("intent_texts.csv", "r", encoding="utf-8") as f:
-    texts = [l.strip() for l in f.readlines()[1:]]  # Skip header
-with open("intent_labels.csv", "r", encoding="utf-8") as f:
-    labels = [l.strip() for l in f.readlines()[1:]]
-
-def predict_intent_knn(sentence, k=1):
-    emb = model.encode([sentence]).astype("float32")
-    D, I = faiss_index.search(emb, k)
+def _vote(db, D_row, rows):
     votes = {}
-    for idx in I[0]:
-        intent = labels[idx]
+    for r in rows:
+        intent = db.labels[r]
         votes[intent] = votes.get(intent, 0) + 1
     pred = max(votes, key=votes.get)
-    return pred, [labels[i] for i in I[0]], [texts[i] for i in I[0]], D[0][0]
+    return pred, [db.labels[r] for r in rows], [db.texts[r] for r in rows], D_row[0]
+
+def predict_intent_knn(sentence, k=1, emb=None):
+    # emb: precomputed raw (unnormalized) vector from embeddings.embed
+    emb = embeddings.embed_batch([sentence])[0] if emb is None else np.asarray(emb, dtype="float32").reshape(1, -1)
+    db = get_intent_index()  # one snapshot per call, so a swap mid-request is harmless
+    D, rows = db.search(emb, k)
+    return _vote(db, D[0], rows[0])
+
+def predict_intent_knn_batch(sentences, k=1, embs=None):
+    # one encode + one (n, d) search for the whole list
+    emb = embeddings.embed_batch(list(sentences))[0] if embs is None else np.asarray(embs, dtype="float32")
+    db = get_intent_index()
+    D, rows = db.search(emb, k)
+    return [_vote(db, D[j], rows[j]) for j in range(len(sentences))]
+
+def intent_neighbours_batch(sentences, k=5, embs=None):
+    # (labels, distances) of the k nearest dataset rows per sentence, for confidence calibration
+    emb = embeddings.embed_batch(list(sentences))[0] if embs is None else np.asarray(embs, dtype="float32")
+    db = get_intent_index()
+    D, rows = db.search(emb, k)
+    return [([db.labels[r] for r in rows[j]], D[j]) for j in range(len(sentences))]
 
 # Example usage
 if __name__ == "__main__":
     query = "Can you call me a cab to the airport?"
-    pred, neighbors, sents = predict_intent_knn(query)
+    pred, neighbors, sents, _ = predict_intent_knn(query)
     print(f"PREDICTED INTENT: {pred}")
     print("Top neighbors/labels:", list(zip(neighbors, sents)))